@@ -31,9 +31,12 @@
 """
 
 from PyQt5 import Qt, QtCore
+from PIL import Image
 import numpy as np
 import struct
+import bisect
 import sys
+import io
 import gc
 
 IS_PYTHON_3 = (sys.version_info[0] > 2)
@@ -54,6 +57,8 @@ EXIF = 34665
 CR2Slice = 50752
 ExposureTime = 33434
 Makernote = 37500
+JpegIFOffset = 513
+JpegIFByteCount = 514
 
 CameraSettings = 0x0001
 FocusInfo = 0x0002
@@ -69,25 +74,44 @@ StartOfScanMarker = b'\xff\xda'
 StartOfImageMarker = b'\xff\xd8'
 EndOfImageMarker = b'\xff\xd9'
 
+# NOTE: the data read at once from the beginning of the file, they
+#       usually contain all the IFDs, the EXIF and the makernotes
+HEADER_READ_SIZE = 64*1024
+
+# numpy types of the TIFF tags, rationals are pairs of integers
+TIFF_DTYPES = {1: 'u1',   # byte
+               2: 'S1',   # ascii
+               3: 'u2',   # short
+               4: 'u4',   # long
+               5: 'u4',   # rational
+               6: 'i1',   # signed byte
+               7: 'u1',   # undefined
+               8: 'i2',   # signed short
+               9: 'i4',   # signed long
+               10: 'i4',  # signed rational
+               11: 'f4',  # float
+               12: 'f8'}  # double
+
 MAX_HUFFMAN_BITS = 16
-MIN_BUFFER_LEN = 2*MAX_HUFFMAN_BITS
 
-decodestring = '>'+'Q'*16  # 16 * 8 bytes
-tokenlen = struct.calcsize(decodestring)
-bittokenlen = tokenlen*8
+# a huffman code and its additional bits are never longer than this
+RESERVOIR_MIN_BITS = 2*MAX_HUFFMAN_BITS
 
+# rows between two checkpoints recorded during the decoding
+CHECKPOINT_INTERVAL = 64
 
-def ba2bs2(b):
-    m = map('{0:08b}'.format, b)
-    s = ''.join(m)
-    return s
+# columns of the left border near the image that are not used to
+# estimate the black level when the black mask is not known
+BLACK_MASK_MARGIN = 4
 
 
-def ba2bs(b):
-    d = struct.unpack(decodestring, b)
-    m = map('{0:064b}'.format, d)
-    s = ''.join(m)
-    return s
+def _getStreamWords(data):
+    """
+    Returns the compressed data as a list of big endian 64 bit
+    integers, padded with zeros at the end.
+    """
+    pad = (-len(data) % 8) + 16
+    return np.frombuffer(bytes(data) + b'\x00'*pad, dtype='>u8').tolist()
 
 
 def _reconstructData(byte_order, *bytesdata):
@@ -131,76 +155,33 @@ def _reconstructDataFromString(byte_order, bytesdata):
     return result
 
 
-def _getTypeSize(ind):
-
-    if ind == 1:     # byte
-        return 1
-    elif ind == 2:   # ascii
-        return -1
-    elif ind == 3:   # short
-        return 2
-    elif ind == 4:   # long
-        return 4
-    elif ind == 5:   # rational
-        return 8
-    elif ind == 6:   # signed byte
-        return 1
-    elif ind == 7:   # undefined
-        return -2
-    elif ind == 8:   # signed short
-        return 2
-    elif ind == 9:   # signed long
-        return 4
-    elif ind == 10:  # signed rational
-        return 8
-    elif ind == 11:  # float
-        return 4
-    elif ind == 12:  # double
-        return 8
-
-
-def _getExifValue(data, data_type):
-
-    if data_type == 1:
-        return np.ubyte(data)
-    elif data_type == 2:
-        return str(data)
-    elif data_type == 3:
-        return np.uint16(data)
-    elif data_type == 4:
-        return np.uint32(data)
-    elif data_type == 5:
-        n = np.uint32(0xffffffff & data)
-        d = np.uint32(((0xffffffff << 32) & data) >> 32)
-        if n == 0:
-            return 0
-        elif d == 0:
-            return "nan"
-        else:
-            return (n, d)
-    elif data_type == 6:
-        return np.byte(data)
-    elif data_type == 7:
-        return data
-    elif data_type == 8:
-        return np.int16(data)
-    elif data_type == 9:
-        return np.int32(data)
-    elif data_type == 10:
-        n = np.int32(0xffffffff & data)
-        d = np.int32(((0xffffffff << 32) & data) >> 32)
-        if n == 0:
-            return 0
-        elif d == 0:
-            return "nan"
-        else:
-            return (n, d)
-    elif data_type == 11:
-        return np.float32(data)
-    elif data_type == 12:
-        return np.float64(data)
+def _getTagValue(byteorder, tag_type, tag_num, data, pos):
+    """
+    Returns the value of a TIFF tag whose data start at data[pos].
+    """
+    dtype = np.dtype(TIFF_DTYPES[tag_type]).newbyteorder(
+        '<' if byteorder == b'II' else '>')
+
+    if tag_type == 2:
+        value = data[pos:pos+tag_num].rstrip(b'\x00')
+        return value.decode('latin-1')
+    elif tag_type in (5, 10):
+        values = np.frombuffer(data, dtype, 2*tag_num, pos)
+        result = []
+        for n, d in zip(values[0::2], values[1::2]):
+            if n == 0:
+                result.append(0)
+            elif d == 0:
+                result.append("nan")
+            else:
+                result.append((n, d))
     else:
-        return data
+        result = list(np.frombuffer(data, dtype, tag_num, pos).astype(
+            dtype.newbyteorder('=')))
+
+    if len(result) == 1:
+        return result[0]
+    return result
 
 
 def getPredictorValue(psv, px_left, px_top, px_topleft):
@@ -242,13 +223,113 @@ def getPredictorValue(psv, px_left, px_top, px_topleft):
     elif psv == 6:
         pred = px_top + ((px_left - px_topleft) >> 1)
     elif psv == 7:
-        pred = (px_top - px_left) >> 1
+        pred = (px_top + px_left) >> 1
     else:
         pred = 0
 
     return pred
 
 
+def reconstructLosslessJpeg(diffs, components, psv, bits, top=None):
+    """
+    Computes the pixel values of a lossless JPEG image from the
+    decoded differences. diffs is an int32 array with the shape of
+    the image as seen by the encoder, ie. with the components
+    interleaved along the rows.
+
+    When the rows do not start from the top of the image, top must
+    be the values of the first pixel of each component in the row
+    above diffs; this is supported only by the predictor 1.
+    """
+
+    # NOTE: as stated by (3), the first pixel of each component is
+    #       predicted by 2**(bits-1), the other pixels of the first
+    #       row by the left pixel, the first pixel of the other rows
+    #       by the top pixel and all the remaining ones by the
+    #       predictor selected by psv. All the arithmetic is modulo
+    #       2**16, that is preserved by the int32 overflow.
+
+    height, width = diffs.shape
+    diffs = diffs.reshape((height, width // components, components))
+    image = np.empty_like(diffs)
+
+    first = diffs[:, 0].cumsum(0, dtype=np.int32)
+    if top is None:
+        first += (1 << (bits - 1))
+    elif psv == 1:
+        first += np.asarray(top, dtype=np.int32)
+    else:
+        raise ValueError("unsupported predictor for partial decoding")
+    image[:, 0] = first
+
+    if psv == 1:
+        # this is the predictor used by Canon
+        np.cumsum(diffs[:, 1:], 1, dtype=np.int32, out=image[:, 1:])
+        image[:, 1:] += first[:, np.newaxis]
+        return image.reshape((height, width))
+
+    np.cumsum(diffs[0, 1:], 0, dtype=np.int32, out=image[0, 1:])
+    image[0, 1:] += first[0]
+    image[0] &= 0xffff
+
+    for row in xrange(1, height):
+        top = image[row - 1]
+        cur = diffs[row]
+
+        if psv == 2:
+            image[row, 1:] = top[1:] + cur[1:]
+        elif psv == 3:
+            image[row, 1:] = top[:-1] + cur[1:]
+        elif psv == 4 or psv == 5:
+            # the left pixel is added linearly, so these predictors
+            # can still be computed with a prefix sum
+            delta = top[1:] - top[:-1]
+            if psv == 5:
+                delta >>= 1
+            delta += cur[1:]
+            np.cumsum(delta, 0, dtype=np.int32, out=image[row, 1:])
+            image[row, 1:] += image[row, 0]
+        else:
+            crow = image[row]
+            for col in xrange(1, crow.shape[0]):
+                pred = getPredictorValue(psv, crow[col - 1],
+                                         top[col], top[col - 1])
+                crow[col] = (pred + cur[col]) & 0xffff
+
+        image[row] &= 0xffff
+
+    return image.reshape((height, width))
+
+
+def unshuffleSlices(data, slices_size):
+    """
+    Reorders the rows decoded from a CR2 image into its original
+    vertical slices, slices_size is the list of the slice widths.
+    """
+    height, width = data.shape
+    flattened = data.reshape(-1)
+    image = np.empty((height, width), dtype=np.uint16)
+
+    # all the slices but the last one have the same width and
+    # can be moved at once
+    count = len(slices_size) - 1
+    start = 0
+    if count > 0 and slices_size[:count] == [slices_size[0]] * count:
+        start = count * slices_size[0]
+        blocks = flattened[:height*start].reshape((count, height, -1))
+        dest = image[:, :start].reshape((height, count, -1))
+        dest[...] = blocks.transpose(1, 0, 2)
+        slices_size = slices_size[count:]
+
+    for s in slices_size:
+        end = start + s
+        image[:, start:end] = flattened[height*start:height*end].reshape(
+            (height, s))
+        start = end
+
+    return image
+
+
 class Sensor(object):
 
     def __init__(self, data=(0, 0, 0, 0, 0, 0, 0, 0,
@@ -284,6 +365,7 @@ class HuffmanTable(object):
     def __init__(self, data=None):
 
         self.codes = {}
+        self._luts = {}
 
         # bitmasks for faster computation
         self.masks = []
@@ -345,6 +427,27 @@ class HuffmanTable(object):
             s += "-----------------------------\n"
         return s
 
+    def getLookupTable(self, key=(0, 0)):
+        """
+        Returns a list of 2**MAX_HUFFMAN_BITS (code length, symbol)
+        tuples indexed by the next MAX_HUFFMAN_BITS bits of the data.
+        Entries that do not start with a valid code are (0, 0). If
+        the table key does not exist the first table is used.
+        """
+        if key not in self.codes:
+            key = sorted(self.codes.keys())[0]
+
+        if key not in self._luts:
+            lut = [(0, 0)] * (1 << MAX_HUFFMAN_BITS)
+            for code, sym in self.codes[key].items():
+                code_len = len(code)
+                start = int(code, 2) << (MAX_HUFFMAN_BITS - code_len)
+                end = start + (1 << (MAX_HUFFMAN_BITS - code_len))
+                lut[start:end] = [(code_len, sym)] * (end - start)
+            self._luts[key] = lut
+
+        return self._luts[key]
+
     def generateCodes(self, sym):
 
         branches = [['']]
@@ -555,10 +658,13 @@ class QCR2Image(QtCore.QObject):
         self.isOpened = False
         self._canceled = False
         self.__decoding_progress = 0
+        self._head = b''
+        self._makernotes = None
+        self.checkpoints = None
+        self.fp = None
 
         if fname is not None:
             self.filename = fname
-            self.fp = open(self.filename, 'rb')
             self.open()
 
     def __del__(self):
@@ -579,7 +685,54 @@ class QCR2Image(QtCore.QObject):
         rbord = self.Sensor.right_border - (self.Sensor.right_border % 2)
         return (lbord, bbord, rbord, tbord)
 
-    def load(self, fname=None, ifd=3):
+    def getBlackMaskColumns(self):
+        """
+        Returns the first and the last+1 columns of the optical black
+        pixels on the left side of the sensor or None if the sensor
+        has no masked columns.
+        """
+        lbord = int(self.getImageBorders()[0])
+        start = int(self.Sensor.black_mask_left_border)
+        end = int(self.Sensor.black_mask_right_border) + 1
+
+        if not (start >= 0 and start + 2 <= end <= lbord):
+            # NOTE: not all the cameras report the black mask, in this
+            #       case the left border is used except for the
+            #       columns near the image, that can be lit
+            start = 0
+            end = lbord - BLACK_MASK_MARGIN
+
+        if end - start < 2:
+            return None
+        return (start, end)
+
+    def getBlackLevels(self, uncropped):
+        """
+        Returns an array with the black level of each row of the
+        sensor, estimated separately for the even and the odd columns
+        as the median of the optical black pixels, or None if the
+        sensor has no masked columns.
+        """
+        columns = self.getBlackMaskColumns()
+        if columns is None:
+            return None
+
+        start, end = columns
+        levels = np.empty((uncropped.shape[0], 2), dtype=np.uint16)
+        for parity in (0, 1):
+            first = start + (parity - start) % 2
+            levels[:, parity] = np.round(
+                np.median(uncropped[:, first:end:2], axis=1))
+        return levels
+
+    def load(self, fname=None, ifd=3, subtract_black=False):
+        """
+        Returns the image stored in the IFD ifd: the raw image cropped
+        to the active area of the sensor for the IFD3 or the embedded
+        JPEG image for the IFD1. If subtract_black is True the black
+        level of each row, estimated from the masked pixels, is
+        subtracted from the raw image.
+        """
         if (not self.isOpened):
             if fname is None:
                 raise SyntaxError("unknown file name")
@@ -589,35 +742,8 @@ class QCR2Image(QtCore.QObject):
         if ifd == 3:
             uncropped = self.decodeRawImage()
 
-            border = self.getImageBorders()
-
-            bbord = border[1]
-            tbord = border[3]
-            lbord = border[0]
-            rbord = border[2]
-
-            #  +---------------------------------------------+ \
-            #  |                 TOP BORDER                  | |
-            #  |      _________________________________      | |
-            #  |  L  |    ^                            |  R  | S
-            #  |  E  |    |                            |  I  | E
-            #  |  F  |    H                            |  G  | N
-            #  |  T  |    E                            |  H  | S
-            #  |     |    I                            |  T  | O
-            #  |  B  |    G          IMAGE             |     | R
-            #  |  O  |    H                            |  B  |
-            #  |  R  |    T                            |  O  | H
-            #  |  D  |    |                            |  R  | E
-            #  |  E  |<---+----------WIDTH------------>|  D  | I
-            #  |  R  |    |                            |  E  | G
-            #  |     |____V____________________________|  R  | H
-            #  |                                             | T
-            #  |                BOTTOM BORDER                | |
-            #  +---------------------------------------------+ /
-            #  \----------------SENSOR WIDTH-----------------/
-
             if uncropped is not None:
-                image = uncropped[tbord:bbord, lbord:rbord].copy()
+                image = self._cropBorders(uncropped, subtract_black)
             else:
                 image = None
 
@@ -634,11 +760,15 @@ class QCR2Image(QtCore.QObject):
 
     def open(self):
 
-        # check header
-        if IS_PYTHON_3:
-            header = self.fp.read(0x0f)
-        else:
-            header = bytearray(self.fp.read(0x0f))
+        if self.fp is None or self.fp.closed:
+            self.fp = open(self.filename, 'rb')
+
+        # NOTE: only the beginning of the file is read here, the
+        #       makernotes are parsed when they are needed and the
+        #       raw data when the image is decoded
+        self.fp.seek(0, 0)
+        self._head = self.fp.read(HEADER_READ_SIZE)
+        header = self._head[0:0x10]
 
         byteorder = header[0:2]
         self.byteorder = byteorder
@@ -646,12 +776,16 @@ class QCR2Image(QtCore.QObject):
         # mode setting
         if byteorder == b'II':
             self.mode = "L;16"
+            endian = '<'
         elif byteorder == b'MM':
             self.mode = "L;16B"
+            endian = '>'
         else:
             raise SyntaxError("unknown endian format")
 
-        if (header[2:3] != b'*') or (header[8:10] != b'CR'):
+        if ((len(header) < 0x10) or
+                (struct.unpack_from(endian+'H', header, 2)[0] != 42) or
+                (header[8:10] != b'CR')):
             raise SyntaxError("not a CR2 image file")
 
         major_version = str(header[0x0a])  # should be 2
@@ -660,11 +794,12 @@ class QCR2Image(QtCore.QObject):
         # and this should be 2.0
         self.version = float(major_version + '.' + minor_version)
 
-        ifd0_offset = _reconstructDataFromString(byteorder, header[4:8])
-        ifd3_offset = _reconstructDataFromString(byteorder, header[12:16])
+        ifd0_offset = struct.unpack_from(endian+'I', header, 4)[0]
+        ifd3_offset = struct.unpack_from(endian+'I', header, 12)[0]
 
         # the IFD0 for sensor information
         self.IFD0 = self._readIfd(byteorder, ifd0_offset)
+        self._ifd0_offset = ifd0_offset
 
         if (EXIF not in self.IFD0.keys()):
             raise SyntaxError("not a CR2 image file")
@@ -676,9 +811,18 @@ class QCR2Image(QtCore.QObject):
         if (Makernote not in self.EXIF.keys()):
             raise SyntaxError("not a CR2 image file")
 
-        self.MAKERNOTES = self._readIfd(byteorder, self.EXIF[Makernote][2])
+        self._makernotes_offset = self.EXIF[Makernote][2]
+        self._makernotes = None
+
+        # only the sensor information are needed to open the image
+        sensor_info = self._readIfd(byteorder,
+                                    self._makernotes_offset,
+                                    (SensorInfo,))
 
-        self.Sensor = Sensor(self.MAKERNOTES[SensorInfo])
+        if SensorInfo not in sensor_info:
+            raise SyntaxError("not a CR2 image file")
+
+        self.Sensor = Sensor(sensor_info[SensorInfo])
 
         border = self.getImageBorders()
 
@@ -708,27 +852,207 @@ class QCR2Image(QtCore.QObject):
         self.isOpened = True
         self.opened.emit()
 
+    @property
+    def MAKERNOTES(self):
+        if self._makernotes is None:
+            self._makernotes = self._readIfd(self.byteorder,
+                                             self._makernotes_offset)
+        return self._makernotes
+
     def close(self):
-        del self.CR2SLICES
-        del self.IFD3
-        del self.IFD0
-        del self.Sensor
-        del self.MAKERNOTES
-        del self.EXIF
-        self.fp.close()
-        self.closed.emit()
-
-    def extractEmbeddedJpeg(self):
+        if self.isOpened:
+            del self.CR2SLICES
+            del self.IFD3
+            del self.IFD0
+            del self.Sensor
+            del self.EXIF
+            self._makernotes = None
+            self._head = b''
+            self.isOpened = False
+        if self.fp is not None:
+            self.fp.close()
+            self.closed.emit()
+
+    def getEmbeddedJpegData(self, full=True):
+        """
+        Returns the compressed data of the full size JPEG image stored
+        in the IFD0 or, if full is False, of the small thumbnail stored
+        in the IFD1. None is returned if the image is not present.
+        """
+        if full:
+            offset = self.IFD0.get(StripOffset)
+            size = self.IFD0.get(StripBytesCount)
+        else:
+            ifd1_offset = self._getNextIfdOffset(self._ifd0_offset)
+            if not ifd1_offset:
+                return None
+            ifd1 = self._readIfd(self.byteorder, ifd1_offset,
+                                 (JpegIFOffset, JpegIFByteCount))
+            offset = ifd1.get(JpegIFOffset)
+            size = ifd1.get(JpegIFByteCount)
+
+        if not offset or not size:
+            return None
+
+        data, pos = self._readData(int(offset), int(size))
+        data = data[pos:pos+int(size)]
+
+        if data[0:2] != StartOfImageMarker:
+            return None
+        return data
+
+    def extractEmbeddedJpeg(self, full=True):
+        """
+        Returns the RGB data of the JPEG image embedded by the camera,
+        see getEmbeddedJpegData.
+        """
         self._canceled = False
         self.decodingStarted.emit()
+
+        data = self.getEmbeddedJpegData(full)
+        if data is None:
+            image = None
+        else:
+            image = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
         self.decodingProgressChanged.emit(100)
         self.decodingEnded.emit()
-        pass  # TODO
+        return image
 
     def decodeRawImage(self):
         self._canceled = False
         self.decodingStarted.emit()
 
+        imdata, hts = self._readLosslessJpeg()
+
+        img = self._decompressLosslessJpeg(imdata, hts)
+
+        del imdata
+
+        return img
+
+    def loadRegions(self, boxes, checkpoints=None, subtract_black=False):
+        """
+        Decodes only the rows of the raw data that are needed by the
+        boxes (x0, y0, x1, y1), given in the coordinates of the image
+        returned by load(), and returns an image of the same size in
+        which the pixels outside the boxes are undefined.
+
+        checkpoints is the list recorded by a previous full decoding
+        (see the attribute checkpoints): the decoding of each group of
+        rows is started from the nearest checkpoint above it instead
+        of the beginning of the image. subtract_black has the same
+        meaning as in load().
+        """
+        if not self.isOpened:
+            self.open()
+
+        self._canceled = False
+        self.decodingStarted.emit()
+
+        imdata, hts = self._readLosslessJpeg()
+
+        # NOTE: the sizes are converted to python integers, numpy
+        #       integers would overflow in the computation of the
+        #       stream positions
+        components = int(hts[StartOfFrameMarker].components)
+        imagew = int(hts[StartOfFrameMarker].width) * components
+        imageh = int(hts[StartOfFrameMarker].height)
+        bits = hts[StartOfFrameMarker].bits
+        psv = hts[StartOfScanMarker].psv
+        slices_size = self._getSlicesSize(imagew)
+        lbord, bbord, rbord, tbord = [int(v) for v in
+                                      self.getImageBorders()]
+
+        columns = self.getBlackMaskColumns()
+        if subtract_black and columns is not None:
+            # the masked pixels of the same rows are needed too
+            boxes = list(boxes)
+            boxes += [(columns[0] - lbord, y0, columns[1] - lbord, y1)
+                      for x0, y0, x1, y1 in boxes]
+
+        # NOTE: the rows of the encoded image are not the rows of the
+        #       raw image when it is divided into slices, so for each
+        #       slice crossed by a box we mark the encoded rows that
+        #       hold the pixels of the box
+        needed = np.zeros(imageh, dtype=bool)
+        for x0, y0, x1, y1 in boxes:
+            x0 = min(max(int(x0) + lbord, 0), imagew)
+            x1 = min(max(int(x1) + lbord, 0), imagew)
+            y0 = min(max(int(y0) + tbord, 0), imageh)
+            y1 = min(max(int(y1) + tbord, 0), imageh)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            start = 0
+            for width in slices_size:
+                end = start + width
+                left = max(x0, start) - start
+                right = min(x1, end) - start
+                if left < right:
+                    first = imageh*start + y0*width + left
+                    last = imageh*start + (y1 - 1)*width + right - 1
+                    needed[first // imagew:last // imagew + 1] = True
+                start = end
+
+        rows = np.flatnonzero(needed)
+        if not len(rows):
+            runs = []
+        elif psv != 1:
+            # without checkpoints the decoding starts from the top
+            runs = [(0, rows[-1] + 1)]
+        else:
+            breaks = np.flatnonzero(np.diff(rows) > 1)
+            runs = zip(rows[np.r_[0, breaks + 1]],
+                       rows[np.r_[breaks, len(rows) - 1]] + 1)
+
+        points = {}
+        if psv == 1:
+            for point in (checkpoints or []):
+                if 0 < point[0] < imageh and len(point) == 2 + components:
+                    points[point[0]] = (point[1], point[2:])
+        starts = sorted(points.keys())
+
+        words = _getStreamWords(imdata)
+        del imdata
+
+        col_luts = self._getColumnTables(hts, imagew)
+        decoded = np.zeros((imageh, imagew), dtype=np.uint16)
+
+        # the decoding continues from the end of the previous group of
+        # rows when no checkpoint is closer to the next one
+        row, bitpos, top = 0, 0, None
+        for run_start, run_end in runs:
+            index = bisect.bisect_right(starts, run_start) - 1
+            if index >= 0 and starts[index] > row:
+                row = starts[index]
+                bitpos, top = points[row]
+
+            diffs = np.empty((run_end - row, imagew), dtype=np.int32)
+            bitpos = self._decodeHuffmanRows(words, col_luts, diffs,
+                                             bitpos, row, imageh)
+            if bitpos is None:
+                return None
+
+            part = reconstructLosslessJpeg(diffs, components, psv,
+                                           bits, top)
+            decoded[row:run_end] = part
+            row = run_end
+            top = part[-1, :components].tolist()
+            del diffs, part
+
+        image = self._cropBorders(unshuffleSlices(decoded, slices_size),
+                                  subtract_black)
+        del decoded
+
+        self.decodingProgressChanged.emit(100)
+        self.decodingEnded.emit()
+        return image
+
+    def _readLosslessJpeg(self):
+        """
+        Reads the lossless JPEG image and returns its entropy coded
+        data, without stuffed bytes, and its tables.
+        """
         self.fp.seek(self.CR2SLICES[0], 0)
         if IS_PYTHON_3:
             rawdata = self.fp.read(self.CR2SLICES[2])
@@ -780,11 +1104,73 @@ class QCR2Image(QtCore.QObject):
 
         del rawdata
 
-        img = self._decompressLosslessJpeg(imdata, hts)
+        return imdata, hts
 
-        del imdata
+    def _getSlicesSize(self, imagew):
+        if self.CR2SLICES[1] == 0:
+            return [int(imagew)]
+        slices_size = []
+        for i in range(self.CR2SLICES[1]):
+            slices_size.append(int(self.CR2SLICES[3]))
+        slices_size.append(int(self.CR2SLICES[4]))
+        return slices_size
+
+    def _getColumnTables(self, hts, imagew):
+        # each component is encoded using the DC table declared for
+        # it in the ScanTable, using a list of tables indexed by
+        # column is faster than computing the component of each pixel
+        components = hts[StartOfFrameMarker].components
+        luts = []
+        scan_props = hts[StartOfScanMarker].componentsPropetries
+        for c in range(components):
+            try:
+                index = scan_props[c]['DC']
+            except KeyError:
+                index = 0
+            luts.append(hts[DhtMarker].getLookupTable((index, 0)))
+        return [luts[col % components] for col in xrange(imagew)]
+
+    def _cropBorders(self, uncropped, subtract_black=False):
+        border = self.getImageBorders()
 
-        return img
+        bbord = border[1]
+        tbord = border[3]
+        lbord = border[0]
+        rbord = border[2]
+
+        #  +---------------------------------------------+ \
+        #  |                 TOP BORDER                  | |
+        #  |      _________________________________      | |
+        #  |  L  |    ^                            |  R  | S
+        #  |  E  |    |                            |  I  | E
+        #  |  F  |    H                            |  G  | N
+        #  |  T  |    E                            |  H  | S
+        #  |     |    I                            |  T  | O
+        #  |  B  |    G          IMAGE             |     | R
+        #  |  O  |    H                            |  B  |
+        #  |  R  |    T                            |  O  | H
+        #  |  D  |    |                            |  R  | E
+        #  |  E  |<---+----------WIDTH------------>|  D  | I
+        #  |  R  |    |                            |  E  | G
+        #  |     |____V____________________________|  R  | H
+        #  |                                             | T
+        #  |                BOTTOM BORDER                | |
+        #  +---------------------------------------------+ /
+        #  \----------------SENSOR WIDTH-----------------/
+
+        image = uncropped[tbord:bbord, lbord:rbord].copy()
+
+        if subtract_black:
+            levels = self.getBlackLevels(uncropped)
+            if levels is not None:
+                # NOTE: lbord is even, so the columns of the image have
+                #       the same parity of the ones of the sensor
+                levels = levels[tbord:bbord]
+                for parity in (0, 1):
+                    cols = image[:, parity::2]
+                    cols -= np.minimum(cols, levels[:, parity, np.newaxis])
+
+        return image
 
     def _decompressLosslessJpeg(self, data, hts):
 
@@ -799,66 +1185,11 @@ class QCR2Image(QtCore.QObject):
             print("Warning: probably corrupted data!")
 
         # some usefull constants and variables
-        dataend = len(data)
-        buff = ba2bs(data[0:tokenlen])
-        lenbuff = len(buff)
-        datapos = tokenlen
-        dataleft = dataend-tokenlen
-        half_max_val = (1 << (hts[StartOfFrameMarker].bits - 1))
-        predictor = [half_max_val] * components
+        bits = hts[StartOfFrameMarker].bits
         psv = hts[StartOfScanMarker].psv
 
         # computing the size of slices
-        if self.CR2SLICES[1] == 0:
-            slices_size = self.imagew
-        else:
-            slices_size = []
-            for i in range(self.CR2SLICES[1]):
-                slices_size.append(self.CR2SLICES[3])
-            slices_size.append(self.CR2SLICES[4])
-
-        # NOTE: For some unknown reason the code runs much more faster
-        #       using python2 instead of python3, probably because
-        #       python3 does more checks during execution.
-
-        # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< #
-        # NOTE: most of the folloding section is needed to speedup
-        #       the decompression process because accessing a local
-        #       list or rictionary is faster then accessing class
-        #       elements or using the len() function.
-
-        masks = hts[DhtMarker].masks[:]
-        codes = hts[DhtMarker].codes[0, 0]
-        same_tables = True
-
-        for c in hts[DhtMarker].codes.values():
-            same_tables &= (c == codes)
-
-        # If the tables are equal, then switching between them
-        # is only a waste of time and only one table will be used
-        if same_tables:
-            kdic = sorted(codes.keys())
-            keys_len = {}
-            for k in kdic:
-                keys_len[k] = len(k)
-        else:
-            i = 0
-            keys_lens = {}
-            kdics = {}
-            codes = hts[DhtMarker].codes
-            indexes = list(codes.keys())
-            num_of_indexes = len(indexes)
-
-            # Sorting keys for a faster research
-            for c in indexes:
-                kdics[c] = sorted(codes[c].keys())
-                keys_lens[c] = {}
-                for k in kdics[c]:
-                    keys_lens[c][k] = len(k)
-
-            kdic = kdics[indexes[0]]
-            keys_len = keys_lens[indexes[0]]
-        # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< #
+        slices_size = self._getSlicesSize(imagew)
 
         """
         As written in CR2 specifications(1), the image is divided into
@@ -939,241 +1270,208 @@ class QCR2Image(QtCore.QObject):
         seen by the huffman encoder of the camera. To obtain the actual
         RAW image the data must be reshaped into vertical slices.
         """
-        image = []
-        rows = xrange(imageh)
-        cols = xrange(imagew)
 
-        _update_val = int(imageh / 100.0)
+        words = _getStreamWords(data)
+        col_luts = self._getColumnTables(hts, imagew)
+
+        # NOTE: the decoding is done in two steps: first the huffman
+        #       decoded differences are stored into an array and then
+        #       the pixel values are computed all at once by
+        #       reconstructLosslessJpeg()
+        diffs = np.empty((imageh, imagew), dtype=np.int32)
+
+        marks = []
+        if self._decodeHuffmanRows(words, col_luts, diffs, 0, 0, imageh,
+                                   marks) is None:
+            return None
+
+        decoded = reconstructLosslessJpeg(diffs, components, psv, bits)
+        del diffs
+
+        # NOTE: a checkpoint holds the position in the stream of the
+        #       first bit of a row and the values of the first pixel
+        #       of each component of the row above, that are all the
+        #       predictor 1 needs to decode the image from that row
+        if psv == 1:
+            self.checkpoints = [[row, bitpos] +
+                                decoded[row - 1, :components].tolist()
+                                for row, bitpos in marks if row > 0]
+        else:
+            self.checkpoints = []
 
-        # Decoding data row by row
+        # Now we reorder the decoded image into the original slices
+        image = unshuffleSlices(decoded, slices_size)
+        del decoded
 
-        if same_tables:
+        self.decodingProgressChanged.emit(100)
+        self.decodingEnded.emit()
+        return image
 
-            # NOTE: This IF statement shuold be inside the
-            # 'for key in kdic' statement but even a simple
-            # IF repeated rows*cols*X times can slow down the
-            # code execution. So it is faster to repeat the
-            # whole FOR ... FOR block, even if it is not so cool...
+    def _decodeHuffmanRows(self, words, col_luts, out, bitpos,
+                           first_row=0, total_rows=None, marks=None):
+        """
+        Decodes the differences of the rows of out starting from the
+        bit bitpos of the stream and returns the position of the bit
+        following the last row, or None if the decoding is canceled.
 
-            for row in rows:
+        first_row is the index of the first row in the image and, if
+        marks is a list, the pairs (row, bitpos) of the rows that are
+        multiple of CHECKPOINT_INTERVAL are appended to it.
+        """
+
+        # NOTE: the compressed stream is read 64 bits at time into an
+        #       integer bit reservoir that always holds at least
+        #       RESERVOIR_MIN_BITS bits, enough for the longest huffman
+        #       code and its additional bits. The next MAX_HUFFMAN_BITS
+        #       bits of the reservoir are used as index of a lookup
+        #       table that gives both the length of the code and the
+        #       decoded symbol, so no bit-by-bit search is needed.
+
+        wpos = bitpos >> 6
+        bitbuf = 0
+        nbits = 0
+        if bitpos & 63:
+            bitbuf = words[wpos]
+            nbits = 64 - (bitpos & 63)
+            wpos += 1
+        peek_mask = (1 << MAX_HUFFMAN_BITS) - 1
+        masks = [(1 << i) - 1 for i in range(MAX_HUFFMAN_BITS + 1)]
+        halves = [(1 << i) >> 1 for i in range(MAX_HUFFMAN_BITS + 1)]
+        left_masks = [(1 << i) - 1 for i in range(RESERVOIR_MIN_BITS)]
+
+        nrows = out.shape[0]
+        total_rows = total_rows or (first_row + nrows)
+        cols = xrange(out.shape[1])
+
+        _update_val = max(int(nrows / 100.0), 1)
+
+        # NOTE: there is no QApplication when decoding is done by
+        #       the worker processes of ingest.BatchDecoder
+        app = Qt.QApplication.instance()
+
+        # Decoding data row by row
+        try:
+            for row in xrange(nrows):
 
                 # using list and converting to ndarray later
                 # is much faster then using ndarray directly!
                 crow = []
 
                 if not row % _update_val:
-                    self.__decoding_progress = int(row * 100.0 / imageh)
+                    self.__decoding_progress = int(
+                        (first_row + row) * 100.0 / total_rows)
                     self.decodingProgressChanged.emit(self.__decoding_progress)
-                    Qt.QApplication.instance().processEvents()
+                    if app is not None:
+                        app.processEvents()
 
                     if self._canceled:
                         self._canceled = False
                         return None
 
+                if (marks is not None and
+                        not (first_row + row) % CHECKPOINT_INTERVAL):
+                    marks.append((first_row + row, wpos*64 - nbits))
+
                 for col in cols:
 
-                    if (lenbuff < MIN_BUFFER_LEN):
-                        if datapos <= dataleft:
-                            buff += ba2bs(data[datapos:datapos+tokenlen])
-                            lenbuff += bittokenlen
-                            datapos += tokenlen
-                        elif datapos < dataend:
-                            buff += ba2bs2(data[datapos:])
-                            lenbuff = len(buff)
-                            datapos = dataend
-
-                    for key in kdic:
-                        off = keys_len[key]
-                        if key == buff[0:off]:
-
-                            dlen = codes[key]
-                            shift = off+dlen
-
-                            if dlen:
-                                sbin = buff[off:shift]
-                                # DC additional bits to integer value
-                                if sbin[0] == '0':
-                                    val = -(int(sbin, 2) ^ masks[dlen])
-                                else:
-                                    val = int(sbin, 2)
-                            else:
-                                val = 0
-
-                            if col < components:
-                                pred = predictor[col]
-                                predictor[col] += val
-                            else:
-
-                                try:
-                                    pxl = crow[-components]
-                                except:
-                                    pxl = 0
-
-                                try:
-                                    pxt = image[-1][col]
-                                except:
-                                    pxt = 0
-
-                                try:
-                                    pxtl = image[-1][col-components]
-                                except:
-                                    pxtl = 0
-
-                                pred = getPredictorValue(psv, pxl, pxt, pxtl)
-
-                            crow.append(val+pred)
-                            buff = buff[shift:]
-                            lenbuff -= shift
-                            break
-
-                # This type of check is faster then checking for
-                # the correct reading of each huffman key, even
-                # if it uses the len() function
-                if len(crow) != imagew:
-                    raise IOError("Corrupted or invalid CR2 data!")
-
-                image.append(crow)
-        else:
-            for row in rows:
+                    if nbits < RESERVOIR_MIN_BITS:
+                        bitbuf = ((bitbuf & left_masks[nbits]) << 64 |
+                                  words[wpos])
+                        wpos += 1
+                        nbits += 64
 
-                # using list and converting to ndarray later
-                # is much faster then using ndarray directly!
-                crow = []
+                    peek = (bitbuf >> (nbits - MAX_HUFFMAN_BITS)) & peek_mask
+                    code_len, dlen = col_luts[col][peek]
 
-                if not row % _update_val:
-                    self.__decoding_progress = int(row * 100.0 / imageh)
-                    self.decodingProgressChanged.emit(self.__decoding_progress)
-                    Qt.QApplication.instance().processEvents()
+                    if not code_len:
+                        raise IOError("Corrupted or invalid CR2 data!")
 
-                    if self._canceled:
-                        self._canceled = False
-                        return None
+                    nbits -= code_len
 
-                for col in cols:
+                    if not dlen:
+                        crow.append(0)
+                    elif dlen == MAX_HUFFMAN_BITS:
+                        # no additional bits are used in this case
+                        crow.append(32768)
+                    else:
+                        # DC additional bits to integer value
+                        nbits -= dlen
+                        val = (bitbuf >> nbits) & masks[dlen]
+                        if val < halves[dlen]:
+                            val -= masks[dlen]
+                        crow.append(val)
 
-                    if (lenbuff < MIN_BUFFER_LEN):
-                        if datapos <= dataleft:
-                            buff += ba2bs(data[datapos:datapos+tokenlen])
-                            lenbuff += bittokenlen
-                            datapos += tokenlen
-                        elif datapos < dataend:
-                            buff += ba2bs2(data[datapos:])
-                            lenbuff = len(buff)
-                            datapos = dataend
-
-                    for key in kdic:
-                        off = keys_len[key]
-                        if key == buff[0:off]:
-
-                            i += 1
-                            idx = indexes[i % num_of_indexes]
-                            dlen = codes[idx][key]
-                            kdic = kdics[idx]
-                            keys_len = keys_lens[idx]
-                            shift = off + dlen
-
-                            if dlen:
-                                sbin = buff[off:shift]
-
-                                # DC additional bits to integer value
-                                if sbin[0] == '0':
-                                    val = -(int(sbin, 2) ^ masks[dlen])
-                                else:
-                                    val = int(sbin, 2)
-                            else:
-                                val = 0
-
-                            if col < components:
-                                pred = predictor[col]
-                                predictor[col] += val
-                            else:
-
-                                try:
-                                    pxl = crow[-components]
-                                except:
-                                    pxl = 0
-
-                                try:
-                                    pxt = image[-1][col]
-                                except:
-                                    pxt = 0
-
-                                try:
-                                    pxtl = image[-1][col-components]
-                                except:
-                                    pxtl = 0
-
-                                pred = getPredictorValue(psv, pxl, pxt, pxtl)
-
-                            crow.append(val + pred)
-                            buff = buff[shift:]
-                            lenbuff -= shift
-                            break
-
-                # This type of check is faster then checking for
-                # the correct reading of each huffman key, even
-                # if it uses the len() function
-                if len(crow) != imagew:
-                    raise IOError("Corrupted or invalid CR2 data!")
-
-                image.append(crow)
+                out[row] = crow
+        except IndexError:
+            # the end of the stream has been reached too early
+            raise IOError("Corrupted or invalid CR2 data!")
 
-        # Now we reorder the decoded image into the original slices
-        flattened = np.array(image, dtype=np.uint).flatten('C')
-        image = np.empty((imageh, imagew), dtype=np.uint16)
-        start = 0
-        end = 0
-
-        for s in slices_size:
-            end += s
-            flatarr = np.array(flattened[imageh*start:imageh*end])
-            image[:, start:end] = flatarr.reshape((imageh, s))
-            start += s
-            del flatarr
-
-        del flattened
-        self.decodingProgressChanged.emit(100)
-        self.decodingEnded.emit()
-        return image
+        return wpos*64 - nbits
 
-    def _readIfd(self, byteorder, offset):
+    def _readData(self, offset, size):
+        """
+        Returns a buffer and the position in it of the data
+        at the given offset of the file.
+        """
+        if offset + size <= len(self._head):
+            return self._head, offset
         self.fp.seek(offset, 0)
-        raw_ifd = self.fp.read(2)
+        data = self.fp.read(size)
+        if len(data) < size:
+            raise SyntaxError("truncated CR2 file")
+        return data, 0
+
+    def _getNextIfdOffset(self, offset):
+        endian = '<' if self.byteorder == b'II' else '>'
+        data, pos = self._readData(offset, 2)
+        count = struct.unpack_from(endian+'H', data, pos)[0]
+        data, pos = self._readData(offset+2+12*count, 4)
+        return struct.unpack_from(endian+'I', data, pos)[0]
+
+    def _readIfd(self, byteorder, offset, tags=None):
+        """
+        Returns a dictionary with the values of the tags of an IFD,
+        if tags is not None only the given tags are decoded.
+        """
+        endian = '<' if byteorder == b'II' else '>'
+
+        data, pos = self._readData(offset, 2)
+        count = struct.unpack_from(endian+'H', data, pos)[0]
+        data, pos = self._readData(offset+2, 12*count)
 
         # create IFD tags dictionary
-        tags = {}
-
-        for i in range(_reconstructDataFromString(byteorder, raw_ifd)):
-            data = self.fp.read(12)
-            tagID = _reconstructDataFromString(byteorder, data[:2])
-            tagType = _reconstructDataFromString(byteorder, data[2:4])
-            tagNum = _reconstructDataFromString(byteorder, data[4:8])
-            tagValOff = _reconstructDataFromString(byteorder, data[8:12])
-
-            if (tagNum > 1) or (_getTypeSize(tagType) > 4):
-                fppos = self.fp.tell()
-                self.fp.seek(tagValOff, 0)
-                datasize = _getTypeSize(tagType)
-                if datasize == -1:
-                    val = _getExifValue(self.fp.read(tagNum), tagType)
-                elif datasize == -2:
-                    tagVal = _getExifValue(tagValOff, tagType)
-                    val = ('undefined', tagNum, tagVal)
-                else:
-                    val = []
-                    for i in range(tagNum):
-                        data = self.fp.read(datasize)
-                        data_off = _reconstructDataFromString(byteorder, data)
-                        tagVal = _getExifValue(data_off, tagType)
-                        val.append(tagVal)
-                self.fp.seek(fppos, 0)
+        tags_dict = {}
+
+        for entry in xrange(pos, pos + 12*count, 12):
+            tagID, tagType, tagNum = struct.unpack_from(endian+'HHI',
+                                                        data, entry)
+
+            if tags is not None and tagID not in tags:
+                continue
+
+            if tagType not in TIFF_DTYPES:
+                # unknown type: only the raw value can be returned
+                val = struct.unpack_from(endian+'I', data, entry+8)[0]
+            elif tagType == 7 and tagNum > 1:
+                tagValOff = struct.unpack_from(endian+'I', data, entry+8)[0]
+                val = ('undefined', tagNum, tagValOff)
             else:
-                val = _getExifValue(tagValOff, tagType)
-            if (type(val) == tuple) or (type(val) == list):
-                if len(val) == 1:
-                    val = val[0]
-            tags[tagID] = val
-        return tags
+                size = np.dtype(TIFF_DTYPES[tagType]).itemsize * tagNum
+                if tagType in (5, 10):
+                    size *= 2
+
+                if size > 4:
+                    tagValOff = struct.unpack_from(endian+'I',
+                                                   data, entry+8)[0]
+                    val_data, val_pos = self._readData(tagValOff, size)
+                else:
+                    val_data, val_pos = data, entry+8
+
+                val = _getTagValue(byteorder, tagType, tagNum,
+                                   val_data, val_pos)
+
+            tags_dict[tagID] = val
+        return tags_dict
 
 
 def imread(fname):
@@ -0,0 +1,444 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# On-disk cache of decoded image data
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import concurrent.futures
+
+import numpy as np
+
+from . import log
+from . import paths
+
+INDEX_FILE = 'index.json'
+HASH_BLOCK_SIZE = 64*1024
+DEFAULT_MAX_SIZE = 4*1024*1024*1024  # bytes
+
+# maximum number of files whose decoding checkpoints are kept
+MAX_CHECKPOINTS = 4096
+
+# file types cached by default, decoding them is much slower than
+# reading the decoded data back from the disk
+DEFAULT_FORMATS = ('CR2',)
+
+
+def normalizeData(data):
+    """
+    Returns the data converted to the type used to store them or None
+    if they cannot be cached.
+    """
+    data = np.asarray(data)
+
+    if data.dtype.kind in 'biu' and data.dtype.itemsize <= 2:
+        # 8 and 16 bit data are stored as they are, so that loading
+        # them from the cache does not change their type
+        return data
+    elif data.dtype.kind in 'biu':
+        int_data = data
+    elif data.dtype.kind == 'f':
+        int_data = data.astype(np.uint16)
+        if not np.array_equal(int_data, data):
+            int_data = None
+    else:
+        return None
+
+    if (int_data is not None and data.size > 0 and
+            int_data.min() >= 0 and int_data.max() <= 65535):
+        return int_data.astype(np.uint16)
+    else:
+        return data.astype(np.float32)
+
+
+def writeData(root, data):
+    """
+    Writes the data to a new file in the cache directory root and
+    returns its name, the file is not added to any index. This can
+    be safely called from other processes.
+    """
+    data = normalizeData(data)
+    if data is None:
+        return None
+
+    fd, fname = tempfile.mkstemp(suffix='.npy', dir=root)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, data)
+    except Exception:
+        os.remove(fname)
+        raise
+    return os.path.basename(fname)
+
+
+class DecodeCache(object):
+
+    """
+    Cache of decoded images stored as .npy files in a cache directory.
+
+    Entries are keyed by a hash of the size, the mtime and the first and
+    last blocks of the source file, so the cache does not depend on
+    the location of the files and never writes next to them. 8 and 16
+    bit integer data are stored as they are, other data in the 16 bit
+    range as uint16 and everything else as float32; cached data are
+    loaded back as read-only memory maps.
+    A JSON index keeps track of the entries, which are evicted in LRU
+    order when the total size exceeds max_size.
+
+    The index also holds the checkpoints recorded while decoding the
+    data, that allow later decodings to start from the middle of the
+    compressed stream. They are small, so they are kept even when the
+    data are evicted, up to MAX_CHECKPOINTS files.
+    """
+
+    def __init__(self, root=paths.CACHE_PATH, max_size=DEFAULT_MAX_SIZE):
+        self._lock = threading.RLock()
+        self._hashes = {}
+        self._index = {}
+        self._checkpoints = {}
+        self._pending = {}
+        self._last_save = 0
+        self.max_size = int(max_size)
+        self.root = None
+        self.setRoot(root)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def setRoot(self, root):
+        with self._lock:
+            root = os.path.expanduser(os.path.expandvars(str(root)))
+            if root == self.root:
+                return
+            self.root = root
+            self._index = {}
+            self._checkpoints = {}
+            try:
+                if not os.path.isdir(root):
+                    os.makedirs(root)
+            except OSError as exc:
+                log.log(repr(self),
+                        "cannot create cache directory: "+str(exc),
+                        level=logging.ERROR)
+                return
+            self._loadIndex()
+
+    def setMaxSize(self, max_size):
+        with self._lock:
+            self.max_size = max(int(max_size), 0)
+            self._evict()
+            self._saveIndex()
+
+    def getSize(self):
+        with self._lock:
+            return sum(e['size'] for e in self._index.values())
+
+    def getKey(self, url, tag='', page=0):
+        """
+        Returns the cache key of a page of a file or None if the file
+        cannot be read.
+        """
+        try:
+            st = os.stat(url)
+        except OSError:
+            return None
+
+        stamp = (url, st.st_size, st.st_mtime)
+
+        with self._lock:
+            digest = self._hashes.get(stamp)
+
+        if digest is None:
+            hsh = hashlib.sha1()
+            hsh.update('{0}:{1}'.format(st.st_size,
+                                        st.st_mtime).encode('ascii'))
+            try:
+                with open(url, 'rb') as fp:
+                    hsh.update(fp.read(HASH_BLOCK_SIZE))
+                    if st.st_size > 2*HASH_BLOCK_SIZE:
+                        fp.seek(-HASH_BLOCK_SIZE, 2)
+                        hsh.update(fp.read(HASH_BLOCK_SIZE))
+            except (IOError, OSError):
+                return None
+            digest = hsh.hexdigest()
+            with self._lock:
+                self._hashes[stamp] = digest
+
+        return '{0}-{1}-{2}'.format(digest, tag, page)
+
+    def load(self, key):
+        if key is None:
+            return None
+
+        with self._lock:
+            pending = self._pending.get(key)
+
+        if pending is not None:
+            if pending[0].cancel():
+                # the data will be decoded by the caller
+                self._adoptPending(key)
+            else:
+                # the data are being decoded right now
+                concurrent.futures.wait([pending[0]])
+                self._adoptPending(key)
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+
+            fname = os.path.join(self.root, entry['file'])
+            try:
+                data = np.load(fname, mmap_mode='r')
+            except Exception as exc:
+                log.log(repr(self),
+                        "removing broken cache entry: "+str(exc),
+                        level=logging.WARNING)
+                self._remove(key)
+                self._saveIndex()
+                return None
+
+            entry['atime'] = time.time()
+            if time.time() - self._last_save > 5:
+                self._saveIndex()
+
+        log.log(repr(self),
+                "loading cached data of "+str(entry['url']),
+                level=logging.DEBUG)
+
+        return data
+
+    def store(self, key, data, url='', checkpoints=None):
+        if key is None or self.root is None:
+            return False
+
+        if checkpoints:
+            self.setCheckpoints(key, checkpoints)
+
+        data = np.asarray(data)
+        if data.nbytes > self.max_size:
+            return False
+
+        with self._lock:
+            try:
+                fname = writeData(self.root, data)
+            except Exception as exc:
+                log.log(repr(self),
+                        "cannot store decoded data: "+str(exc),
+                        level=logging.ERROR)
+                return False
+
+            if fname is None:
+                return False
+
+            return self.addEntry(key, fname, url)
+
+    def addEntry(self, key, fname, url='', checkpoints=None):
+        """
+        Adds to the index a file already written in the cache
+        directory by writeData.
+        """
+        if key is None or self.root is None:
+            return False
+
+        if checkpoints:
+            self.setCheckpoints(key, checkpoints)
+
+        path = os.path.join(self.root, os.path.basename(fname))
+
+        with self._lock:
+            try:
+                data = np.load(path, mmap_mode='r')
+                shape = list(data.shape)
+                dtype = data.dtype.str
+                del data
+            except Exception as exc:
+                log.log(repr(self),
+                        "invalid cache file "+path+": "+str(exc),
+                        level=logging.ERROR)
+                return False
+
+            if key in self._index:
+                if self._index[key]['file'] == os.path.basename(path):
+                    return True
+                self._remove(key)
+
+            self._index[key] = {'file': os.path.basename(path),
+                                'url': str(url),
+                                'shape': shape,
+                                'dtype': dtype,
+                                'size': os.path.getsize(path),
+                                'atime': time.time()}
+            self._evict()
+            self._saveIndex()
+
+        log.log(repr(self),
+                "decoded data of "+str(url)+" stored in the cache",
+                level=logging.DEBUG)
+
+        return True
+
+    def getCheckpoints(self, key):
+        """
+        Returns the decoding checkpoints of key or None.
+        """
+        with self._lock:
+            return self._checkpoints.get(key)
+
+    def setCheckpoints(self, key, checkpoints):
+        """
+        Stores the decoding checkpoints of key, that must be a list
+        of lists of integers. The index is saved with the next entry.
+        """
+        if key is None:
+            return
+        with self._lock:
+            self._checkpoints.pop(key, None)
+            self._checkpoints[key] = [[int(v) for v in point]
+                                      for point in checkpoints]
+            while len(self._checkpoints) > MAX_CHECKPOINTS:
+                # dropping the checkpoints stored first
+                del self._checkpoints[next(iter(self._checkpoints))]
+
+    def setPending(self, key, future, url=''):
+        """
+        Registers a concurrent.futures.Future whose result is the name
+        of a file written by writeData with the data of key, or a tuple
+        with the name and the decoding checkpoints. The file is added
+        to the cache when the future is done and load() waits for it
+        if the data are requested in the meanwhile.
+        """
+        with self._lock:
+            self._pending[key] = (future, url)
+        future.add_done_callback(lambda f: self._adoptPending(key))
+
+    def isPending(self, key):
+        return key in self._pending
+
+    def _adoptPending(self, key):
+        # NOTE: this is called both by load() and by the callback of
+        #       the future, the pending entry is removed only after
+        #       the file is in the index, so that load() always finds
+        #       one of them
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                return False
+
+            future, url = pending
+            if not future.done():
+                return False
+            elif future.cancelled() or future.exception() is not None:
+                del self._pending[key]
+                return False
+
+            fname = future.result()
+            checkpoints = None
+            if isinstance(fname, tuple):
+                fname, checkpoints = fname
+
+            if fname is None:
+                added = False
+            else:
+                added = self.addEntry(key, fname, url, checkpoints)
+
+            del self._pending[key]
+            return added
+
+    def _remove(self, key):
+        entry = self._index.pop(key)
+        try:
+            os.remove(os.path.join(self.root, entry['file']))
+        except OSError:
+            pass
+
+    def _evict(self):
+        size = sum(e['size'] for e in self._index.values())
+        if size <= self.max_size:
+            return
+        lru = sorted(self._index.keys(), key=lambda k: self._index[k]['atime'])
+        for key in lru:
+            if size <= self.max_size:
+                break
+            size -= self._index[key]['size']
+            log.log(repr(self),
+                    "evicting "+str(self._index[key]['url'])+" from cache",
+                    level=logging.DEBUG)
+            self._remove(key)
+
+    def _loadIndex(self):
+        fname = os.path.join(self.root, INDEX_FILE)
+        try:
+            with open(fname, 'r') as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            index = {}
+
+        # NOTE: old indexes hold only the entries
+        if 'entries' in index:
+            self._checkpoints = index.get('checkpoints', {})
+            index = index['entries']
+
+        # dropping entries whose data file has been removed
+        self._index = {k: v for k, v in index.items()
+                       if os.path.isfile(os.path.join(self.root, v['file']))}
+
+    def _saveIndex(self):
+        if self.root is None:
+            return False
+        fname = os.path.join(self.root, INDEX_FILE)
+        try:
+            fd, tmpname = tempfile.mkstemp(suffix='.json', dir=self.root)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'entries': self._index,
+                           'checkpoints': self._checkpoints}, f)
+            os.replace(tmpname, fname)
+            self._last_save = time.time()
+            return True
+        except (IOError, OSError) as exc:
+            log.log(repr(self),
+                    "cannot save cache index: "+str(exc),
+                    level=logging.ERROR)
+            return False
+
+    def flush(self):
+        with self._lock:
+            return self._saveIndex()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index.keys()):
+                self._remove(key)
+            self._checkpoints = {}
+            self._saveIndex()
+
+
+_decode_cache = None
+
+
+def getCache():
+    global _decode_cache
+    if _decode_cache is None:
+        _decode_cache = DecodeCache()
+    return _decode_cache
@@ -0,0 +1,294 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Pluggable backends for the 2D Fourier transforms used by utils
+
+import os
+import pickle
+import logging
+import threading
+
+import numpy as np
+import cv2
+
+from . import log
+from . import paths
+
+try:
+    import scipy.fft
+    HAS_SCIPY_FFT = True
+except ImportError:
+    HAS_SCIPY_FFT = False
+
+try:
+    import pyfftw
+    import pyfftw.builders
+    HAS_PYFFTW = True
+except ImportError:
+    HAS_PYFFTW = False
+
+WISDOM_FILE = os.path.join(paths.HOME_PATH, 'fftw_wisdom.pickle')
+
+
+class FFTBackend(object):
+
+    """
+    Base class of the FFT backends.
+
+    The direct transform pads the image to the optimal DFT size
+    computed by cv2.getOptimalDFTSize, so that all the backends
+    return arrays of the same shape. The inverse transform is NOT
+    normalized, as cv2.idft without the DFT_SCALE flag, and only
+    its real part is returned.
+    """
+
+    name = None
+
+    def __init__(self, threads=1):
+        self.threads = max(int(threads), 1)
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def setThreads(self, threads):
+        self.threads = max(int(threads), 1)
+        self.clear()
+
+    def clear(self):
+        self._buffers = {}
+
+    def getOptimalShape(self, shape):
+        return (cv2.getOptimalDFTSize(shape[0]),
+                cv2.getOptimalDFTSize(shape[1]))
+
+    def _getBuffer(self, key, shape, dtype):
+        # NOTE: the buffers are keyed also by the size of the input
+        #       image, so the padding region is written only once
+        #       and it is always zero.
+        try:
+            return self._buffers[key]
+        except KeyError:
+            buf = np.zeros(shape, dtype=dtype)
+            self._buffers[key] = buf
+            return buf
+
+    def fft(self, img):
+        raise NotImplementedError
+
+    def ift(self, fft):
+        raise NotImplementedError
+
+
+class CV2Backend(FFTBackend):
+
+    name = 'cv2'
+
+    # NOTE: the number of threads is not used, cv2.setNumThreads
+    #       would change it for all the OpenCV functions (warps,
+    #       debayering, template matching...) in the whole program
+
+    def fft(self, img):
+        h, w = img.shape[0:2]
+        oh, ow = self.getOptimalShape((h, w))
+
+        with self._lock:
+            cmplx = self._getBuffer(('fft', h, w), (oh, ow, 2), np.float64)
+            cmplx[0:h, 0:w, 0] = img.real
+            cmplx[0:h, 0:w, 1] = img.imag
+            img_fft = cv2.dft(cmplx)
+
+        result = np.empty((oh, ow), dtype=np.complex128)
+        result.real = img_fft[..., 0]
+        result.imag = img_fft[..., 1]
+
+        return result
+
+    def ift(self, fft):
+        imh, imw = fft.shape
+
+        with self._lock:
+            cmplx = self._getBuffer(('ift', imh, imw),
+                                    (imh, imw, 2), np.float64)
+            cmplx[..., 0] = fft.real
+            cmplx[..., 1] = fft.imag
+            img_ift = cv2.idft(cmplx)
+
+        return img_ift[..., 0].copy()
+
+
+class NumpyBackend(FFTBackend):
+
+    name = 'numpy'
+
+    # NOTE: numpy >= 2 keeps single precision in the transforms, the
+    #       data are converted to double precision as in the other
+    #       backends
+
+    def fft(self, img):
+        return np.fft.fft2(np.asarray(img, dtype=np.complex128),
+                           s=self.getOptimalShape(img.shape))
+
+    def ift(self, fft):
+        fft = np.asarray(fft, dtype=np.complex128)
+        return np.fft.ifft2(fft).real.astype(np.float64)*fft.size
+
+
+class ScipyBackend(FFTBackend):
+
+    name = 'scipy'
+
+    def fft(self, img):
+        h, w = img.shape[0:2]
+        oh, ow = self.getOptimalShape((h, w))
+
+        # NOTE: scipy.fft caches its plans internally
+        cmplx = np.zeros((oh, ow), dtype=np.complex128)
+        cmplx[0:h, 0:w] = img
+
+        return scipy.fft.fft2(cmplx, workers=self.threads,
+                              overwrite_x=True)
+
+    def ift(self, fft):
+        return scipy.fft.ifft2(fft, norm='forward',
+                               workers=self.threads).real
+
+
+class FFTWBackend(FFTBackend):
+
+    name = 'pyfftw'
+
+    def __init__(self, threads=1, planner_effort='FFTW_MEASURE'):
+        FFTBackend.__init__(self, threads)
+        self.planner_effort = planner_effort
+        self._plans = {}
+        loadWisdom()
+
+    def clear(self):
+        FFTBackend.clear(self)
+        self._plans = {}
+
+    def _getPlan(self, key, shape, builder):
+        try:
+            return self._plans[key]
+        except KeyError:
+            log.log("<lxnstack.fftbackends module>",
+                    "planning FFTW "+str(key),
+                    level=logging.DEBUG)
+            buf = pyfftw.zeros_aligned(shape, dtype=np.complex128)
+            plan = builder(buf,
+                           threads=self.threads,
+                           planner_effort=self.planner_effort,
+                           overwrite_input=True,
+                           avoid_copy=True)
+            self._plans[key] = plan
+            saveWisdom()
+            return plan
+
+    def fft(self, img):
+        h, w = img.shape[0:2]
+        oh, ow = self.getOptimalShape((h, w))
+
+        with self._lock:
+            plan = self._getPlan(('fft', h, w), (oh, ow),
+                                 pyfftw.builders.fft2)
+            buf = plan.input_array
+            buf[0:h, 0:w] = img
+            buf[h:, :] = 0
+            buf[:h, w:] = 0
+            # NOTE: the output array is owned by the plan
+            return plan().copy()
+
+    def ift(self, fft):
+        with self._lock:
+            plan = self._getPlan(('ift',)+fft.shape, fft.shape,
+                                 pyfftw.builders.ifft2)
+            plan.input_array[...] = fft
+            return plan(normalise_idft=False).real.copy()
+
+
+BACKENDS = {
+    CV2Backend.name: CV2Backend,
+    NumpyBackend.name: NumpyBackend,
+}
+
+if HAS_SCIPY_FFT:
+    BACKENDS[ScipyBackend.name] = ScipyBackend
+
+if HAS_PYFFTW:
+    BACKENDS[FFTWBackend.name] = FFTWBackend
+
+DEFAULT_BACKEND = CV2Backend.name
+
+_current_backend = CV2Backend()
+
+
+def getAvailableBackends():
+    return sorted(BACKENDS.keys())
+
+
+def getBackend():
+    return _current_backend
+
+
+def setBackend(name, threads=1):
+    global _current_backend
+
+    if name not in BACKENDS:
+        log.log("<lxnstack.fftbackends module>",
+                "FFT backend \'"+str(name)+"\' not available, using " +
+                DEFAULT_BACKEND,
+                level=logging.WARNING)
+        name = DEFAULT_BACKEND
+
+    if _current_backend.name == name:
+        _current_backend.setThreads(threads)
+    else:
+        _current_backend = BACKENDS[name](threads)
+        _current_backend.setThreads(threads)
+
+    log.log("<lxnstack.fftbackends module>",
+            "using FFT backend \'"+name+"\' with " +
+            str(_current_backend.threads)+" thread(s)",
+            level=logging.INFO)
+
+    return _current_backend
+
+
+def loadWisdom():
+    if not (HAS_PYFFTW and os.path.isfile(WISDOM_FILE)):
+        return False
+    try:
+        with open(WISDOM_FILE, 'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+        return True
+    except Exception as exc:
+        log.log("<lxnstack.fftbackends module>",
+                "cannot load FFTW wisdom: "+str(exc),
+                level=logging.WARNING)
+        return False
+
+
+def saveWisdom():
+    if not HAS_PYFFTW:
+        return False
+    try:
+        with open(WISDOM_FILE, 'wb') as f:
+            pickle.dump(pyfftw.export_wisdom(), f)
+        return True
+    except Exception as exc:
+        log.log("<lxnstack.fftbackends module>",
+                "cannot save FFTW wisdom: "+str(exc),
+                level=logging.WARNING)
+        return False
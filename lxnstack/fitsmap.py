@@ -0,0 +1,180 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Memory-mapped access to the data of uncompressed FITS images
+
+import logging
+
+import numpy as np
+
+from . import log
+from . import probes
+
+FITS_DTYPES = {8: '>u1',
+               16: '>i2',
+               32: '>i4',
+               64: '>i8',
+               -32: '>f4',
+               -64: '>f8'}
+
+
+class FitsImageMap(object):
+
+    """
+    Read-only view of a 2D image stored in an uncompressed FITS file.
+
+    The raw data are memory-mapped and BZERO, BSCALE and BLANK are
+    applied only to the pixels that are actually read, so that large
+    images can be processed tile by tile. Slicing a FitsImageMap
+    returns the scaled data of the requested region as an array of
+    type ftype.
+    """
+
+    def __init__(self, url, page, raw, header, cards, ftype=np.float32):
+        self.url = url
+        self.page = page
+        self.raw = raw
+        self.cards = cards
+        self.ftype = ftype
+        self.bzero = header.get('BZERO', 0)
+        self.bscale = header.get('BSCALE', 1)
+        if 'BLANK' in header and raw.dtype.kind != 'f':
+            self.blank = int(header['BLANK'])
+        else:
+            self.blank = None
+        self.dtype = probes.getFitsDtype(header)
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    def __len__(self):
+        return self.raw.shape[0]
+
+    def __getitem__(self, key):
+        return self._scale(self.raw[key], self.ftype)
+
+    def _scale(self, raw, ftype, out=None):
+        if out is None:
+            out = raw.astype(ftype)
+        else:
+            out[...] = raw
+
+        if self.bscale != 1:
+            out *= self.bscale
+        if self.bzero != 0:
+            out += self.bzero
+        if self.blank is not None and out.dtype.kind == 'f':
+            out[raw == self.blank] = np.nan
+
+        return out
+
+    def readTile(self, y0, y1, x0, x1, ftype=None, out=None):
+        """
+        Returns the scaled data of the region [y0:y1, x0:x1]. If out
+        is given, the data are written into it.
+        """
+        if ftype is None:
+            ftype = self.ftype
+        return self._scale(self.raw[y0:y1, x0:x1], ftype, out)
+
+    def iterTiles(self, tile_w=256, tile_h=256, ftype=None):
+        """
+        Yields the tuples (y0, x0, tile) covering the whole image.
+        """
+        imh, imw = self.shape
+        for y0 in range(0, imh, tile_h):
+            for x0 in range(0, imw, tile_w):
+                yield (y0, x0, self.readTile(y0, y0+tile_h,
+                                             x0, x0+tile_w,
+                                             ftype))
+
+    def asarray(self, ftype=None):
+        if ftype is None:
+            ftype = self.ftype
+        return self._scale(self.raw, ftype)
+
+    def min(self):
+        vmin = float(self.raw.min())*self.bscale + self.bzero
+        vmax = float(self.raw.max())*self.bscale + self.bzero
+        return min(vmin, vmax)
+
+    def close(self):
+        self.raw = None
+
+
+def openFitsMap(file_name, page=0, rgb_fits_mode=False, ftype=np.float32):
+    """
+    Returns a FitsImageMap of the requested page or None if the page
+    does not exist or its data cannot be memory-mapped (compressed
+    images, RGB fits files).
+    """
+    try:
+        return _openFitsMap(file_name, page, rgb_fits_mode, ftype)
+    except Exception as exc:
+        log.log("<lxnstack.fitsmap module>",
+                "cannot map file \'"+str(file_name)+"\': "+str(exc),
+                level=logging.DEBUG)
+        return None
+
+
+def _openFitsMap(file_name, page, rgb_fits_mode, ftype):
+    hdus = []
+    with open(file_name, 'rb') as fp:
+        for cards, header, offset, datasize in probes.iterFitsHDUs(fp):
+            if not hdus and header.get('SIMPLE') is not True:
+                return None
+            hdus.append((cards, header, offset,
+                         probes.getFitsImageAxes(header)))
+
+    if not hdus:
+        return None
+
+    if rgb_fits_mode:
+        layers = [h[3] for h in hdus if h[3] is not None and len(h[3]) == 2]
+        if (len(layers) == 3 and
+                layers[0] == layers[1] == layers[2]):
+            # this is an RGB image, see Frame._open
+            return None
+
+    npages = page
+    for cards, header, offset, axes in hdus:
+        if axes is None or len(axes) <= 1:
+            continue
+
+        total = int(np.prod(axes[2:]))
+        if npages >= total:
+            npages -= total
+            continue
+
+        if header.get('ZIMAGE') is True:
+            # tile compressed data cannot be memory-mapped
+            return None
+
+        dtype = FITS_DTYPES[int(header['BITPIX'])]
+        imw, imh = axes[0:2]
+        raw = np.memmap(file_name, dtype=dtype, mode='r',
+                        offset=offset, shape=tuple(axes[::-1]))
+        raw = raw.reshape((-1, imh, imw))[npages]
+
+        # NOTE: cards of the primary HDU are used as frame properties
+        return FitsImageMap(file_name, page, raw, header, hdus[0][0], ftype)
+
+    return None
@@ -0,0 +1,385 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Streaming writer of uncompressed FITS files
+
+import re
+import math
+import logging
+
+import numpy as np
+
+from . import log
+from . import probes
+from . import fitsmap
+
+# size of the chunks of data converted at once
+CHUNK_SIZE = 1024*1024  # bytes
+
+# these keywords are written by the writer itself
+STRUCTURAL_KEYWORDS = ('SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'EXTEND',
+                       'PCOUNT', 'GCOUNT', 'BZERO', 'BSCALE', 'EXTNAME',
+                       'END')
+
+_keyword_re = re.compile('^[A-Z0-9_-]{1,8}$')
+
+
+def getFitsFormat(dtype):
+    """
+    Returns the tuple (bitpix, bzero) used to store data of the
+    given type.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return (-64 if dtype.itemsize > 4 else -32, 0)
+    elif dtype.kind in 'biu':
+        bitpix = max(dtype.itemsize*8, 8)
+        if dtype.kind == 'b':
+            return (8, 0)
+        elif (dtype.kind == 'u') == (bitpix == 8):
+            return (bitpix, 0)
+        else:
+            return (bitpix, probes.FITS_INT_OFFSETS[bitpix])
+    else:
+        raise TypeError("unsupported data type "+str(dtype))
+
+
+def formatValue(value):
+    """
+    Returns the value field of a header card or None if the value
+    cannot be stored in a FITS header.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return '{0:>20}'.format('T' if value else 'F')
+    elif isinstance(value, (int, np.integer)):
+        return '{0:>20d}'.format(int(value))
+    elif isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return None
+        text = repr(value).upper()
+        if len(text) > 20:
+            text = '{0:.16G}'.format(value)
+        if '.' not in text and 'E' not in text:
+            text += '.0'
+        return '{0:>20}'.format(text)
+    elif isinstance(value, str):
+        try:
+            value.encode('ascii')
+        except UnicodeError:
+            return None
+        if not value.isprintable():
+            return None
+        value = value.replace("'", "''")[:68]
+        if value.endswith("'") and not value.endswith("''"):
+            value = value[:-1]
+        return "'{0:<8}'".format(value)
+    else:
+        return None
+
+
+def formatCard(key, value):
+    """
+    Returns a 80 characters header card or None if the keyword or
+    the value are not valid.
+    """
+    key = str(key).upper()
+    if key in ('COMMENT', 'HISTORY'):
+        return '{0:<8}{1:<72}'.format(key, str(value)[:72])
+    elif not _keyword_re.match(key):
+        return None
+
+    text = formatValue(value)
+    if text is None:
+        return None
+
+    return '{0:<8}= {1:<70}'.format(key, text)[:probes.FITS_CARD_SIZE]
+
+
+class FitsWriter(object):
+
+    """
+    Writes a FITS file one HDU at time.
+
+    The header of each HDU is written as soon as the HDU is begun and
+    the data are converted and written in chunks of CHUNK_SIZE bytes,
+    directly from the source arrays, which can also be strided views
+    or generators of planes. The first axis of a data cube can be left
+    undefined, passing None as its length: in this case the planes can
+    be appended one at time and NAXIS3 is updated when the HDU ends.
+
+    Example:
+        with FitsWriter('cube.fits') as writer:
+            writer.beginHDU((None, height, width), np.uint16)
+            for frame in frames:
+                writer.writePlane(frame)
+    """
+
+    def __init__(self, file_name):
+        self.url = str(file_name)
+        self._fp = open(self.url, 'wb')
+        self._hdu_count = 0
+        self._shape = None
+        self._written = 0
+        self._naxis_pos = None
+
+    def __repr__(self):
+        return "<lxnstack.fitswriter.FitsWriter object at {0}>".format(
+            hex(id(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _writeCards(self, cards):
+        text = ''
+        for card in cards:
+            if card is not None:
+                text += card
+        text += '{0:<80}'.format('END')
+        size = len(text)
+        nblocks = (size + probes.FITS_BLOCK_SIZE - 1)//probes.FITS_BLOCK_SIZE
+        text += ' '*(nblocks*probes.FITS_BLOCK_SIZE - size)
+        self._fp.write(text.encode('ascii'))
+
+    def beginHDU(self, shape=(), dtype=np.float32, header=None,
+                 extname=None):
+        """
+        Writes the header of a new HDU. shape is the shape of the data
+        in the numpy order, eg. (height, width) or (planes, height,
+        width); an empty shape creates an HDU without data.
+        """
+        if self._shape is not None:
+            self.endHDU()
+
+        shape = tuple(shape)
+        bitpix, bzero = getFitsFormat(dtype)
+
+        if shape and shape[0] is None:
+            naxis_pos = len(shape)
+        else:
+            naxis_pos = None
+
+        if self._hdu_count == 0:
+            cards = [formatCard('SIMPLE', True)]
+        else:
+            cards = [formatCard('XTENSION', 'IMAGE')]
+
+        cards.append(formatCard('BITPIX', bitpix))
+        cards.append(formatCard('NAXIS', len(shape)))
+        for n, size in enumerate(reversed(shape)):
+            cards.append(formatCard('NAXIS'+str(n+1), size or 0))
+
+        if self._hdu_count == 0:
+            cards.append(formatCard('EXTEND', True))
+        else:
+            cards.append(formatCard('PCOUNT', 0))
+            cards.append(formatCard('GCOUNT', 1))
+
+        if bzero != 0:
+            cards.append(formatCard('BZERO', bzero))
+            cards.append(formatCard('BSCALE', 1))
+
+        if extname is not None:
+            cards.append(formatCard('EXTNAME', str(extname)))
+
+        if header is not None:
+            if hasattr(header, 'items'):
+                header = header.items()
+            for key, value in header:
+                key = str(key).upper()
+                if key.rstrip('0123456789') in STRUCTURAL_KEYWORDS:
+                    continue
+                card = formatCard(key, value)
+                if card is None:
+                    log.log(repr(self),
+                            "skipping header keyword "+key,
+                            level=logging.DEBUG)
+                cards.append(card)
+
+        header_pos = self._fp.tell()
+        self._writeCards(cards)
+
+        if naxis_pos is not None:
+            # position of the card of the last axis
+            self._naxis_pos = header_pos + (2+naxis_pos)*probes.FITS_CARD_SIZE
+        else:
+            self._naxis_pos = None
+
+        self._hdu_count += 1
+        self._shape = shape
+        self._bitpix = bitpix
+        self._bzero = bzero
+        self._dtype = np.dtype(fitsmap.FITS_DTYPES[bitpix])
+        self._written = 0
+
+    def _getPlaneSize(self):
+        return int(np.prod(self._shape[1:])) if self._shape else 0
+
+    def _getTotalSize(self):
+        if not self._shape:
+            return 0
+        elif self._shape[0] is None:
+            return None
+        else:
+            return int(np.prod(self._shape))
+
+    def _encode(self, chunk):
+        chunk = np.asarray(chunk)
+        if self._bzero == 0:
+            return chunk.astype(self._dtype)
+        elif self._bitpix == 8:
+            raw = chunk.astype(np.int8).view(np.uint8) ^ np.uint8(0x80)
+            return raw
+        else:
+            nbytes = str(self._bitpix//8)
+            udtype = np.dtype('u'+nbytes)
+            raw = chunk.astype(udtype) ^ udtype.type(self._bzero)
+            return raw.view('i'+nbytes).astype(self._dtype)
+
+    def _writeArray(self, data):
+        data = np.asarray(data)
+        if data.ndim == 0:
+            data = data.reshape((1,))
+
+        total = self._getTotalSize()
+        if total is not None and self._written + data.size > total:
+            raise ValueError("too much data for the current HDU")
+
+        if data.ndim == 1:
+            rows = data.reshape((1, -1))
+        else:
+            rows = data.reshape((-1, data.shape[-1]))
+
+        row_size = max(rows.shape[1]*self._dtype.itemsize, 1)
+        step = max(CHUNK_SIZE//row_size, 1)
+        for y in range(0, rows.shape[0], step):
+            raw = self._encode(rows[y:y+step])
+            self._fp.write(np.ascontiguousarray(raw).data)
+
+        self._written += data.size
+
+    def writeData(self, data):
+        """
+        Writes data to the current HDU. data can be an array or an
+        iterable of arrays (eg. the planes of a cube or blocks of
+        rows) that are written in sequence.
+        """
+        if self._shape is None:
+            raise ValueError("no HDU has been begun")
+
+        if isinstance(data, np.ndarray) or hasattr(data, '__array__'):
+            self._writeArray(data)
+        else:
+            for block in data:
+                self._writeArray(block)
+
+    def writePlane(self, plane):
+        """
+        Appends a plane to the data cube of the current HDU.
+        """
+        plane = np.asarray(plane)
+        if plane.size != self._getPlaneSize():
+            raise ValueError("wrong plane size: "+str(plane.shape))
+        self._writeArray(plane)
+
+    def endHDU(self):
+        """
+        Pads the data of the current HDU to the size of a FITS block,
+        the missing data, if any, are filled with zeros.
+        """
+        if self._shape is None:
+            return
+
+        total = self._getTotalSize()
+        itemsize = self._dtype.itemsize
+
+        if total is None:
+            planes = self._written//max(self._getPlaneSize(), 1)
+            total = planes*self._getPlaneSize()
+        else:
+            planes = None
+
+        if self._written < total:
+            log.log(repr(self),
+                    "missing data in HDU "+str(self._hdu_count) +
+                    ": filling with zeros",
+                    level=logging.WARNING)
+            self._fp.write(b'\x00'*((total - self._written)*itemsize))
+
+        datasize = total*itemsize
+        pad = -datasize % probes.FITS_BLOCK_SIZE
+        self._fp.write(b'\x00'*pad)
+
+        if planes is not None:
+            end_pos = self._fp.tell()
+            self._fp.seek(self._naxis_pos)
+            card = formatCard('NAXIS'+str(len(self._shape)), planes)
+            self._fp.write(card.encode('ascii'))
+            self._fp.seek(end_pos)
+
+        self._shape = None
+        self._naxis_pos = None
+        self._written = 0
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        if self._fp is None:
+            return
+        try:
+            if self._shape is not None:
+                self.endHDU()
+            elif self._hdu_count == 0:
+                # a FITS file must have at least the primary HDU
+                self.beginHDU()
+                self.endHDU()
+        finally:
+            self._fp.close()
+            self._fp = None
+
+
+def writeImage(file_name, data, header=None, dtype=None):
+    """
+    Writes an image or a data cube in a single HDU.
+    """
+    data = np.asarray(data)
+    with FitsWriter(file_name) as writer:
+        writer.beginHDU(data.shape, dtype or data.dtype, header)
+        writer.writeData(data)
+
+
+def writeRGB(file_name, data, header=None, dtype=None,
+             extnames=('RED', 'GREEN', 'BLUE')):
+    """
+    Writes an header-only primary HDU and one image extension for
+    each component of data, that must have shape (height, width, n).
+    """
+    data = np.asarray(data)
+    with FitsWriter(file_name) as writer:
+        writer.beginHDU((), np.uint8, header)
+        for c in range(data.shape[2]):
+            if c < len(extnames):
+                extname = extnames[c]
+            else:
+                extname = None
+            writer.beginHDU(data.shape[0:2], dtype or data.dtype,
+                            extname=extname)
+            writer.writeData(data[..., c])
@@ -0,0 +1,265 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Process-wide LRU cache of the decoded pixel data of the frames
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import collections
+
+import numpy as np
+
+from . import log
+
+DEFAULT_BUDGET = 512*1024*1024  # bytes
+
+# these arguments do not change the decoded data
+IGNORED_ARGS = ('progress_bar', 'skip_loading')
+
+
+class FrameCache(object):
+
+    """
+    LRU cache of decoded frames with a memory budget in bytes.
+
+    Cached arrays are read-only: unless copy=False is requested, get()
+    returns a copy, so callers can still modify the data in place.
+    When a spill directory is set, evicted float32 arrays are saved as
+    .npy files and they are loaded back as memory-mapped arrays on the
+    next request.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, spill_dir=None,
+                 spill_budget=None):
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._spilled = collections.OrderedDict()
+        self._own_spill_dir = False
+        self.budget = int(budget)
+        self.spill_dir = None
+        self.spill_budget = spill_budget
+        self.nbytes = 0
+        self.spill_nbytes = 0
+        self.resetStats()
+        self.setSpillDir(spill_dir)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._spilled
+
+    def resetStats(self):
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    def getStats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self.nbytes,
+                    'budget': self.budget,
+                    'hits': self.hits,
+                    'spill_hits': self.spill_hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'spills': self.spills,
+                    'spilled_entries': len(self._spilled),
+                    'spilled_bytes': self.spill_nbytes}
+
+    def setBudget(self, budget):
+        with self._lock:
+            self.budget = max(int(budget), 0)
+            self._shrink(self.budget)
+
+    def setSpillDir(self, spill_dir):
+        with self._lock:
+            self._clearSpilled()
+            if spill_dir is None:
+                self.spill_dir = None
+                return
+            elif spill_dir is True:
+                spill_dir = tempfile.mkdtemp(prefix='lxnstack-framecache-')
+                self._own_spill_dir = True
+            else:
+                if not os.path.isdir(spill_dir):
+                    os.makedirs(spill_dir)
+                self._own_spill_dir = False
+            self.spill_dir = spill_dir
+
+    def getKey(self, url, page, open_args, *args):
+        """
+        Returns the cache key of a frame or None if the frame
+        cannot be cached.
+        """
+        try:
+            st = os.stat(url)
+        except OSError:
+            return None
+
+        if 'data' in open_args:
+            return None
+
+        try:
+            oargs = tuple(sorted((k, v) for k, v in open_args.items()
+                                 if k not in IGNORED_ARGS))
+            key = (url, page, st.st_size, st.st_mtime, oargs) + args
+            hash(key)
+        except TypeError:
+            # unhashable open arguments
+            return None
+
+        return key
+
+    def get(self, key, copy=True):
+        if key is None:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if copy:
+                    return self._entries[key].copy()
+                return self._entries[key]
+            elif key in self._spilled:
+                # NOTE: spilled frames stay on the disk and they are
+                #       returned as read-only memory maps, a copy in
+                #       memory is made only when it is requested
+                fname, nbytes = self._spilled[key]
+                try:
+                    data = np.load(fname, mmap_mode='r')
+                except Exception as exc:
+                    log.log("<lxnstack.framecache module>",
+                            "cannot load spilled frame: "+str(exc),
+                            level=logging.WARNING)
+                    del self._spilled[key]
+                    self.spill_nbytes -= nbytes
+                    self._removeFile(fname)
+                else:
+                    self._spilled.move_to_end(key)
+                    self.spill_hits += 1
+                    if copy:
+                        return np.array(data)
+                    return data
+
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        if key is None or not isinstance(data, np.ndarray):
+            return False
+
+        with self._lock:
+            return self._put(key, np.array(data))
+
+    def _put(self, key, data):
+        if data.nbytes > self.budget:
+            return False
+
+        data.flags.writeable = False
+
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key).nbytes
+
+        self._shrink(self.budget - data.nbytes)
+        self._entries[key] = data
+        self.nbytes += data.nbytes
+
+        return True
+
+    def _shrink(self, size):
+        while self._entries and self.nbytes > size:
+            key, data = self._entries.popitem(last=False)
+            self.nbytes -= data.nbytes
+            self.evictions += 1
+            if self.spill_dir is not None and data.dtype == np.float32:
+                self._spill(key, data)
+
+    def _spill(self, key, data):
+        if self.spill_budget is not None:
+            if data.nbytes > self.spill_budget:
+                return
+            while (self._spilled and
+                   self.spill_nbytes + data.nbytes > self.spill_budget):
+                fname, nbytes = self._spilled.popitem(last=False)[1]
+                self.spill_nbytes -= nbytes
+                self._removeFile(fname)
+
+        fd, fname = tempfile.mkstemp(suffix='.npy', dir=self.spill_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+        except Exception as exc:
+            log.log("<lxnstack.framecache module>",
+                    "cannot spill frame to disk: "+str(exc),
+                    level=logging.WARNING)
+            self._removeFile(fname)
+            return
+
+        self._spilled[key] = (fname, data.nbytes)
+        self.spill_nbytes += data.nbytes
+        self.spills += 1
+
+    def _removeFile(self, fname):
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+
+    def _clearSpilled(self):
+        for fname, nbytes in self._spilled.values():
+            self._removeFile(fname)
+        self._spilled.clear()
+        self.spill_nbytes = 0
+        if self._own_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self._own_spill_dir = False
+
+    def invalidate(self, url):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == url]:
+                self.nbytes -= self._entries.pop(key).nbytes
+            for key in [k for k in self._spilled if k[0] == url]:
+                fname, nbytes = self._spilled.pop(key)
+                self.spill_nbytes -= nbytes
+                self._removeFile(fname)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self._clearSpilled()
+
+    def logStats(self):
+        stats = self.getStats()
+        log.log("<lxnstack.framecache module>",
+                ("frame cache: {entries} frames ({bytes} bytes), "
+                 "{hits} hits, {spill_hits} spill hits, {misses} misses, "
+                 "{evictions} evictions, {spills} spills").format(**stats),
+                level=logging.INFO)
+
+
+_frame_cache = FrameCache()
+
+
+def getCache():
+    return _frame_cache
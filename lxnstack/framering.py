@@ -0,0 +1,108 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Ring of preallocated frame buffers between a capture thread
+# and the threads writing the frames to disk
+
+import threading
+import collections
+
+import numpy as np
+
+DEFAULT_DEPTH = 32
+
+
+class FrameRing(object):
+
+    """
+    Fixed number of frame buffers shared by one producer and one or
+    more consumers.
+
+    The producer copies each frame into a free slot with push(), that
+    never blocks: when all the slots are in use the frame is refused.
+    Consumers take the oldest frame with pop() and give its slot back
+    with free() once they have done with the data.
+    The slots are allocated with the first frame pushed.
+    """
+
+    def __init__(self, depth=DEFAULT_DEPTH):
+        self._cond = threading.Condition()
+        self.depth = max(int(depth), 1)
+        self._slots = None
+        self._info = [None]*self.depth
+        self._free = collections.deque(range(self.depth))
+        self._ready = collections.deque()
+        self._closed = False
+        self.max_queued = 0
+
+    def push(self, data, number, timestamp):
+        """
+        Copies data into a free slot. Returns False if the ring is
+        full or closed.
+        """
+        with self._cond:
+            if self._closed or not self._free:
+                return False
+            if self._slots is None:
+                self._slots = [np.empty(data.shape, dtype=data.dtype)
+                               for i in range(self.depth)]
+            idx = self._free.popleft()
+
+        # the slot is owned by the producer until it is queued
+        slot = self._slots[idx]
+        if slot.shape != data.shape or slot.dtype != data.dtype:
+            slot = np.empty(data.shape, dtype=data.dtype)
+            self._slots[idx] = slot
+        np.copyto(slot, data)
+
+        with self._cond:
+            self._info[idx] = (number, timestamp)
+            self._ready.append(idx)
+            self.max_queued = max(self.max_queued, len(self._ready))
+            self._cond.notify()
+        return True
+
+    def pop(self):
+        """
+        Waits for a frame and returns (slot, data, number, timestamp),
+        or None when the ring is closed and there are no more frames.
+        """
+        with self._cond:
+            while not self._ready:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            idx = self._ready.popleft()
+        number, timestamp = self._info[idx]
+        return idx, self._slots[idx], number, timestamp
+
+    def free(self, idx):
+        with self._cond:
+            self._info[idx] = None
+            self._free.append(idx)
+
+    def close(self):
+        # the frames already queued can still be popped
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def isClosed(self):
+        return self._closed
+
+    def getQueued(self):
+        with self._cond:
+            return len(self._ready)
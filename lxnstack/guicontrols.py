@@ -28,6 +28,7 @@ from . import translation as tr
 from . import plotting
 from . import utils
 from . import styles
+from . import fftbackends
 from . import lightcurves as lcurves
 from . import colormaps as cmaps
 from . import mappedimage
@@ -74,6 +75,9 @@ class OptionsDialog(DialogWindow):
 
         self._dialog.refreshPushButton.setIcon(utils.getQIcon("view-refresh"))
 
+        for backend_name in fftbackends.getAvailableBackends():
+            self._dialog.fftBackendComboBox.addItem(backend_name)
+
         self._stylesheets = styles.enumarateStylesSheet()
         for stylesheet_file in self._stylesheets:
             self._dialog.themeListWidget.addItem(stylesheet_file)
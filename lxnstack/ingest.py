@@ -0,0 +1,343 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Bulk ingest of image files: path expansion, parallel probing,
+# grouping by image shape and batch decoding of raw files
+
+import os
+import glob
+import logging
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+
+from PyQt5 import QtCore
+
+from . import log
+from . import utils
+from . import decodecache
+from . import translation as tr
+
+GLOB_CHARS = '*?['
+
+# decoding a raw file needs some hundreds of MB, so only few
+# files are decoded at time
+DEFAULT_DECODE_WORKERS = max(min((os.cpu_count() or 1) - 1, 4), 1)
+
+
+def expandPaths(paths, recursive=False):
+    """
+    Returns the sorted list of the files referred by paths, that can
+    be file names, directories or glob patterns. Only the files of
+    a supported format, recognized from the extension or from the
+    first bytes of the file, are taken from directories and patterns.
+    """
+    formats = utils.getSupportedFormats()
+    files = []
+
+    def _isSupported(fname):
+        return (os.path.isfile(fname) and
+                utils.getFileType(fname, formats) is not None)
+
+    for path in paths:
+        path = os.path.expanduser(str(path))
+
+        if any(c in path for c in GLOB_CHARS):
+            matches = sorted(glob.glob(path, recursive=recursive))
+        else:
+            matches = [path]
+
+        for match in matches:
+            if os.path.isdir(match):
+                if recursive:
+                    for root, dirs, fnames in os.walk(match):
+                        dirs.sort()
+                        files.extend(os.path.join(root, f)
+                                     for f in sorted(fnames)
+                                     if _isSupported(os.path.join(root, f)))
+                else:
+                    files.extend(os.path.join(match, f)
+                                 for f in sorted(os.listdir(match))
+                                 if _isSupported(os.path.join(match, f)))
+            elif match == path or _isSupported(match):
+                # NOTE: explicitly requested files are always returned,
+                #       so that they end up in the rejection report if
+                #       they cannot be loaded
+                files.append(match)
+
+    unique = []
+    seen = set()
+    for fname in files:
+        if fname not in seen:
+            seen.add(fname)
+            unique.append(fname)
+
+    return unique
+
+
+class IngestResult(object):
+
+    """
+    Result of the analysis of a list of files.
+
+    pages are grouped by their shape (width, height, components) and
+    they are stored as (url, page, frame) tuples, where frame is the
+    utils.Frame already created for the page or None.
+    """
+
+    def __init__(self, files):
+        self.files = list(files)
+        self.groups = collections.OrderedDict()
+        self.unprobed = []
+        self.unreadable = []
+        self.rejected = []
+        self._order = {url: i for i, url in enumerate(self.files)}
+
+    def addPage(self, url, page, shape, frame=None):
+        self.groups.setdefault(shape, []).append((url, page, frame))
+
+    def addUnreadable(self, url):
+        self.unreadable.append(url)
+
+    def getReferenceShape(self):
+        """
+        Returns the shape of the first file that can be loaded.
+        """
+        best = None
+        for shape, pages in self.groups.items():
+            idx = min(self._order.get(p[0], 0) for p in pages)
+            if best is None or idx < best[0]:
+                best = (idx, shape)
+        return None if best is None else best[1]
+
+    def countPages(self):
+        return sum(len(p) for p in self.groups.values())
+
+    def getPages(self, shape):
+        pages = self.groups.get(shape, [])
+        return sorted(pages, key=lambda p: (self._order.get(p[0], 0), p[1]))
+
+    def reject(self, shape):
+        """
+        Moves all the pages with the given shape to the rejection list.
+        """
+        files = collections.OrderedDict()
+        for url, page, frame in self.getPages(shape):
+            files[url] = files.get(url, 0) + 1
+        for url, count in files.items():
+            self.rejected.append((url, count, shape))
+        self.groups.pop(shape, None)
+
+    def getReport(self, shape=None):
+        report = ''
+        for url in self.unreadable:
+            report += url+' --> '+tr.tr('cannot open image')+'\n'
+
+        for url, count, img_shape in self.rejected:
+            report += url
+            if count > 1:
+                report += ' ('+str(count)+' '+tr.tr('frames')+')'
+            report += ' --> '
+            if shape is not None and img_shape[0:2] != shape[0:2]:
+                report += tr.tr('size does not match')+':\n'
+                report += tr.tr('current size')+'='
+                report += str(shape[0])+'x'+str(shape[1])+' '
+                report += tr.tr('image size')+'='
+                report += str(img_shape[0])+'x'+str(img_shape[1])+'\n'
+            else:
+                report += tr.tr('number of channels does not match')
+                report += ':\n'+tr.tr('current channels')+'='
+                report += str(shape[2] if shape is not None else '?')+' '
+                report += tr.tr('image channels')+'='
+                report += str(img_shape[2])+'\n'
+        return report
+
+    def hasRejected(self):
+        return bool(self.unreadable or self.rejected)
+
+
+def scanFiles(files, **open_args):
+    """
+    Probes all the files in parallel and groups their pages by shape.
+    Files that cannot be probed are listed in IngestResult.unprobed
+    and must be opened with utils.Frame.
+    """
+    result = IngestResult(files)
+    infos = utils.probeFiles(result.files, **open_args)
+
+    for url, info in zip(result.files, infos):
+        if info is None:
+            result.unprobed.append(url)
+        elif len(info.pages) == 0:
+            result.addUnreadable(url)
+        else:
+            for page, (imw, imh, mode) in enumerate(info.pages):
+                shape = (imw, imh, utils.getNumberOfComponents(mode))
+                result.addPage(url, page, shape)
+
+    log.log("<lxnstack.ingest module>",
+            "scanned "+str(len(result.files))+" files: " +
+            str(result.countPages())+" frames in " +
+            str(len(result.groups))+" groups, " +
+            str(len(result.unprobed))+" files not probed",
+            level=logging.INFO)
+
+    return result
+
+
+def _decodeRawFile(url, root, subtract_black=False):
+    # NOTE: this function runs in the worker processes, so the decoded
+    #       data are written directly to the cache directory and only
+    #       the name of the file and the checkpoints are sent back
+    cr2file = utils.cr2plugin.imread(url)
+    img = cr2file.load(subtract_black=subtract_black)
+    if img is None:
+        return None
+    return (decodecache.writeData(root, img), cr2file.checkpoints)
+
+
+class BatchDecoder(QtCore.QObject):
+
+    """
+    Decodes raw files into the decode cache using a pool of worker
+    processes, so that the files are already decoded when they are
+    needed and the GUI is not blocked in the meanwhile.
+
+    The pool is created when the first files are submitted and the
+    progress is reported per file by the signals, which are emitted
+    from the thread that manages the pool.
+    """
+
+    fileDecoded = QtCore.pyqtSignal(str)
+    fileFailed = QtCore.pyqtSignal(str)
+    progressChanged = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, max_workers=None):
+        QtCore.QObject.__init__(self)
+        self.max_workers = max_workers or DEFAULT_DECODE_WORKERS
+        self._executor = None
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._done = 0
+        self._total = 0
+
+    def __repr__(self):
+        return "<lxnstack.ingest.BatchDecoder object at {0}>".format(
+            hex(id(self)))
+
+    def _getExecutor(self):
+        if self._executor is None:
+            # NOTE: forking a process that uses Qt is not safe
+            context = multiprocessing.get_context('spawn')
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.max_workers, mp_context=context)
+        return self._executor
+
+    def submit(self, files, subtract_black=False):
+        """
+        Schedules the decoding of the raw files that are not already
+        in the cache and returns the number of scheduled files. If
+        subtract_black is True the black level is subtracted from the
+        decoded data.
+        """
+        if not utils.CR2_SUPPORT:
+            return 0
+
+        formats = utils.getSupportedFormats()
+        cache = decodecache.getCache()
+        tag = utils.getRawCacheTag(subtract_black)
+        count = 0
+
+        for url in files:
+            if utils.getFileType(url, formats) != 'CR2':
+                continue
+
+            # NOTE: the key must match the one used by utils.Frame._open
+            key = cache.getKey(url, tag, 0)
+            if key is None or key in cache or cache.isPending(key):
+                continue
+
+            with self._lock:
+                if self._done == self._total:
+                    self._done = 0
+                    self._total = 0
+                self._total += 1
+                future = self._getExecutor().submit(_decodeRawFile,
+                                                    url, cache.root,
+                                                    subtract_black)
+                self._futures[future] = url
+
+            cache.setPending(key, future, url)
+            future.add_done_callback(self._fileDone)
+            count += 1
+
+        if count:
+            log.log(repr(self),
+                    "decoding "+str(count)+" raw files in background",
+                    level=logging.INFO)
+            self.progressChanged.emit(self._done, self._total)
+
+        return count
+
+    def _fileDone(self, future):
+        with self._lock:
+            url = self._futures.pop(future, '')
+            self._done += 1
+            done, total = self._done, self._total
+
+        if future.cancelled():
+            pass
+        elif future.exception() is not None:
+            log.log(repr(self),
+                    "cannot decode "+url+": "+str(future.exception()),
+                    level=logging.WARNING)
+            self.fileFailed.emit(url)
+        else:
+            self.fileDecoded.emit(url)
+
+        self.progressChanged.emit(done, total)
+        if done == total:
+            self.finished.emit()
+
+    def isRunning(self):
+        return bool(self._futures)
+
+    def cancel(self):
+        """
+        Cancels the files not yet being decoded.
+        """
+        with self._lock:
+            futures = list(self._futures.keys())
+        for future in futures:
+            future.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_batch_decoder = None
+
+
+def getBatchDecoder():
+    global _batch_decoder
+    if _batch_decoder is None:
+        _batch_decoder = BatchDecoder()
+    return _batch_decoder
@@ -19,6 +19,7 @@ import sys
 import math
 import time
 import shutil
+import concurrent.futures
 import webbrowser
 import logging
 
@@ -32,6 +33,12 @@ from . import paths
 from . import log
 from . import utils
 from . import styles
+from . import fftbackends
+from . import framecache
+from . import decodecache
+from . import videoreader
+from . import serfile
+from . import ingest
 from . import projects
 from . import videocapture
 from . import imgfeatures
@@ -40,6 +47,14 @@ from . import colormaps as cmaps
 from . import translation as tr
 from . import lightcurves as lcurves
 
+# indexes of the bayer matrices as used by theApp.debayerize
+BAYER_MATRIX_INDEXES = {'RGGB': 0, 'GRBG': 1, 'BGGR': 2, 'GBRG': 3}
+
+# pixels added around the star apertures when only the regions of the
+# frames used by the photometry are loaded, to leave room for the
+# debayering and the hot pixels correction
+PHOTOMETRY_MARGIN = 8
+
 
 def Int(val):
     i = math.floor(val)
@@ -69,8 +84,10 @@ class theApp(Qt.QObject):
         self._updating_feature = False     # used to avoid recursion loop
         self._photo_time_clock = 0
         self._phase_align_data = None
+        self.registration_cache = projects.RegistrationCache()
 
         self.current_match_mode = cv2.TM_SQDIFF  # TODO: Add selection box
+        self._aap_templates = {}
 
         self._generateOpenStrings()
 
@@ -124,6 +141,7 @@ class theApp(Qt.QObject):
 
         self.aap_rectangle = (256, 256)
         self.aap_wholeimage = 0
+        self.aap_outliers_kappa = 3.0
 
         self.manual_align = False
 
@@ -198,15 +216,26 @@ class theApp(Qt.QObject):
         self.phase_interpolation_order = 0
         self.interpolation_order = 0
         self.use_image_time = True
+        self.fft_backend = fftbackends.DEFAULT_BACKEND
+        self.fft_threads = 1
+        self.frame_cache_size = framecache.DEFAULT_BUDGET//(1024*1024)  # MiB
+        self.checked_frame_cache_spill = 0
+        self.decode_cache_path = paths.CACHE_PATH
+        self.decode_cache_size = decodecache.DEFAULT_MAX_SIZE//(1024*1024)
 
         self.progress_dialog = Qt.QProgressDialog()
         self.progress_dialog.canceled.connect(self.canceled)
 
         self.frame_open_args = {'rgb_fits_mode': True,
                                 'convert_cr2': False,
+                                'cr2_black_level': False,
                                 'assume_localtime': False,
                                 'progress_bar': self.progress_dialog}
 
+        self.batch_decoder = ingest.getBatchDecoder()
+        self.batch_decoder.progressChanged.connect(
+            self._updateDecodingProgress)
+
         self.current_cap_device = None
         self.current_cap_device_title = ""
         self.video_writer = cv2.VideoWriter()
@@ -442,7 +471,8 @@ class theApp(Qt.QObject):
             self.loadProject(self.args['load_project'])
 
         if self.args['add_images'] is not None:
-            self.loadFiles(self.args['add_images'])
+            self.loadFiles(self.args['add_images'],
+                           predecode=self.args['predecode_raw'] or None)
 
         if self.args['align'] is not None:
             self.wnd.toolBox.setCurrentIndex(1)
@@ -635,6 +665,8 @@ class theApp(Qt.QObject):
             int(self.frame_open_args['rgb_fits_mode'])*2)
         self.dlg._dialog.decodeCR2CheckBox.setCheckState(
             int(self.frame_open_args['convert_cr2'])*2)
+        self.dlg._dialog.blackCR2CheckBox.setCheckState(
+            int(self.frame_open_args['cr2_black_level'])*2)
 
         self.dlg._dialog.devComboBox.setCurrentIndex(
             self.current_cap_combo_idx)
@@ -683,6 +715,22 @@ class theApp(Qt.QObject):
         self.dlg._dialog.themeListWidget.setCurrentRow(
             self.current_style)
 
+        self.dlg._dialog.fftBackendComboBox.setCurrentIndex(
+            self.dlg._dialog.fftBackendComboBox.findText(self.fft_backend))
+
+        self.dlg._dialog.fftThreadsSpinBox.setValue(self.fft_threads)
+
+        self.dlg._dialog.frameCacheSpinBox.setValue(self.frame_cache_size)
+
+        self.dlg._dialog.frameCacheSpillCheckBox.setCheckState(
+            self.checked_frame_cache_spill)
+
+        self.dlg._dialog.decodeCachePathLineEdit.setText(
+            self.decode_cache_path)
+
+        self.dlg._dialog.decodeCacheSizeSpinBox.setValue(
+            self.decode_cache_size)
+
         if self.checked_custom_temp_dir == 2:
             self.temp_path = os.path.expandvars(self.custom_temp_path)
         else:
@@ -842,6 +890,9 @@ class theApp(Qt.QObject):
             self.frame_open_args['convert_cr2'] = bool(
                 int(self.dlg._dialog.decodeCR2CheckBox.checkState()) == 2)
 
+            self.frame_open_args['cr2_black_level'] = bool(
+                int(self.dlg._dialog.blackCR2CheckBox.checkState()) == 2)
+
             self.checked_autodetect_min_quality = int(
                 self.dlg._dialog.minQualitycheckBox.checkState())
 
@@ -863,6 +914,26 @@ class theApp(Qt.QObject):
             self.current_style = int(
                     self.dlg._dialog.themeListWidget.currentRow())
 
+            self.fft_backend = str(
+                self.dlg._dialog.fftBackendComboBox.currentText())
+
+            self.fft_threads = int(
+                self.dlg._dialog.fftThreadsSpinBox.value())
+
+            fftbackends.setBackend(self.fft_backend, self.fft_threads)
+
+            self.frame_cache_size = int(
+                self.dlg._dialog.frameCacheSpinBox.value())
+
+            self.checked_frame_cache_spill = int(
+                self.dlg._dialog.frameCacheSpillCheckBox.checkState())
+
+            self.decode_cache_path = str(
+                self.dlg._dialog.decodeCachePathLineEdit.text())
+
+            self.decode_cache_size = int(
+                self.dlg._dialog.decodeCacheSizeSpinBox.value())
+
             self.saveSettings()
 
             if self.checked_custom_temp_dir == 2:
@@ -870,6 +941,8 @@ class theApp(Qt.QObject):
             else:
                 self.temp_path = paths.TEMP_PATH
 
+            self._setupCaches()
+
             return True
         else:
             # discard changes
@@ -1310,6 +1383,7 @@ class theApp(Qt.QObject):
             if val == Qt.QMessageBox.Yes:
                 self.stopDirectVideoCapture()
                 self.canceled()
+                self.batch_decoder.shutdown()
                 self.saveSettings()
                 if os.path.exists(paths.TEMP_PATH):
                     shutil.rmtree(paths.TEMP_PATH)
@@ -1359,6 +1433,10 @@ class theApp(Qt.QObject):
             "toolbar_locked",
             bool(self.action_lock_toolbars.isChecked()))
 
+        settings.setValue(
+            "quick_look",
+            bool(self.action_quick_look.isChecked()))
+
         settings.setValue(
             "auto_rgb_fits",
             int(self.dlg._dialog.rgbFitsCheckBox.checkState()))
@@ -1367,6 +1445,10 @@ class theApp(Qt.QObject):
             "auto_convert_cr2",
             int(self.dlg._dialog.decodeCR2CheckBox.checkState()))
 
+        settings.setValue(
+            "cr2_black_level",
+            int(self.dlg._dialog.blackCR2CheckBox.checkState()))
+
         settings.setValue(
             "auto_search_dark_flat",
             int(self.dlg._dialog.autoFolderscheckBox.checkState()))
@@ -1419,6 +1501,18 @@ class theApp(Qt.QObject):
                           str(self.custom_temp_path))
         settings.setValue("use_zipped_tempfiles",
                           int(self.checked_compressed_temp))
+        settings.setValue("fft_backend",
+                          str(self.fft_backend))
+        settings.setValue("fft_threads",
+                          int(self.fft_threads))
+        settings.setValue("frame_cache_size",
+                          int(self.frame_cache_size))
+        settings.setValue("frame_cache_spill",
+                          int(self.checked_frame_cache_spill))
+        settings.setValue("decode_cache_path",
+                          str(self.decode_cache_path))
+        settings.setValue("decode_cache_size",
+                          int(self.decode_cache_size))
         current_style_item = self.dlg._dialog.themeListWidget.item(
                 self.current_style)
         settings.setValue("current_style_name",
@@ -1448,8 +1542,14 @@ class theApp(Qt.QObject):
             "use_whole_image", None, int)
         self.action_lock_toolbars.setChecked(settings.value(
             "toolbar_locked", None, bool))
+        self.action_quick_look.setChecked(settings.value(
+            "quick_look", False, bool))
         self.dlg._dialog.decodeCR2CheckBox.setCheckState(settings.value(
             "auto_convert_cr2", None, int))
+        self.dlg._dialog.blackCR2CheckBox.setCheckState(settings.value(
+            "cr2_black_level", 0, int))
+        self.frame_open_args['cr2_black_level'] = bool(
+            int(self.dlg._dialog.blackCR2CheckBox.checkState()) == 2)
         self.dlg._dialog.rgbFitsCheckBox.setCheckState(settings.value(
             "auto_rgb_fits", None, int))
         self.checked_seach_dark_flat = settings.value(
@@ -1485,6 +1585,18 @@ class theApp(Qt.QObject):
             "custom_temp_path", None, str))
         self.checked_compressed_temp = int(settings.value(
             "use_zipped_tempfiles", None, int))
+        self.fft_backend = str(settings.value(
+            "fft_backend", fftbackends.DEFAULT_BACKEND, str))
+        self.fft_threads = max(int(settings.value(
+            "fft_threads", 1, int)), 1)
+        self.frame_cache_size = max(int(settings.value(
+            "frame_cache_size", self.frame_cache_size, int)), 0)
+        self.checked_frame_cache_spill = int(settings.value(
+            "frame_cache_spill", 0, int))
+        self.decode_cache_path = str(settings.value(
+            "decode_cache_path", paths.CACHE_PATH, str))
+        self.decode_cache_size = max(int(settings.value(
+            "decode_cache_size", self.decode_cache_size, int)), 0)
         current_style_name = str(settings.value(
             "current_style_name", None, str))
         current_style_item = self.dlg._dialog.themeListWidget.findItems(
@@ -1511,6 +1623,33 @@ class theApp(Qt.QObject):
 
         self.changeAlignMethod(self.current_align_method)
 
+        fftbackends.setBackend(self.fft_backend, self.fft_threads)
+        self.fft_backend = fftbackends.getBackend().name
+
+        self._setupCaches()
+
+    def _setupCaches(self):
+        cache = framecache.getCache()
+        cache.setBudget(self.frame_cache_size*1024*1024)
+        if self.checked_frame_cache_spill == 2:
+            # NOTE: spilled frames can use up to four times the
+            #       memory budget on disk
+            cache.spill_budget = 4*cache.budget
+            if self.checked_custom_temp_dir == 2:
+                temp_path = os.path.expandvars(self.custom_temp_path)
+            else:
+                temp_path = paths.TEMP_PATH
+            cache.setSpillDir(os.path.join(temp_path, 'framecache'))
+        else:
+            cache.setSpillDir(None)
+        log.log(repr(self),
+                "frame cache budget: "+str(self.frame_cache_size)+" MiB",
+                level=logging.DEBUG)
+
+        decoded = decodecache.getCache()
+        decoded.setRoot(self.decode_cache_path or paths.CACHE_PATH)
+        decoded.setMaxSize(self.decode_cache_size*1024*1024)
+
     def deselectAllListWidgetsItems(self):
         self.wnd.lightListWidget.setCurrentItem(None)
         self.wnd.biasListWidget.setCurrentItem(None)
@@ -1575,7 +1714,11 @@ class theApp(Qt.QObject):
         iv = self.mdi_windows[sw]['widget']
 
         if type(image) == utils.Frame:
-            iv.showImage(self.debayerize(image.getData(asarray=True)))
+            if self.action_quick_look.isChecked():
+                data = image.getPreviewData()
+            else:
+                data = image.getData(asarray=True)
+            iv.showImage(self.debayerize(data))
             self.mdi_windows[sw]['references'] = [image, ]
             iv.image_name = image.name
             iv.image_features = image.getAllFeatures()
@@ -1938,6 +2081,15 @@ class theApp(Qt.QObject):
             self.updateBayerMatrix)
         self.action_enable_rawmode.setCheckable(True)
 
+        self.action_quick_look = QAction(
+            utils.getQIcon("insert-image"),
+            tr.tr('Quick-look raw previews'), self)
+        self.action_quick_look.setToolTip(
+            tr.tr('Show the JPEG previews embedded in the raw files ' +
+                  'instead of decoding the raw data'))
+        self.action_quick_look.setCheckable(True)
+        self.action_quick_look.toggled.connect(self.updateQuickLook)
+
         self.action_edit_channel_mapping = QAction(
             utils.getQIcon("channel-mapping"),
             tr.tr('Edit photometric bands mapping'), self)
@@ -2083,6 +2235,7 @@ class theApp(Qt.QObject):
         self.bayer_tcb.addItem(utils.getQIcon("bayer-gbrg"), "GBRG")
         self.bayer_tcb.addItem(utils.getQIcon("bayer-bggr"), "BGGR")
 
+        toolbar.addAction(self.action_quick_look)
         toolbar.addAction(self.action_enable_rawmode)
         self.action_bayer = toolbar.addWidget(self.bayer_tcb)
 
@@ -2200,7 +2353,63 @@ class theApp(Qt.QObject):
                     msg,
                     level=logging.ERROR)
 
-    def loadFiles(self, newlist=None):
+    def _ingestFiles(self, paths, shape=None, exclude=(), open_args=None):
+        """
+        Probes the files referred by paths (files, directories or glob
+        patterns) and groups their frames by size and number of
+        channels. Only the frames having the given shape, or the shape
+        of the first loadable file when shape is None, are accepted.
+        Returns the tuple (result, shape) where result is the
+        ingest.IngestResult of the files.
+        """
+        if open_args is None:
+            open_args = self.frame_open_args
+
+        files = [f for f in ingest.expandPaths(paths) if f not in exclude]
+
+        self.statusBar.showMessage(tr.tr('Analyzing images, please wait...'))
+        result = ingest.scanFiles(files, **open_args)
+
+        # files whose headers cannot be probed are opened the usual way
+        # and their frames are kept, so they are not opened twice
+        for url in result.unprobed:
+            page = 0
+            img = utils.Frame(url, page, **open_args)
+            if not img.is_good:
+                result.addUnreadable(url)
+                continue
+            while img.is_good:
+                result.addPage(url, page,
+                               (img.width, img.height,
+                                img.getNumberOfComponents()),
+                               img)
+                page += 1
+                img = utils.Frame(url, page, **open_args)
+
+        if shape is None:
+            shape = result.getReferenceShape()
+
+        for img_shape in list(result.groups.keys()):
+            if img_shape != shape:
+                result.reject(img_shape)
+
+        return (result, shape)
+
+    def _showRejectedMsgBox(self, report):
+        msgBox = Qt.QMessageBox(self.wnd)
+        msgBox.setText(tr.tr("Some images have different size or number " +
+                             "of channels and will been ignored.\n"))
+        msgBox.setInformativeText(tr.tr("All images must have the " +
+                                        "same size and number of " +
+                                        "channels.\n\n") +
+                                  tr.tr("Click the \'Show Details' " +
+                                        "button for more information.\n"))
+        msgBox.setDetailedText(report)
+        msgBox.setIcon(Qt.QMessageBox.Warning)
+        msgBox.exec_()
+        del msgBox
+
+    def loadFiles(self, newlist=None, predecode=None):
 
         oldlist = self.framelist[:]
 
@@ -2221,25 +2430,41 @@ class theApp(Qt.QObject):
         if not newlist:
             return
 
+        if predecode is None:
+            predecode = self.frame_open_args['convert_cr2']
+
+        if predecode:
+            # raw files are decoded in background by the batch decoder
+            open_args = dict(self.frame_open_args, convert_cr2=False)
+        else:
+            open_args = self.frame_open_args
+
         if self.framelist:
-            imw = self.currentWidth
-            imh = self.currentHeight
-            dep = self.currentDepht
+            shape = (self.currentWidth,
+                     self.currentHeight,
+                     self.currentDepht)
         else:
-            ref = utils.Frame(str(newlist[0]), **self.frame_open_args)
-            if not ref.is_good:
-                msgBox = Qt.QMessageBox(self.wnd)
-                msgBox.setText(tr.tr("Cannot open image") +
-                               " \""+str(ref.url)+"\"")
-                msgBox.setIcon(Qt.QMessageBox.Critical)
-                msgBox.exec_()
-                return False
-            imw = ref.width
-            imh = ref.height
-            dep = ref.getNumberOfComponents()
+            shape = None
+
+        self.lock()
+        result, shape = self._ingestFiles(
+            newlist, shape,
+            exclude=set(f.url for f in self.framelist),
+            open_args=open_args)
+        self.unlock()
 
-            del ref
+        if shape is None:
+            msgBox = Qt.QMessageBox(self.wnd)
+            msgBox.setText(tr.tr("Cannot open image") +
+                           " \""+str(newlist[0])+"\"")
+            msgBox.setDetailedText(result.getReport())
+            msgBox.setIcon(Qt.QMessageBox.Critical)
+            msgBox.exec_()
+            return False
 
+        imw, imh, dep = shape
+
+        if not self.framelist:
             self.currentWidth = imw
             self.currentHeight = imh
             self.currentDepht = dep
@@ -2253,55 +2478,26 @@ class theApp(Qt.QObject):
                 self.dlg._dialog.rWSpinBox.setValue(r_l)
                 self.dlg._dialog.rHSpinBox.setValue(r_l)
 
-        self.current_dir = os.path.dirname(str(newlist[0]))
-        rejected = ''
+        if result.files:
+            self.current_dir = os.path.dirname(result.files[0])
 
-        self.progress.setMaximum(len(newlist))
+        pages = result.getPages(shape)
+
+        self.progress.setMaximum(len(pages))
         self.lock()
-        self.statusBar.showMessage(tr.tr('Analyzing images, please wait...'))
+        self.statusBar.showMessage(tr.tr('Loading files, please wait...'))
         count = 0
-        warnings = False
         listitemslist = []
-        for i in newlist:
+        for url, page, img in pages:
             count += 1
-            if not (i in self.framelist):
-                # TODO:fix here: string must be compared to string
-                page = 0
-                img = utils.Frame(str(i), page, **self.frame_open_args)
-                if not img.is_good:
-                    msgBox = Qt.QMessageBox(self.wnd)
-                    msgBox.setText(tr.tr("Cannot open image") +
-                                   " \""+str(i)+"\"")
-                    msgBox.setIcon(Qt.QMessageBox.Critical)
-                    msgBox.exec_()
-                    continue
-
-                while img.is_good:
-                    if (imw, imh) != (img.width, img.height):
-                        warnings = True
-                        rejected += img.url+' --> '
-                        rejected += tr.tr('size does not match')+':\n'
-                        rejected += tr.tr('current size')+'='
-                        rejected += str(self.currentWidth)+'x'
-                        rejected += str(self.currentHeight)+' '
-                        rejected += tr.tr('image size')+'='
-                        rejected += str(img.width)+'x'+str(img.height)+'\n'
-                    elif dep != img.getNumberOfComponents():
-                        warnings = True
-                        rejected += img.url+' --> '
-                        rejected += tr.tr('number of channels does not match')
-                        rejected += ':\n'+tr.tr('current channels')+'='
-                        rejected += str(self.currentDepht)+' '
-                        rejected += tr.tr('image channels')+'='
-                        rejected += str(img.getNumberOfComponents())+'\n'
-                    else:
-                        self.addFrameListWidgetItem(img, listitemslist)
-                        img.addProperty('frametype', utils.LIGHT_FRAME_TYPE)
-                        self.framelist.append(img)
-                    page += 1
-                    img = utils.Frame(str(i), page, **self.frame_open_args)
-                    if self.progressWasCanceled():
-                        break
+            if img is None:
+                img = utils.Frame(url, page, **open_args)
+            if img.is_good:
+                self.addFrameListWidgetItem(img, listitemslist)
+                img.addProperty('frametype', utils.LIGHT_FRAME_TYPE)
+                self.framelist.append(img)
+            elif page == 0:
+                result.addUnreadable(url)
 
             self.progress.setValue(count)
             if self.progressWasCanceled():
@@ -2312,24 +2508,13 @@ class theApp(Qt.QObject):
         for item in listitemslist:
             self.wnd.lightListWidget.addItem(item)
 
-        newlist = []
-
-        if warnings:
-            msgBox = Qt.QMessageBox(self.wnd)
-
-            msgBox.setText(tr.tr("Some images have different size or number " +
-                                 "of channels and will been ignored.\n"))
-
-            msgBox.setInformativeText(tr.tr("All images must have the " +
-                                            "same size and number of " +
-                                            "channels.\n\n") +
-                                      tr.tr("Click the \'Show Details' " +
-                                            "button for more information.\n"))
+        if predecode:
+            self.batch_decoder.submit(
+                [url for url, page, img in pages if page == 0],
+                self.frame_open_args['cr2_black_level'])
 
-            msgBox.setDetailedText(rejected)
-            msgBox.setIcon(Qt.QMessageBox.Warning)
-            msgBox.exec_()
-            del msgBox
+        if result.hasRejected():
+            self._showRejectedMsgBox(result.getReport(shape))
 
         self.wnd.manualAlignGroupBox.setEnabled(True)
 
@@ -2361,9 +2546,34 @@ class theApp(Qt.QObject):
 
         if self.framelist:
             self.unlockSidebar()
+            self._applyBayerPattern(self.framelist[0])
 
         self.statusBar.showMessage(tr.tr('Ready'))
 
+    def _applyBayerPattern(self, frame):
+        """
+        Enables the raw-mode if the frames declare their bayer matrix,
+        like the raw SER sequences do.
+        """
+        pattern = frame.properties.get('BAYERPAT')
+        if pattern not in BAYER_MATRIX_INDEXES or frame.isRGB():
+            return
+
+        log.log(repr(self),
+                "using the bayer matrix of the frames: "+pattern,
+                level=logging.INFO)
+        self.bayer_tcb.setCurrentIndex(BAYER_MATRIX_INDEXES[pattern])
+        self.action_enable_rawmode.setChecked(True)
+        self.updateBayerMatrix()
+
+    def _updateDecodingProgress(self, done, total):
+        if done < total:
+            self.statusBar.showMessage(
+                tr.tr('Decoding raw files') + ': ' +
+                str(done) + '/' + str(total))
+        else:
+            self.statusBar.showMessage(tr.tr('Raw files decoded'))
+
     def doAddBiasFiles(self, clicked):
         self.addBiasFiles()
 
@@ -2427,12 +2637,36 @@ class theApp(Qt.QObject):
         q.setToolTip(frame.long_tool_name)
         # TODO: Check for circular dependencies!
         q.target_image = frame
+        if self.action_quick_look.isChecked():
+            icon = frame.getThumbnail()
+            if icon is not None:
+                q.setIcon(icon)
         frame.addProperty('listItem', q)
         if type(framelistwidget) is QtGui.QListWidget:
             framelistwidget.addItem(q)
         else:
             framelistwidget.append(q)
 
+    def updateQuickLook(self, checked):
+        """
+        Shows or hides the thumbnails of the raw frames in the lists.
+        """
+        for listwidget in (self.wnd.lightListWidget,
+                           self.wnd.darkListWidget,
+                           self.wnd.flatListWidget,
+                           self.wnd.biasListWidget):
+            if checked:
+                listwidget.setIconSize(QtCore.QSize(48, 32))
+            for i in range(listwidget.count()):
+                item = listwidget.item(i)
+                icon = None
+                if checked:
+                    try:
+                        icon = item.target_image.getThumbnail()
+                    except AttributeError:
+                        pass
+                item.setIcon(icon or QtGui.QIcon())
+
     def addFrameFiles(self, frametype, framelistwidget, framelist, clearbutton,
                       directory=None, ignoreErrors=False):
         if directory is None:
@@ -2448,48 +2682,33 @@ class theApp(Qt.QObject):
                 utils.DIALOG_OPTIONS))
 
         elif os.path.exists(directory) and os.path.isdir(directory):
-            files = []
-            lst = os.listdir(directory)
-            for x in lst:
-                files.append(os.path.join(directory, x))
+            files = [directory]
         else:
             return False
 
-        self.progress.setMaximum(len(files))
         self.lock()
+        result, shape = self._ingestFiles(
+            files,
+            (self.currentWidth, self.currentHeight, self.currentDepht),
+            exclude=set(f.url for f in framelist))
+
+        pages = result.getPages(shape)
+        self.progress.setMaximum(len(pages))
         count = 0
-        warnings = False
-        rejected = ""
 
-        for fn in files:
+        for url, page, img in pages:
 
             QtGui.QApplication.instance().processEvents()
             self.progress.setValue(count)
 
-            if (os.path.isfile(str(fn))):  # TODO: check for duplicates
-                page = 0
-                i = utils.Frame(str(fn), page, **self.frame_open_args)
-                if not i.is_good:
-                    if not ignoreErrors:
-                        msgBox = Qt.QMessageBox(self.wnd)
-                        msgBox.setText(tr.tr("Cannot open image") +
-                                       " \""+str(fn)+"\"")
-                        msgBox.setIcon(Qt.QMessageBox.Critical)
-                        msgBox.exec_()
-                    continue
-                while i.is_good:
-                    if ((self.currentWidth == i.width) and
-                            (self.currentHeight == i.height) and
-                            (self.currentDepht == i.getNumberOfComponents())):
-                        framelist.append(i)
-                        self.addFrameListWidgetItem(i, framelistwidget)
-                        i.addProperty('frametype', str(frametype))
-                    else:
-                        warnings = True
-                        rejected += i.url+"\n"
-                        break
-                    page += 1
-                    i = utils.Frame(str(fn), page, **self.frame_open_args)
+            if img is None:
+                img = utils.Frame(url, page, **self.frame_open_args)
+            if img.is_good:
+                framelist.append(img)
+                self.addFrameListWidgetItem(img, framelistwidget)
+                img.addProperty('frametype', str(frametype))
+            elif page == 0:
+                result.addUnreadable(url)
 
             if self.progressWasCanceled():
                 return False
@@ -2497,19 +2716,11 @@ class theApp(Qt.QObject):
 
         self.unlock()
 
-        if warnings:
-            msgBox = Qt.QMessageBox(self.wnd)
-            msgBox.setText(tr.tr("Some images have different size or number " +
-                                 "of channels and will been ignored.\n"))
-            msgBox.setInformativeText(tr.tr("All images must have the " +
-                                            "same size and number of " +
-                                            "channels.\n\n") +
-                                      tr.tr("Click the \'Show Details' " +
-                                            "button for more information.\n"))
-            msgBox.setDetailedText(rejected)
-            msgBox.setIcon(Qt.QMessageBox.Warning)
-            msgBox.exec_()
-            del msgBox
+        if ignoreErrors:
+            result.unreadable = []
+
+        if result.hasRejected():
+            self._showRejectedMsgBox(result.getReport(shape))
 
         if (len(framelist) == 0):
             return False
@@ -3374,6 +3585,13 @@ class theApp(Qt.QObject):
         self.result_d = 3
 
         self.transf_coeff_table = {}
+        self._aap_templates = {}
+        self.registration_cache.clear()
+        framecache.getCache().logStats()
+        framecache.getCache().clear()
+        videoreader.closeAll()
+        serfile.closeAll()
+        self.batch_decoder.cancel()
         self.channel_mapping = {}
 
         self.current_project_fname = None
@@ -3521,6 +3739,8 @@ class theApp(Qt.QObject):
         except Exception as exc:
             return self.corruptedMsgBox(str(exc))
 
+        self._saveRegistrationCache()
+
         wnd_title = str(paths.PROGRAM_NAME)
         wnd_title += ' ['+self.current_project_fname+']'
         self.wnd.setWindowTitle(wnd_title)
@@ -3552,6 +3772,9 @@ class theApp(Qt.QObject):
 
         self.current_project_fname = project_fname
 
+        self.registration_cache.load(
+            projects.getRegistrationCacheURL(project_fname))
+
         log.log(repr(self),
                 'setting up project environment',
                 level=logging.DEBUG)
@@ -3700,82 +3923,171 @@ class theApp(Qt.QObject):
         current_point = self.wnd.alignPointsListWidget.currentRow()
         self.statusBar.showMessage(tr.tr('detecting points, please wait...'))
 
-        current_frame = self.framelist[image_idx]
+        result = self._autoPointsCv(image_idx)
 
-        for point_idx in range(len(current_frame.alignpoints)):
-            self.point_idx = point_idx
-            if not self._autoPointCv(point_idx, image_idx):
-                self.wnd.alignPointsListWidget.setCurrentRow(current_point)
-                return False
         self.wnd.alignPointsListWidget.setCurrentRow(current_point)
         self.point_idx = current_point
 
-    def _autoPointCv(self, point_idx, image_idx=0):
-        point = self.framelist[image_idx].alignpoints[point_idx]
+        return result
+
+    def _getAlignPointTemplates(self, frame, points, r_w, r_h):
+        """
+        Returns a dictionary that maps each index in 'points' to a
+        tuple (template, dx, dy), where (dx, dy) is the position of
+        the align point relative to the top-left corner of the
+        template. The templates are cached and the image data of
+        the reference frame is loaded only if one of the points has
+        been moved since the last call.
+        """
+        templates = {}
+        rawi = None
+
+        for point_idx in points:
+            point = frame.alignpoints[point_idx]
+            px = Int(point.x)
+            py = Int(point.y)
+            key = (frame.long_tool_name, point.id)
+            geometry = (px, py, r_w, r_h)
+
+            if key in self._aap_templates:
+                cached = self._aap_templates[key]
+                if cached[0] == geometry:
+                    templates[point_idx] = cached[1]
+                    continue
+
+            if rawi is None:
+                rawi = frame.getData(asarray=True)
+
+            imh, imw = rawi.shape[0:2]
+            x1 = max(px-r_w, 0)
+            x2 = min(px+r_w, imw)
+            y1 = max(py-r_h, 0)
+            y2 = min(py+r_h, imh)
+
+            tmpl = np.ascontiguousarray(rawi[y1:y2, x1:x2],
+                                        dtype=np.float32)
+            self._aap_templates[key] = (geometry, (tmpl, px-x1, py-y1))
+            templates[point_idx] = (tmpl, px-x1, py-y1)
+
+        del rawi
+
+        return templates
+
+    def _autoPointsCv(self, image_idx=0):
+        ref_frame = self.framelist[image_idx]
+        total_frames = len(self.framelist)
 
-        # if already detected and not moved
-        skip = True
-        for i in range(len(self.framelist)):
-            skip &= self.framelist[i].alignpoints[point_idx].aligned
+        # if already detected and not moved then skip
+        points = []
+        for point_idx in range(len(ref_frame.alignpoints)):
+            skip = True
+            for frm in self.framelist:
+                skip &= frm.alignpoints[point_idx].aligned
+            if not skip:
+                points.append(point_idx)
 
-        # then skip
-        if skip:
+        if not points:
             return True
 
         r_w = Int(self.aap_rectangle[0]/2)
         r_h = Int(self.aap_rectangle[1]/2)
-        x1 = point.x-r_w
-        x2 = point.x+r_w
-        y1 = point.y-r_h
-        y2 = point.y+r_h
 
-        rawi = self.framelist[image_idx].getData(asarray=True)
-        refi = rawi[y1:y2, x1:x2]
-        del rawi
+        self.progress.setMaximum(total_frames-1)
+        self.lock()
 
-        cv_ref = refi.astype(np.float32)
-        del refi
+        templates = self._getAlignPointTemplates(ref_frame, points, r_w, r_h)
 
-        self.progress.setMaximum(len(self.framelist)-1)
-        self.lock()
+        # NOTE: the search window in each frame is centered on the
+        #       position predicted from the motion of the point in
+        #       the previous frames, so the frames are processed
+        #       walking away from the reference frame in both the
+        #       directions, while the points of a frame are matched
+        #       concurrently (cv2 releases the GIL).
+        order = (list(range(image_idx+1, total_frames)) +
+                 list(range(image_idx-1, -1, -1)))
 
-        for i in range(len(self.framelist)):
-            self.progress.setValue(i)
+        tracks = {}
+        count = 0
 
-            frm = self.framelist[i]
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(len(points), os.cpu_count() or 1)))
 
-            if self.progressWasCanceled():
-                return False
+        try:
+            for i in order:
+                self.progress.setValue(count)
+                count += 1
 
-            if i == image_idx:
-                continue
-            msg = tr.tr('detecting point')+' '+str(point_idx+1)+' '
-            msg += tr.tr('of')+' '
-            msg += str(len(self.framelist[image_idx].alignpoints))
-            msg += tr.tr(' ')+tr.tr('on image')+tr.tr(' ')+str(i)
-            msg += tr.tr(' ')+tr.tr('of')+tr.tr(' ')+str(len(self.framelist)-1)
-            self.statusBar.showMessage(msg)
-
-            if self.aap_wholeimage == 2:
-                rawi = frm.getData(asarray=True)
-            else:
-                rawi = frm.getData(asarray=True)[y1-r_h:y2+r_h, x1-r_w:x2+r_w]
+                if self.progressWasCanceled():
+                    return False
+
+                if i == image_idx+1 or i == image_idx-1:
+                    # starting a new walk from the reference frame
+                    for point_idx in points:
+                        pnt = ref_frame.alignpoints[point_idx]
+                        tracks[point_idx] = [Int(pnt.x), Int(pnt.y), 0, 0]
 
-            cv_im = rawi.astype(np.float32)
+                msg = tr.tr('detecting points on image')+' '+str(i)+' '
+                msg += tr.tr('of')+' '+str(total_frames-1)
+                self.statusBar.showMessage(msg)
 
-            del rawi
+                frm = self.framelist[i]
 
-            # TODO: fix error occurring when
-            #       align-rectangle is outside the image
-            res = cv2.matchTemplate(cv_im, cv_ref, self.current_match_mode)
-            minmax = cv2.minMaxLoc(res)
-            del res
-            if self.aap_wholeimage == 2:
-                frm.alignpoints[point_idx].x = minmax[2][0]+r_w
-                frm.alignpoints[point_idx].y = minmax[2][1]+r_h
-            else:
-                frm.alignpoints[point_idx].x = minmax[2][0]+x1
-                frm.alignpoints[point_idx].y = minmax[2][1]+y1
+                # each frame is loaded only once for all the points
+                cv_im = frm.getData(asarray=True).astype(np.float32)
+                imh, imw = cv_im.shape[0:2]
+
+                jobs = {}
+                for point_idx in points:
+                    tmpl, dx, dy = templates[point_idx]
+                    th, tw = tmpl.shape[0:2]
+
+                    if self.aap_wholeimage == 2:
+                        x1, y1, x2, y2 = 0, 0, imw, imh
+                    else:
+                        px, py, vx, vy = tracks[point_idx]
+                        x1 = px + vx - dx - r_w
+                        y1 = py + vy - dy - r_h
+                        x2 = x1 + tw + 2*r_w
+                        y2 = y1 + th + 2*r_h
+
+                    jobs[point_idx] = pool.submit(utils.matchTemplate,
+                                                  cv_im, tmpl,
+                                                  x1, y1, x2, y2,
+                                                  self.current_match_mode)
+
+                for point_idx in points:
+                    tmpl, dx, dy = templates[point_idx]
+                    loc = jobs[point_idx].result()
+                    track = tracks[point_idx]
+
+                    if loc is None:
+                        log.log(repr(self),
+                                "align point "+str(point_idx) +
+                                " is outside the image "+frm.name,
+                                level=logging.WARNING)
+                        continue
+
+                    nx = loc[0]+dx
+                    ny = loc[1]+dy
+
+                    # updating the predicted motion
+                    track[2] = nx - track[0]
+                    track[3] = ny - track[1]
+                    track[0] = nx
+                    track[1] = ny
+
+                    frm.alignpoints[point_idx].x = nx
+                    frm.alignpoints[point_idx].y = ny
+                    frm.alignpoints[point_idx].aligned = True
+
+                del cv_im
+        finally:
+            pool.shutdown()
+
+        # NOTE: the points that have not been found in some frames
+        #       are not marked, so they are searched again next time
+        for point_idx in points:
+            ref_frame.alignpoints[point_idx].aligned = True
 
         self.unlock()
 
@@ -3837,58 +4149,6 @@ class theApp(Qt.QObject):
 
         return result
 
-    def _derotateAlignPoints(self, var_matrix):
-        vecslist = []
-
-        for i in self.framelist:
-            _tmp = []
-
-            for p in i.alignpoints:
-                _tmp.append(np.array([p.x, p.y])-i.offset[0:2])
-
-            vecslist.append(_tmp)
-
-        del _tmp
-
-        refs = vecslist[0]
-        nvecs = len(vecslist[0])
-        angles = [0]
-
-        for vecs in vecslist[1:]:
-            angle = 0
-            for i in range(nvecs):
-
-                x1 = refs[i][0]
-                y1 = refs[i][1]
-                x2 = vecs[i][0]
-                y2 = vecs[i][1]
-
-                vmod = (vecs[i][0]**2 + vecs[i][1]**2)**0.5
-                rmod = (refs[i][0]**2 + refs[i][1]**2)**0.5
-
-                if (vmod == 0) or (rmod == 0):
-                    continue
-
-                cosa = ((x1*x2 + y1*y2)/(vmod*rmod))
-                sina = ((x2*y1 - x1*y2)/(vmod*rmod))
-
-                if cosa > 1:
-                    # this should never never never occur
-                    cosa = 1.0
-
-                if sina > 1:
-                    # this should never never never occur
-                    sina = 1.0
-
-                angle += (math.atan2(sina, cosa)*180.0/math.pi)*var_matrix[i]
-
-            angle /= var_matrix.sum()
-
-            angles.append(angle)
-
-        for i in range(len(self.framelist)):
-            self.framelist[i].angle = -angles[i]
-
     def _alignAlignPoints(self, align, derotate):
         if not self.framelist:
             return False
@@ -3903,73 +4163,59 @@ class theApp(Qt.QObject):
             self.progress.setMaximum(total_images-1)
             self.lock()
 
-            mat = np.zeros((total_images, total_points, 2))
+            mat = np.array([[(p.x, p.y) for p in img.alignpoints]
+                            for img in self.framelist],
+                           dtype=np.float64)
 
-            for i in range(total_images):
-                for j in range(total_points):
-                    p = self.framelist[i].alignpoints[j]
-                    mat[i, j, 0] = p.x
-                    mat[i, j, 1] = p.y
-
-            x_stk = mat[..., 0].mean()
-            y_stk = mat[..., 1].mean()
+            # weighting each point with the inverse of the variance
+            # of its squared distance from the mean position
+            dist = ((mat - mat.mean(axis=(0, 1)))**2).sum(2)
 
-            mat2 = mat-[x_stk, y_stk]
+            # Added 0.00000001 to avoid division by zero
+            w = 1/(dist.var(0)+0.00000001)
+            del dist
 
-            var = np.empty((len(mat[0])))
+            derotate = derotate and (total_points > 1)
 
-            for i in range(len(mat[0])):
-                dist = (mat2[..., i, 0]**2 + mat2[..., i, 1]**2)
-                var[i] = dist.var()
+            offsets, angles, residuals, w = utils.register_points(
+                mat, w,
+                derotate=derotate,
+                center=(self.currentWidth/2.0, self.currentHeight/2.0),
+                kappa=self.aap_outliers_kappa)
 
-            del mat2
+            del mat
 
-            # Added 0.00000001 to avoid division by zero
-            w = 1/(var+0.00000001)
-            del var
+            rejected = np.argwhere(w == 0).flatten()
+            if len(rejected):
+                log.log(repr(self),
+                        'rejected align points: '+str(list(rejected)),
+                        level=logging.INFO)
 
-            if align:
-                for img in self.framelist:
-                    x = 0
-                    y = 0
-                    for j in range(len(img.alignpoints)):
-                        x += img.alignpoints[j].x*w[j]
-                        y += img.alignpoints[j].y*w[j]
+            log.log(repr(self),
+                    'mean residual: '+str(residuals[:, w > 0].mean()),
+                    level=logging.INFO)
 
-                    img.offset[0] = x/w.sum()
-                    img.offset[1] = y/w.sum()
+            for i in range(total_images):
+                img = self.framelist[i]
 
-                    self.progress.setValue(i)
-                    if ((i % 25) == 0) and self.progressWasCanceled():
-                        return False
-            else:
-                for img in self.framelist:
+                if align:
+                    img.offset[0] = offsets[i, 0]
+                    img.offset[1] = offsets[i, 1]
+                else:
                     img.offset[0] = 0
                     img.offset[1] = 0
 
-            self.unlock()
-            self.statusBar.showMessage(tr.tr('DONE'))
-
-            if (total_points > 1) and derotate:
-                self._derotateAlignPoints(w)
-
-                rotation_center = (self.currentWidth/2, self.currentHeight/2)
-
-                # compesate shift for rotation
-                for img in self.framelist:
-                    x = img.offset[0]-rotation_center[0]
-                    y = img.offset[1]-rotation_center[1]
-                    alpha = math.pi*img.angle/180.0
+                if derotate:
+                    img.angle = angles[i]
+                else:
+                    img.angle = 0
 
-                    cosa = math.cos(alpha)
-                    sina = math.sin(alpha)
+                self.progress.setValue(i)
+                if ((i % 25) == 0) and self.progressWasCanceled():
+                    return False
 
-                    # new shift
-                    img.offset[0] = self.currentWidth/2 + (x*cosa + y*sina)
-                    img.offset[1] = self.currentWidth/2 + (y*cosa - x*sina)
-            else:
-                for img in self.framelist:
-                    img.angle = 0
+            self.unlock()
+            self.statusBar.showMessage(tr.tr('DONE'))
 
             self.progress.setMaximum(3*len(self.framelist))
 
@@ -4026,16 +4272,22 @@ class theApp(Qt.QObject):
         self.progress.setMaximum(len(self.framelist))
 
         ref = None
-        mask = utils.generateCosBell(self.currentWidth, self.currentHeight)
+        ref_data = None
+        mask = None
 
         sharp1 = self.wnd.sharp1DoubleSpinBox.value()
         sharp2 = self.wnd.sharp2DoubleSpinBox.value()
 
+        cache = self.registration_cache
+        cache.resetMTimes()
+        cache_hits = 0
+
         count = 0
         for img in self.framelist:
             self.progress.setValue(count)
             count += 1
             if self.progressWasCanceled():
+                self._saveRegistrationCache()
                 self.unlock()
                 self.statusBar.showMessage(tr.tr('canceled by the user'))
                 return False
@@ -4047,48 +4299,96 @@ class theApp(Qt.QObject):
                     log.log(repr(self),
                             'using image '+img.name+' as reference',
                             level=logging.INFO)
-                    ref_data = ref.getData(asarray=True)
-                    if len(ref_data.shape) == 3:
-                        ref_data = ref_data.sum(2)
-                    ref_data *= mask
                     ref.setOffset([0, 0])
                 else:
-                    log.log(repr(self),
-                            'registering image '+img.name,
-                            level=logging.INFO)
-
-                    img_data = img.getData(asarray=True)
-                    if len(img_data.shape) == 3:
-                        img_data = img_data.sum(2)
-                    img_data *= mask
-
-                    data = utils.register_image(
-                        ref_data, img_data,
+                    key = cache.getKey(
+                        img, ref,
                         sharp1, sharp2,
                         align, derotate,
+                        img.angle - ref.angle,
                         self.phase_interpolation_order,
-                        override_angle=img.angle - ref.angle)
+                        self.action_enable_rawmode.isChecked(),
+                        self.frame_open_args)
+                    cached = cache.get(key)
+
+                    if cached is not None:
+                        log.log(repr(self),
+                                'using cached registration for image ' +
+                                img.name,
+                                level=logging.DEBUG)
+                        cache_hits += 1
+                        shift, angle = cached[0:2]
+                    else:
+                        log.log(repr(self),
+                                'registering image '+img.name,
+                                level=logging.INFO)
+
+                        if ref_data is None:
+                            # NOTE: the reference data is loaded only
+                            #       if at least one frame is not cached
+                            mask = utils.generateCosBell(self.currentWidth,
+                                                         self.currentHeight)
+                            ref_data = ref.getData(asarray=True)
+                            if len(ref_data.shape) == 3:
+                                ref_data = ref_data.sum(2)
+                            ref_data *= mask
+
+                        img_data = img.getData(asarray=True)
+                        if len(img_data.shape) == 3:
+                            img_data = img_data.sum(2)
+                        img_data *= mask
+
+                        data = utils.register_image(
+                            ref_data, img_data,
+                            sharp1, sharp2,
+                            align, derotate,
+                            self.phase_interpolation_order,
+                            override_angle=img.angle - ref.angle)
+
+                        shift = data[1]
+                        angle = data[2]
+
+                        if data[0] is not None:
+                            quality = ((data[0].max()-data[0].mean()) /
+                                       data[0].std())
+                        else:
+                            quality = None
+
+                        cache.set(key, shift, angle, quality)
+
+                        self._phase_align_data = (data[1], data[2], data[0])
+                        del img_data
+                        if (data[0] is not None and
+                                self.checked_show_phase_img == 2):
+                            iv.showImage(data[0])
 
-                    self._phase_align_data = (data[1], data[2], data[0])
                     self.statusBar.showMessage(tr.tr('shift: ') +
-                                               str(data[1]) + ', ' +
+                                               str(shift) + ', ' +
                                                tr.tr('rotation: ') +
-                                               str(data[2]))
-                    del img_data
-                    if (data[0] is not None and
-                            self.checked_show_phase_img == 2):
-                        iv.showImage(data[0])
-
-                    if data[1] is not None:
-                        img.setOffset(data[1])
-                    if data[2] is not None:
-                        img.setAngle(data[2])
+                                               str(angle))
+
+                    if shift is not None:
+                        img.setOffset(shift)
+                    if angle is not None:
+                        img.setAngle(angle)
         del mask
+        del ref_data
+
+        log.log(repr(self),
+                'registration cache hits: '+str(cache_hits),
+                level=logging.INFO)
+
+        self._saveRegistrationCache()
         self._phase_align_data = None
         sw.close()
         self.unlock()
         self.statusBar.showMessage(tr.tr('DONE'))
 
+    def _saveRegistrationCache(self):
+        if self.current_project_fname is not None:
+            self.registration_cache.save(
+                projects.getRegistrationCacheURL(self.current_project_fname))
+
     def getStackingMethod(self, method, framelist, bias_image,
                           dark_image, flat_image, **args):
         """
@@ -4559,35 +4859,37 @@ class theApp(Qt.QObject):
         else:
             return image
 
-    def registerImages(self, img, img_data):
+    def registerImages(self, img, img_data, out=None):
         if img.angle != 0:
             log.log(repr(self),
                     "rotating of "+str(img.angle)+" degrees",
                     level=logging.INFO)
-            img_data = sp.ndimage.interpolation.rotate(
-                img_data, img.angle, order=self.interpolation_order,
-                reshape=False, mode='constant', cval=0.0)
         else:
             log.log(repr(self),
                     "skipping rotation",
                     level=logging.INFO)
-        shift = np.zeros([len(img_data.shape)])
-        shift[0] = -img.offset[1]
-        shift[1] = -img.offset[0]
 
-        if (shift[0] != 0) or (shift[1] != 0):
+        if (img.offset[0] != 0) or (img.offset[1] != 0):
             log.log(repr(self),
-                    "shifting of "+str(shift[0:2])+" pixels",
+                    "shifting of "+str(-img.offset[1::-1])+" pixels",
                     level=logging.INFO)
-            img_data = sp.ndimage.interpolation.shift(
-                img_data, shift, order=self.interpolation_order,
-                mode='constant', cval=0.0)
         else:
             log.log(repr(self),
                     "skipping shift",
                     level=logging.INFO)
-        del shift
-        return img_data
+
+        if (img.angle == 0 and
+                img.offset[0] == 0 and
+                img.offset[1] == 0):
+            return img_data
+
+        # NOTE: rotation and shift are combined in a single affine
+        #       transformation, so the image is interpolated only once
+        return utils.transform_image(img_data,
+                                     img.angle,
+                                     img.offset[0:2],
+                                     order=self.interpolation_order,
+                                     out=out)
 
     def nativeOperationOnImages(self, operation, name, framelist,
                                 bias_image=None, dark_image=None,
@@ -4627,6 +4929,8 @@ class theApp(Qt.QObject):
         else:
             chunks_size = 1
 
+        buf = None
+        warp_buf = None
         for img in framelist:
             self.progress.setValue(progress_count)
             progress_count += 1
@@ -4646,7 +4950,13 @@ class theApp(Qt.QObject):
                         level=logging.INFO)
                 continue
 
-            r = img.getData(asarray=True, ftype=self.ftype)
+            if chunks_size > 1:
+                r = img.getData(asarray=True, ftype=self.ftype)
+            else:
+                # NOTE: r is consumed before the next frame is
+                #       loaded, so the same buffer is reused
+                buf = img.loadInto(buf, self.ftype)
+                r = buf
 
             if self.progressWasCanceled():
                 return None
@@ -4670,7 +4980,15 @@ class theApp(Qt.QObject):
             self.progress.setValue(progress_count)
             progress_count += 1
 
-            r = self.registerImages(img, r)
+            if chunks_size > 1:
+                r = self.registerImages(img, r)
+            else:
+                # NOTE: also the registered frame is consumed before
+                #       the next one, so its buffer is reused too
+                if (warp_buf is None or warp_buf.shape != r.shape or
+                        warp_buf.dtype != r.dtype):
+                    warp_buf = np.empty_like(r)
+                r = self.registerImages(img, r, warp_buf)
 
             if self.progressWasCanceled():
                 return None
@@ -4986,6 +5304,28 @@ class theApp(Qt.QObject):
 
         total = len(framelist)
 
+        if (master_bias is None and master_dark is None and
+                master_flat is None and hot_pixels is None):
+            tile_readers = self._getTileReaders(framelist)
+        else:
+            tile_readers = None
+
+        if tile_readers:
+            # NOTE: the images need neither calibration nor registration
+            #       so they are read directly from the source files
+            mdn = self._operationOnSubregions(operation,
+                                              tile_readers,
+                                              tile_readers[0].shape,
+                                              name, 256, 256,
+                                              **args)
+            for reader in tile_readers:
+                reader.close()
+            del tile_readers
+
+            self.statusBar.clearMessage()
+
+            return mdn
+
         self.statusBar.showMessage(tr.tr('Registering images') +
                                    ', '+tr.tr('please wait...'))
         self.progress.reset()
@@ -4996,6 +5336,8 @@ class theApp(Qt.QObject):
         original_shape = None
         tmpfilelist = []
 
+        buf = None
+        warp_buf = None
         for img in framelist:
             if self.progressWasCanceled():
                 return False
@@ -5009,7 +5351,8 @@ class theApp(Qt.QObject):
                 progress_count += 3
                 continue
 
-            r = img.getData(asarray=True, ftype=self.ftype)
+            buf = img.loadInto(buf, self.ftype)
+            r = buf
 
             self.progress.setValue(progress_count)
             progress_count += 1
@@ -5035,7 +5378,12 @@ class theApp(Qt.QObject):
             self.progress.setValue(progress_count)
             progress_count += 1
 
-            r = self.registerImages(img, r)
+            # NOTE: r is written to a temporary file before the next
+            #       frame is registered, so the buffer is reused
+            if (warp_buf is None or warp_buf.shape != r.shape or
+                    warp_buf.dtype != r.dtype):
+                warp_buf = np.empty_like(r)
+            r = self.registerImages(img, r, warp_buf)
 
             if self.progressWasCanceled():
                 return False
@@ -5057,6 +5405,44 @@ class theApp(Qt.QObject):
 
         return mdn
 
+    def _getTileReaders(self, framelist):
+        """
+        Returns the list of the memory-mapped data of the used frames,
+        or None if any of them is registered or cannot be mapped.
+        """
+        readers = []
+        for img in framelist:
+            if not img.isUsed():
+                continue
+
+            if (img.angle != 0 or
+                    img.offset[0] != 0 or
+                    img.offset[1] != 0):
+                return None
+
+            reader = img.getTileReader(self.ftype)
+            if reader is None or reader.ndim != 2:
+                return None
+            elif readers and reader.shape != readers[0].shape:
+                return None
+
+            # see calibrate()
+            img_min = reader.min()
+            if img_min < 0:
+                log.log(repr(self),
+                        "The image contains negative values." +
+                        "please, check your calibration frames!",
+                        level=logging.WARNING)
+                reader.bzero -= img_min
+
+            readers.append(reader)
+
+        log.log(repr(self),
+                "reading "+str(len(readers))+" images from source files",
+                level=logging.INFO)
+
+        return readers
+
     def getNumberOfComponents(self):
         if self.isBayerUsed():
             return 3
@@ -5139,6 +5525,19 @@ class theApp(Qt.QObject):
     def updateChannelMapping(self):
         self.channel_mapping = self.chmap_dlg.exec_(self.channel_mapping)
 
+    def _getPhotometryRegions(self, frame):
+        """
+        Returns the boxes (x0, y0, x1, y1) of the frame that contain
+        the apertures of its stars.
+        """
+        boxes = []
+        for st in frame.stars:
+            stx, sty = st.getAbsolutePosition()
+            size = int(max(st.r1, st.r2, st.r3)) + PHOTOMETRY_MARGIN
+            boxes.append((int(stx) - size, int(sty) - size,
+                          int(stx) + size + 1, int(sty) + size + 1))
+        return boxes
+
     def generateColorTransfTable(self, method=None, **args):
         del self._bas
         del self._drk
@@ -5209,6 +5608,7 @@ class theApp(Qt.QObject):
 
         allstars = {}
 
+        buf = None
         for img in self.framelist:
             if not img.isUsed():
                 log.log(repr(self),
@@ -5221,8 +5621,9 @@ class theApp(Qt.QObject):
                         level=logging.INFO)
 
             self.progress.setValue(count)
-            r = img.getData(asarray=True, ftype=self.ftype)
-            r = self.calibrate(r,
+            buf = img.loadInto(buf, self.ftype,
+                               regions=self._getPhotometryRegions(img))
+            r = self.calibrate(buf,
                                master_bias,
                                master_dark,
                                master_flat,
@@ -5455,6 +5856,7 @@ class theApp(Qt.QObject):
 
         allstars = {}
 
+        buf = None
         for img in self.framelist:
             if not img.isUsed():
                 log.log(repr(self),
@@ -5467,8 +5869,9 @@ class theApp(Qt.QObject):
                         level=logging.INFO)
 
             self.progress.setValue(count)
-            r = img.getData(asarray=True, ftype=self.ftype)
-            r = self.calibrate(r,
+            buf = img.loadInto(buf, self.ftype,
+                               regions=self._getPhotometryRegions(img))
+            r = self.calibrate(buf,
                                master_bias,
                                master_dark,
                                master_flat,
@@ -32,3 +32,4 @@ STYLES_PATH = os.path.join(DATA_PATH, 'styles')
 TEMP_PATH = os.path.join('/tmp', PROGRAM_NAME.lower())
 HOME_PATH = os.path.join(os.path.expandvars('$HOME'), PROGRAM_NAME.lower())
 CAPTURED_PATH = os.path.join(HOME_PATH, 'captured')
+CACHE_PATH = os.path.join(HOME_PATH, 'cache')
@@ -0,0 +1,445 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Metadata-only probes: image size, mode and number of pages are read
+# from the file headers without decoding any pixel data
+
+import os
+import zipfile
+import logging
+import threading
+import concurrent.futures
+
+import numpy as np
+import cv2
+
+from PIL import Image
+
+from . import log
+from . import serfile
+
+try:
+    from . import cr2plugin
+    HAS_CR2 = True
+except Exception:
+    HAS_CR2 = False
+
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+# NOTE: unsigned/signed integer conventions used by pyfits/astropy
+#       to store data with a BZERO offset and BSCALE=1
+FITS_INT_OFFSETS = {8: -128,
+                    16: 2**15,
+                    32: 2**31,
+                    64: 2**63}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class ImageInfo(object):
+
+    """
+    Header informations of an image file.
+
+    pages is a list of (width, height, mode) tuples, one for each
+    frame that utils.Frame can load from the file, while header
+    contains the raw metadata read by the probe (FITS cards, EXIF
+    and makernote tags). For sequences with per-frame timestamps,
+    times holds the UTC time of each page.
+    """
+
+    def __init__(self, url, file_type):
+        self.url = url
+        self.file_type = file_type
+        self.pages = []
+        self.header = []
+        self.makernotes = {}
+        self.times = None
+
+    def __len__(self):
+        return len(self.pages)
+
+
+def getModeFromShape(shape, dtype):
+    dtype = np.dtype(dtype)
+    if len(shape) > 2:
+        dpth = shape[2]
+        if dpth == 1:
+            pass
+        elif dpth == 3:
+            return 'RGB'
+        elif dpth == 4:
+            return 'RGBA'
+        else:
+            # multidimensional image AKA datacube
+            return 'M'*dpth
+
+    if dtype.kind == 'f':
+        return 'F'
+    elif dtype.kind in ('i', 'u'):
+        return 'I'
+    elif dtype.kind == 'b':
+        return '1'
+    else:
+        return None
+
+
+def _parseFitsValue(val):
+    val = val.strip()
+    if val.startswith("'"):
+        # string values can contain '/' and escaped quotes
+        end = 1
+        while True:
+            end = val.find("'", end)
+            if end < 0:
+                return val[1:].rstrip()
+            elif val[end+1:end+2] == "'":
+                end += 2
+            else:
+                return val[1:end].replace("''", "'").rstrip()
+
+    val = val.split('/')[0].strip()
+
+    if val == 'T':
+        return True
+    elif val == 'F':
+        return False
+
+    try:
+        return int(val)
+    except ValueError:
+        pass
+
+    try:
+        return float(val.replace('D', 'E'))
+    except ValueError:
+        return val
+
+
+def _readFitsHeader(fp):
+    cards = []
+    while True:
+        block = fp.read(FITS_BLOCK_SIZE)
+        if len(block) < FITS_BLOCK_SIZE:
+            return None
+        block = block.decode('ascii', 'replace')
+        for i in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[i:i+FITS_CARD_SIZE]
+            key = card[0:8].strip()
+            if key == 'END':
+                return cards
+            elif not key:
+                continue
+            elif card[8:10] == '= ':
+                cards.append((key, _parseFitsValue(card[10:])))
+            else:
+                cards.append((key, card[8:].strip()))
+
+
+def iterFitsHDUs(fp):
+    """
+    Yields the tuple (cards, header, data_offset, data_size) for
+    each HDU of an opened FITS file, where data_offset is the position
+    of the data unit in the file and data_size its size in bytes.
+    """
+    while True:
+        cards = _readFitsHeader(fp)
+        if cards is None:
+            return
+
+        header = dict(cards)
+
+        naxis = int(header.get('NAXIS', 0))
+        if naxis > 0:
+            axes = [int(header.get('NAXIS'+str(n+1), 0))
+                    for n in range(naxis)]
+            datasize = abs(int(header.get('BITPIX', 8)))//8
+            datasize *= int(header.get('GCOUNT', 1))
+            datasize *= int(header.get('PCOUNT', 0))+int(np.prod(axes))
+        else:
+            datasize = 0
+
+        offset = fp.tell()
+        yield (cards, header, offset, datasize)
+
+        # skipping data units, padded to a multiple of the block size
+        nblocks = (datasize + FITS_BLOCK_SIZE - 1)//FITS_BLOCK_SIZE
+        fp.seek(offset + nblocks*FITS_BLOCK_SIZE, 0)
+
+
+def getFitsImageAxes(header):
+    """
+    Returns the list [NAXIS1, NAXIS2, ...] of an image HDU, including
+    tile compressed images, or None if the HDU does not contain an
+    image.
+    """
+    xtension = header.get('XTENSION', 'PRIMARY')
+    if xtension in ('PRIMARY', 'IMAGE'):
+        prefix = 'NAXIS'
+    elif xtension == 'BINTABLE' and header.get('ZIMAGE') is True:
+        prefix = 'ZNAXIS'
+    else:
+        return None
+    return [int(header.get(prefix+str(n+1), 0))
+            for n in range(int(header.get(prefix, 0)))]
+
+
+def getFitsDtype(header):
+    """
+    Returns the dtype of the data of an image HDU after the BZERO
+    and BSCALE scaling has been applied.
+    """
+    if header.get('ZIMAGE') is True:
+        header = {'BITPIX': header.get('ZBITPIX', 0),
+                  'BZERO': header.get('BZERO', 0),
+                  'BSCALE': header.get('BSCALE', 1)}
+
+    bitpix = int(header.get('BITPIX', 0))
+    bzero = header.get('BZERO', 0)
+    bscale = header.get('BSCALE', 1)
+
+    if bitpix < 0:
+        return np.dtype('f'+str(-bitpix//8))
+    elif bscale != 1:
+        return np.dtype(np.float32 if bitpix <= 16 else np.float64)
+    elif bzero == 0:
+        return np.dtype('i'+str(bitpix//8) if bitpix > 8 else np.uint8)
+    elif bzero == FITS_INT_OFFSETS.get(bitpix):
+        return np.dtype('u'+str(bitpix//8) if bitpix > 8 else np.int8)
+    else:
+        return np.dtype(np.float32 if bitpix <= 16 else np.float64)
+
+
+def probeFITS(file_name, rgb_fits_mode=False):
+    info = ImageInfo(file_name, 'FITS')
+    hdus = []
+
+    with open(file_name, 'rb') as fp:
+        for cards, header, offset, datasize in iterFitsHDUs(fp):
+            if not hdus:
+                if header.get('SIMPLE') is not True:
+                    return None
+                info.header = cards
+
+            axes = getFitsImageAxes(header)
+            if axes is None:
+                hdus.append(None)
+            else:
+                hdus.append((axes, getFitsDtype(header)))
+
+    if not hdus:
+        return None
+
+    if rgb_fits_mode and len(hdus) >= 3:
+        layers = [h for h in hdus if h is not None and len(h[0]) == 2]
+        if (len(layers) == 3 and
+                layers[0][0] == layers[1][0] == layers[2][0]):
+            imw, imh = layers[0][0]
+            info.pages.append((imw, imh, 'RGB'))
+            return info
+
+    for hdu in hdus:
+        if hdu is None or len(hdu[0]) <= 1:
+            continue
+        axes, dtype = hdu
+        imw, imh = axes[0:2]
+        total = int(np.prod(axes[2:]))
+        mode = getModeFromShape((imh, imw), dtype)
+        info.pages.extend([(imw, imh, mode)]*total)
+
+    return info
+
+
+def _readNpyHeader(fp):
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+    return shape, dtype
+
+
+def _getArrayPage(shape, dtype):
+    if len(shape) < 2:
+        return None
+    imh, imw = shape[0:2]
+    return (imw, imh, getModeFromShape(shape, dtype))
+
+
+def probeNPY(file_name):
+    info = ImageInfo(file_name, 'NPY')
+    with open(file_name, 'rb') as fp:
+        page = _getArrayPage(*_readNpyHeader(fp))
+    if page is not None:
+        info.pages.append(page)
+    return info
+
+
+def probeNPZ(file_name):
+    info = ImageInfo(file_name, 'NPZ')
+    with zipfile.ZipFile(file_name) as zf:
+        for name in zf.namelist():
+            with zf.open(name) as fp:
+                page = _getArrayPage(*_readNpyHeader(fp))
+            if page is None:
+                # Frame.open cannot load any page from here on
+                break
+            info.pages.append(page)
+    return info
+
+
+def probeCR2(file_name):
+    if not HAS_CR2:
+        return None
+    info = ImageInfo(file_name, 'CR2')
+    # NOTE: QCR2Image.open parses the IFDs from the first bytes of
+    #       the file, the raw data is decoded when load() is called
+    cr2file = cr2plugin.imread(file_name)
+    try:
+        info.header = list(cr2file.EXIF.items())
+        info.makernotes = dict(cr2file.MAKERNOTES)
+        imw, imh = cr2file.size
+        info.pages.append((imw, imh, 'L'))
+    finally:
+        cr2file.close()
+    return info
+
+
+def probeVIDEO(file_name):
+    video = cv2.VideoCapture(file_name)
+    try:
+        if not video.isOpened():
+            return None
+        imw = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        imh = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        video.release()
+
+    if imw <= 0 or imh <= 0 or total_frames <= 0:
+        # some containers do not store these informations
+        return None
+
+    info = ImageInfo(file_name, 'VIDEO')
+    # NOTE: frames are always converted to RGB by cv2
+    info.pages = [(imw, imh, 'RGB')]*total_frames
+    return info
+
+
+def probeSER(file_name):
+    reader = serfile.getReader(file_name)
+    info = ImageInfo(file_name, 'SER')
+    mode = getModeFromShape(reader.frame_shape, reader.dtype)
+    info.pages = [(reader.width, reader.height, mode)]*len(reader)
+    info.header = list(reader.getProperties().items())
+    info.times = [reader.getTime(page) for page in range(len(reader))]
+    return info
+
+
+def probePIL(file_name, file_type):
+    info = ImageInfo(file_name, file_type)
+
+    # NOTE: Image.open reads only the file header, pixel data are
+    #       decoded when they are accessed for the first time
+    img = Image.open(file_name)
+    try:
+        try:
+            exif = img._getexif()
+        except AttributeError:
+            exif = None
+
+        if exif:
+            info.header = list(exif.items())
+
+        for page in range(getattr(img, 'n_frames', 1)):
+            if page > 0:
+                img.seek(page)
+            info.pages.append((img.size[0],
+                               img.size[1],
+                               img.mode.split(';')[0]))
+    finally:
+        img.close()
+
+    return info
+
+
+def _probe(file_name, file_type, rgb_fits_mode=False):
+    if file_type == 'FITS':
+        return probeFITS(file_name, rgb_fits_mode)
+    elif file_type == 'NPY':
+        return probeNPY(file_name)
+    elif file_type == 'NPZ':
+        return probeNPZ(file_name)
+    elif file_type == 'CR2':
+        return probeCR2(file_name)
+    elif file_type == 'VIDEO':
+        return probeVIDEO(file_name)
+    elif file_type == 'SER':
+        return probeSER(file_name)
+    else:
+        return probePIL(file_name, file_type)
+
+
+def probe(file_name, file_type, rgb_fits_mode=False):
+    """
+    Returns an ImageInfo object or None if the file cannot be probed
+    without decoding it. Results are cached until the file changes.
+    """
+    try:
+        st = os.stat(file_name)
+    except OSError:
+        return None
+
+    key = (file_name, file_type, bool(rgb_fits_mode))
+    stamp = (st.st_size, st.st_mtime)
+
+    with _cache_lock:
+        if key in _cache and _cache[key][0] == stamp:
+            return _cache[key][1]
+
+    try:
+        info = _probe(file_name, file_type, rgb_fits_mode)
+    except Exception as exc:
+        log.log("<lxnstack.probes module>",
+                "cannot probe file \'"+file_name+"\': "+str(exc),
+                level=logging.DEBUG)
+        info = None
+
+    with _cache_lock:
+        _cache[key] = (stamp, info)
+
+    return info
+
+
+def probeFiles(files, rgb_fits_mode=False, max_workers=None):
+    """
+    Probes a list of (file_name, file_type) pairs in a pool of threads
+    and returns the list of the corresponding ImageInfo objects.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        jobs = [executor.submit(probe, fname, ftype, rgb_fits_mode)
+                for fname, ftype in files]
+        return [job.result() for job in jobs]
+
+
+def clearCache():
+    with _cache_lock:
+        _cache.clear()
@@ -95,6 +95,194 @@ def loadTransfTableFromFile(fname):
     return dic
 
 
+def getRegistrationCacheURL(project_fname):
+    return os.path.splitext(project_fname)[0]+'-registration.npy'
+
+
+class RegistrationCache(object):
+
+    """
+    A persistent table of phase correlation registration results.
+
+    Each record holds the shift, the rotation angle and the quality of
+    the correlation peak of a frame and is keyed by the url, page and
+    modification time of the frame and of the reference frame, by the
+    sharpening parameters, by the align/derotate flags, by the
+    interpolation order and by the options that change the loaded
+    data (raw mode, RGB FITS mode and CR2 black level). The table is
+    stored next to the project file as a numpy structured array.
+    """
+
+    _FIELDS = [('page', np.int32),
+               ('mtime', np.float64),
+               ('ref_page', np.int32),
+               ('ref_mtime', np.float64),
+               ('sharp1', np.float64),
+               ('sharp2', np.float64),
+               ('align', np.bool_),
+               ('derotate', np.bool_),
+               ('override_angle', np.float64),
+               ('interp_order', np.int32),
+               ('raw_mode', np.bool_),
+               ('rgb_fits_mode', np.bool_),
+               ('black_level', np.bool_),
+               ('dx', np.float64),
+               ('dy', np.float64),
+               ('angle', np.float64),
+               ('quality', np.float64)]
+
+    def __init__(self):
+        self._records = {}
+        self._mtimes = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def clear(self):
+        self._records = {}
+        self._mtimes = {}
+
+    def _getMTime(self, url):
+        # NOTE: the modification time of each file is read only once
+        #       for each alignment, call resetMTimes() to read it again
+        if url not in self._mtimes:
+            try:
+                self._mtimes[url] = utils.getModificationTime(url)
+            except OSError:
+                self._mtimes[url] = -1.0
+        return self._mtimes[url]
+
+    def resetMTimes(self):
+        self._mtimes = {}
+
+    def getKey(self, frame, ref, sharp1, sharp2, align, derotate,
+               override_angle=0, interp_order=0, raw_mode=False,
+               open_args=None):
+        open_args = open_args or {}
+        if derotate:
+            # the angle is not used when derotating
+            override_angle = 0
+        return (frame.url, int(frame.page), self._getMTime(frame.url),
+                ref.url, int(ref.page), self._getMTime(ref.url),
+                float(sharp1), float(sharp2),
+                bool(align), bool(derotate),
+                float(override_angle), int(interp_order), bool(raw_mode),
+                bool(open_args.get('rgb_fits_mode', False)),
+                bool(open_args.get('cr2_black_level', False)))
+
+    def get(self, key):
+        """
+        Returns a tuple (shift, angle, quality) or None if there is no
+        valid record for the given key. shift and angle are None if they
+        were not computed.
+        """
+        if key not in self._records:
+            return None
+
+        dx, dy, angle, quality = self._records[key]
+
+        if np.isnan(dx) or np.isnan(dy):
+            shift = None
+        else:
+            shift = [dx, dy]
+
+        if np.isnan(angle):
+            angle = None
+
+        return (shift, angle, quality)
+
+    def set(self, key, shift, angle, quality):
+        if shift is None:
+            dx, dy = np.nan, np.nan
+        else:
+            dx, dy = float(shift[0]), float(shift[1])
+
+        if angle is None:
+            angle = np.nan
+
+        if quality is None:
+            quality = np.nan
+
+        self._records[key] = (dx, dy, float(angle), float(quality))
+
+    def load(self, fname):
+        self.clear()
+
+        if not os.path.isfile(fname):
+            return False
+
+        try:
+            table = np.load(fname)
+        except Exception as exc:
+            log.log(repr(self),
+                    "cannot load the registration cache: "+str(exc),
+                    level=logging.WARNING)
+            return False
+
+        names = table.dtype.names or ()
+        if any(field not in names for field, dtype in self._FIELDS):
+            log.log(repr(self),
+                    "discarding an outdated registration cache",
+                    level=logging.INFO)
+            return False
+
+        for rec in table:
+            key = (str(rec['url']), int(rec['page']), float(rec['mtime']),
+                   str(rec['ref_url']), int(rec['ref_page']),
+                   float(rec['ref_mtime']),
+                   float(rec['sharp1']), float(rec['sharp2']),
+                   bool(rec['align']), bool(rec['derotate']),
+                   float(rec['override_angle']), int(rec['interp_order']),
+                   bool(rec['raw_mode']), bool(rec['rgb_fits_mode']),
+                   bool(rec['black_level']))
+            self._records[key] = (float(rec['dx']), float(rec['dy']),
+                                  float(rec['angle']), float(rec['quality']))
+
+        log.log(repr(self),
+                "loaded "+str(len(self._records))+" registration records",
+                level=logging.DEBUG)
+
+        return True
+
+    def save(self, fname):
+        if len(self) == 0:
+            # nothing to save, no file is written
+            return True
+
+        self.resetMTimes()
+
+        # dropping records of files that have been changed or removed
+        valid = [(k, v) for k, v in self._records.items()
+                 if (self._getMTime(k[0]) == k[2] and
+                     self._getMTime(k[3]) == k[5])]
+
+        self._records = dict(valid)
+
+        url_len = max([1]+[max(len(k[0]), len(k[3])) for k, v in valid])
+
+        dtype = ([('url', 'U'+str(url_len)),
+                  ('ref_url', 'U'+str(url_len))] + self._FIELDS)
+
+        table = np.empty(len(valid), dtype=dtype)
+
+        for i, (k, v) in enumerate(valid):
+            table[i] = (k[0], k[3], k[1], k[2], k[4], k[5],
+                        k[6], k[7], k[8], k[9], k[10],
+                        k[11], k[12], k[13], k[14]) + v
+
+        try:
+            # NOTE: np.save would append '.npy' to a file object name
+            with open(fname, 'wb') as f:
+                np.save(f, table)
+        except Exception as exc:
+            log.log(repr(self),
+                    "cannot save the registration cache: "+str(exc),
+                    level=logging.WARNING)
+            return False
+
+        return True
+
+
 class Project(object):
 
     def __init__(self, frame_open_args):
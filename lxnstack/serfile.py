@@ -0,0 +1,498 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Sequences of frames stored in SER files
+
+import os
+import time
+import struct
+import calendar
+import logging
+import threading
+import collections
+
+import numpy as np
+
+from . import log
+
+FILE_ID = b'LUCAM-RECORDER'
+HEADER_SIZE = 178
+HEADER_FORMAT = '<14s7i40s40s40sqq'
+STRING_SIZE = 40
+
+# NOTE: the specification says that LittleEndian is 1 for little
+#       endian data, but most capture programs write 0 for them and
+#       most readers follow this convention, as it is done here
+LITTLE_ENDIAN_FLAG = 0
+
+COLOR_MONO = 0
+COLOR_RGB = 100
+COLOR_BGR = 101
+
+# number of color planes of the color IDs, Bayer patterns have one
+COLOR_PLANES = {COLOR_RGB: 3, COLOR_BGR: 3}
+
+BAYER_PATTERNS = {8: 'RGGB',
+                  9: 'GRBG',
+                  10: 'GBRG',
+                  11: 'BGGR',
+                  16: 'CYYM',
+                  17: 'YCMY',
+                  18: 'YMCY',
+                  19: 'MYYC'}
+
+# timestamps are stored as the number of 100ns intervals
+# since 0001-01-01 00:00:00 UTC
+TICKS_PER_SECOND = 10000000
+EPOCH_TICKS = 621355968000000000
+# timestamps after 2200-01-01 are not plausible
+MAX_TICKS = EPOCH_TICKS + 7258118400*TICKS_PER_SECOND
+
+MAX_OPEN_READERS = 8
+
+_readers = collections.OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def timeToTicks(t):
+    return int(round(t*TICKS_PER_SECOND)) + EPOCH_TICKS
+
+
+def ticksToTime(ticks):
+    return float(ticks - EPOCH_TICKS)/TICKS_PER_SECOND
+
+
+def _getRoughness(rows, planes):
+    # mean difference between each component of a pixel and the
+    # same component of the next pixel of the row
+    rows = rows.astype(np.int32)
+    return np.abs(rows[:, planes:] - rows[:, :-planes]).mean()
+
+
+def _encodeString(value):
+    value = str(value).encode('ascii', 'replace')[:STRING_SIZE]
+    return value.ljust(STRING_SIZE, b' ')
+
+
+def _decodeString(value):
+    return value.decode('ascii', 'replace').strip(' \x00')
+
+
+class SerReader(object):
+
+    """
+    Read-only access to the frames of a SER file.
+
+    The frames are memory-mapped, so getFrame() returns a read-only
+    view of the data of the file and no frame is decoded or copied
+    until its pixels are actually accessed.
+    """
+
+    def __init__(self, file_name):
+        self.url = str(file_name)
+        self.stamp = _getStamp(self.url)
+
+        with open(self.url, 'rb') as fp:
+            data = fp.read(HEADER_SIZE)
+
+        if len(data) < HEADER_SIZE:
+            raise IOError("not a SER file: "+self.url)
+
+        fields = struct.unpack(HEADER_FORMAT, data)
+
+        if fields[0] != FILE_ID:
+            raise IOError("not a SER file: "+self.url)
+
+        self.lu_id = fields[1]
+        self.color_id = fields[2]
+        self.little_endian = (fields[3] == LITTLE_ENDIAN_FLAG)
+        self.width = fields[4]
+        self.height = fields[5]
+        self.bit_depth = fields[6]
+        self.frame_count = fields[7]
+        self.observer = _decodeString(fields[8])
+        self.instrument = _decodeString(fields[9])
+        self.telescope = _decodeString(fields[10])
+        self.date_time = fields[11]
+        self.date_time_utc = fields[12]
+
+        self.planes = COLOR_PLANES.get(self.color_id, 1)
+        self.bayer_pattern = BAYER_PATTERNS.get(self.color_id)
+
+        if self.bit_depth <= 8:
+            self.dtype = np.dtype(np.uint8)
+        elif self.little_endian:
+            self.dtype = np.dtype('<u2')
+        else:
+            self.dtype = np.dtype('>u2')
+
+        if self.planes > 1:
+            self.frame_shape = (self.height, self.width, self.planes)
+        else:
+            self.frame_shape = (self.height, self.width)
+
+        self.frame_size = (self.width*self.height*self.planes *
+                           self.dtype.itemsize)
+
+        # NOTE: the frame count in the header may not be updated if
+        #       the capture has been interrupted, and SerWriter.flush
+        #       writes it only every now and then
+        size = os.path.getsize(self.url)
+        available = (size - HEADER_SIZE)//max(self.frame_size, 1)
+        trailer_pos = HEADER_SIZE + self.frame_count*self.frame_size
+        trailer_size = size - trailer_pos
+
+        if 0 < self.frame_count < available:
+            # there are more data than the frames in the header: they
+            # are the timestamps only if their size matches exactly
+            if trailer_size != 8*self.frame_count:
+                self.frame_count = available
+                trailer_pos = None
+        elif 0 < self.frame_count == available:
+            if trailer_size < 8*self.frame_count:
+                trailer_pos = None
+        else:
+            self.frame_count = available
+            trailer_pos = HEADER_SIZE + self.frame_count*self.frame_size
+            if size < trailer_pos + 8*self.frame_count:
+                trailer_pos = None
+
+        self._frames = None
+        self._timestamps = None
+        self._load_lock = threading.Lock()
+        self._trailer_pos = trailer_pos
+
+        if self.dtype.itemsize > 1 and self.frame_count > 0:
+            self._checkByteOrder()
+
+    def _checkByteOrder(self):
+        # NOTE: not all the capture programs agree on the meaning of
+        #       the LittleEndian flag, so the byte order is checked on
+        #       the first frame: data that do not use all the 16 bits
+        #       must fit in bit_depth bits, otherwise the right byte
+        #       order is the one that gives the smoothest image
+        row_size = self.width*self.planes
+        rows = max(min(self.height, 65536//max(row_size, 1)), 1)
+        sample = np.memmap(self.url, dtype=self.dtype, mode='r',
+                           offset=HEADER_SIZE, shape=(rows, row_size))
+        swapped = sample.byteswap()
+
+        if self.bit_depth < 16:
+            limit = 1 << self.bit_depth
+            if sample.max() < limit:
+                return
+            elif swapped.max() < limit:
+                self._swapByteOrder()
+                return
+
+        if self.width < 2:
+            return
+
+        if _getRoughness(swapped, self.planes) < \
+                0.5*_getRoughness(sample, self.planes):
+            self._swapByteOrder()
+
+    def _swapByteOrder(self):
+        log.log(repr(self),
+                "wrong byte order flag in "+self.url,
+                level=logging.DEBUG)
+        self.dtype = self.dtype.newbyteorder()
+        self.little_endian = not self.little_endian
+
+    def __repr__(self):
+        return "<lxnstack.serfile.SerReader object at {0}>".format(
+            hex(id(self)))
+
+    def __len__(self):
+        return self.frame_count
+
+    def _getFrames(self):
+        with self._load_lock:
+            if self._frames is None and self.frame_count > 0:
+                self._frames = np.memmap(
+                    self.url, dtype=self.dtype, mode='r',
+                    offset=HEADER_SIZE,
+                    shape=(self.frame_count,)+self.frame_shape)
+            return self._frames
+
+    def getFrame(self, page):
+        """
+        Returns a read-only view of the data of the requested frame or
+        None if the frame does not exist.
+        """
+        if page < 0 or page >= self.frame_count:
+            return None
+        elif self.color_id == COLOR_BGR:
+            return self._getFrames()[page][..., ::-1]
+        else:
+            return self._getFrames()[page]
+
+    def iterFrames(self, start=0, stop=None):
+        if stop is None or stop > self.frame_count:
+            stop = self.frame_count
+        for page in range(start, stop):
+            yield (page, self.getFrame(page))
+
+    def getTimestamps(self):
+        """
+        Returns the UTC timestamps of the frames as seconds since the
+        epoch or None if the file has no timestamps.
+        """
+        with self._load_lock:
+            if self._timestamps is None and self._trailer_pos is not None:
+                with open(self.url, 'rb') as fp:
+                    fp.seek(self._trailer_pos)
+                    ticks = np.fromfile(fp, dtype='<i8',
+                                        count=self.frame_count)
+                if (len(ticks) == self.frame_count and
+                        np.all(ticks >= EPOCH_TICKS) and
+                        np.all(ticks < MAX_TICKS) and
+                        np.all(np.diff(ticks) >= 0)):
+                    self._timestamps = ((ticks - EPOCH_TICKS) /
+                                        float(TICKS_PER_SECOND))
+                else:
+                    self._trailer_pos = None
+            return self._timestamps
+
+    def getTime(self, page):
+        """
+        Returns the UTC time of a frame as seconds since the epoch or
+        None if it is unknown.
+        """
+        timestamps = self.getTimestamps()
+        if timestamps is not None and 0 <= page < len(timestamps):
+            return float(timestamps[page])
+        elif self.date_time_utc > 0:
+            return ticksToTime(self.date_time_utc)
+        else:
+            return None
+
+    def getProperties(self):
+        props = {}
+        if self.observer:
+            props['OBSERVER'] = self.observer
+        if self.instrument:
+            props['INSTRUME'] = self.instrument
+        if self.telescope:
+            props['TELESCOP'] = self.telescope
+        if self.bayer_pattern is not None:
+            props['BAYERPAT'] = self.bayer_pattern
+        return props
+
+    def close(self):
+        with self._load_lock:
+            self._frames = None
+            self._timestamps = None
+
+
+class SerWriter(object):
+
+    """
+    Append-only writer of SER files.
+
+    The header is written when the first frame is added, frames are
+    appended to the body of the file as they arrive and the index of
+    their timestamps is stored at the end of the file when the writer
+    is closed. The frame count in the header is updated by flush(),
+    so a file is readable even if the writer is never closed.
+    """
+
+    def __init__(self, file_name, observer='', instrument='',
+                 telescope='', color_id=None):
+        """
+        color_id is the SER color ID of the frames, when it is None
+        COLOR_MONO or COLOR_RGB is used according to the shape of
+        the first frame; use the keys of BAYER_PATTERNS for raw
+        frames.
+        """
+        self.url = str(file_name)
+        self.observer = observer
+        self.instrument = instrument
+        self.telescope = telescope
+        self.color_id = color_id
+        self.frame_count = 0
+        self.frame_shape = None
+        self.dtype = None
+        self._timestamps = []
+        self._fp = open(self.url, 'wb')
+
+    def __repr__(self):
+        return "<lxnstack.serfile.SerWriter object at {0}>".format(
+            hex(id(self)))
+
+    def __len__(self):
+        return self.frame_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _writeHeader(self):
+        height, width = self.frame_shape[0:2]
+        if self.dtype.itemsize > 1:
+            bit_depth = 16
+        else:
+            bit_depth = 8
+
+        if self._timestamps:
+            utc_time = self._timestamps[0]
+            local_time = calendar.timegm(time.localtime(utc_time))
+            local_time += utc_time % 1
+            utc_ticks = timeToTicks(utc_time)
+            local_ticks = timeToTicks(local_time)
+        else:
+            utc_ticks = 0
+            local_ticks = 0
+
+        header = struct.pack(HEADER_FORMAT,
+                             FILE_ID,
+                             0,
+                             self.color_id,
+                             LITTLE_ENDIAN_FLAG,
+                             width,
+                             height,
+                             bit_depth,
+                             self.frame_count,
+                             _encodeString(self.observer),
+                             _encodeString(self.instrument),
+                             _encodeString(self.telescope),
+                             local_ticks,
+                             utc_ticks)
+        self._fp.write(header)
+
+    def addFrame(self, data, timestamp=None):
+        """
+        Appends a frame to the file. All the frames must have the same
+        shape and the same type (uint8 or uint16) of the first one.
+        timestamp is the UTC time of the frame in seconds since the
+        epoch, the current time is used if it is None.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        data = np.asarray(data)
+        if data.ndim == 3 and data.shape[2] == 4:
+            # the alpha channel (or padding) of RGB32 frames is dropped
+            data = data[..., :3]
+
+        if self.frame_shape is None:
+            if data.ndim == 3 and data.shape[2] == 3:
+                if self.color_id not in COLOR_PLANES:
+                    self.color_id = COLOR_RGB
+            elif data.ndim == 2:
+                if self.color_id in COLOR_PLANES or self.color_id is None:
+                    self.color_id = COLOR_MONO
+            else:
+                raise ValueError("unsupported frame shape "+str(data.shape))
+
+            if data.dtype.itemsize > 1 or data.dtype.kind == 'f':
+                self.dtype = np.dtype('<u2')
+            else:
+                self.dtype = np.dtype(np.uint8)
+
+            self.frame_shape = data.shape
+            self._timestamps.append(timestamp)
+            self._writeHeader()
+            self._timestamps.pop()
+        elif data.shape != self.frame_shape:
+            raise ValueError("wrong frame shape "+str(data.shape))
+
+        if self.color_id == COLOR_BGR:
+            data = data[..., ::-1]
+        self._fp.write(np.ascontiguousarray(data, dtype=self.dtype).data)
+        self._timestamps.append(timestamp)
+        self.frame_count += 1
+
+    def flush(self):
+        """
+        Updates the frame count in the header.
+        """
+        if self._fp is None or self.frame_shape is None:
+            return
+        pos = self._fp.tell()
+        self._fp.seek(38)
+        self._fp.write(struct.pack('<i', self.frame_count))
+        self._fp.seek(pos)
+        self._fp.flush()
+
+    def close(self):
+        if self._fp is None:
+            return
+        try:
+            if self.frame_shape is not None:
+                ticks = [timeToTicks(t) for t in self._timestamps]
+                self._fp.write(np.array(ticks, dtype='<i8').data)
+                self.flush()
+        finally:
+            self._fp.close()
+            self._fp = None
+
+        log.log(repr(self),
+                str(self.frame_count)+" frames written to "+self.url,
+                level=logging.INFO)
+
+
+def writeFrames(file_name, frames, timestamps=None, **args):
+    """
+    Writes a sequence of frames to a SER file, args are passed to
+    SerWriter.
+    """
+    with SerWriter(file_name, **args) as writer:
+        for i, frame in enumerate(frames):
+            if timestamps is None:
+                writer.addFrame(frame)
+            else:
+                writer.addFrame(frame, timestamps[i])
+    return writer.frame_count
+
+
+def _getStamp(url):
+    try:
+        st = os.stat(url)
+        return (st.st_size, st.st_mtime)
+    except OSError:
+        return None
+
+
+def getReader(file_name):
+    """
+    Returns the shared reader of a SER file, only the last
+    MAX_OPEN_READERS readers are kept open.
+    """
+    file_name = str(file_name)
+    with _readers_lock:
+        reader = _readers.pop(file_name, None)
+        if reader is None or reader.stamp != _getStamp(file_name):
+            if reader is not None:
+                reader.close()
+            reader = SerReader(file_name)
+
+        _readers[file_name] = reader
+
+        while len(_readers) > MAX_OPEN_READERS:
+            _readers.popitem(last=False)[1].close()
+
+        return reader
+
+
+def closeAll():
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.close()
+        _readers.clear()
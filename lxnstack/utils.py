@@ -40,11 +40,21 @@ CUSTOM_EXTENSIONS = {
     '.fts': 'FITS',
     '.npy': 'NPY',
     '.npz': 'NPZ',
+    '.ser': 'SER',
     '.avi': 'VIDEO',
     '.mp4': 'VIDEO',
     '.mpg': 'VIDEO',
     '.mpeg': 'VIDEO'}
 
+# signatures used to recognize the files whose extension is missing
+# or unknown, TIFF based files (TIFF and CR2) are handled separately
+MAGIC_BYTES = [
+    (b'SIMPLE  =', 'FITS'),
+    (b'LUCAM-RECORDER', 'SER'),
+    (b'\x93NUMPY', 'NPY'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG')]
+
 LIGHT_FRAME_TYPE = 'light frame'
 BIAS_FRAME_TYPE = 'bias frame'
 DARK_FRAME_TYPE = 'dark frame'
@@ -188,6 +198,15 @@ except ImportError:
                     tr.tr("Please install opencv2 python bindings."))
     sys.exit(1)
 
+from . import fftbackends
+from . import probes
+from . import framecache
+from . import videoreader
+from . import fitsmap
+from . import decodecache
+from . import fitswriter
+from . import serfile
+
 
 try:
     from PIL import Image, ExifTags
@@ -508,6 +527,8 @@ class SaveImageDialog(object):
                 self._updateSaveOptions)
             self.save_dlg.radioButtonNumpy.toggled.connect(
                 self._updateSaveOptions)
+            self.save_dlg.radioButtonSer.toggled.connect(
+                self._updateSaveOptions)
             self.save_dlg.radioButtonInt.toggled.connect(
                 self._updateSaveOptions)
             self.save_dlg.radioButtonFloat.toggled.connect(
@@ -568,6 +589,8 @@ class SaveImageDialog(object):
             frmat = 'fits'
         elif self.save_dlg.radioButtonNumpy.isChecked():
             frmat = 'numpy'
+        elif self.save_dlg.radioButtonSer.isChecked():
+            frmat = 'ser'
         return frmat, flags
 
     def getBitsFormat(self):
@@ -705,6 +728,24 @@ class SaveImageDialog(object):
             else:
                 self.save_dlg.checkBoxUnsigned.setEnabled(True)
 
+        elif self.save_dlg.radioButtonSer.isChecked():
+            self.save_dlg.groupBoxImageQuality.setEnabled(False)
+            self.save_dlg.groupBoxImageCompression.setEnabled(False)
+            self.save_dlg.radioButtonFloat.setEnabled(False)
+            self.save_dlg.checkBoxUnsigned.setEnabled(False)
+            self.save_dlg.checkBoxUnsigned.setCheckState(2)
+            self.save_dlg.radioButtonInt.setChecked(True)
+            self.save_dlg.radioButton8.setEnabled(True)
+            self.save_dlg.radioButton16.setEnabled(True)
+            self.save_dlg.radioButton32.setEnabled(False)
+            self.save_dlg.radioButton64.setEnabled(False)
+            self.save_dlg.comprFitsCheckBox.setEnabled(False)
+            self.save_dlg.rgbFitsCheckBox.setEnabled(False)
+
+            if (self.save_dlg.radioButton32.isChecked() or
+                    self.save_dlg.radioButton64.isChecked()):
+                self.save_dlg.radioButton8.setChecked(True)
+
         else:
             pass  # Should never happen
 
@@ -799,11 +840,13 @@ class Frame(Qt.QObject):
                         return None
 
             else:
-                _tmp_data = self.open(self.url,
-                                      page,
-                                      PIL_priority=True,
-                                      only_sizes=True,
-                                      **args)
+                _tmp_data = self._probe(self.url, page, **args)
+                if _tmp_data is None:
+                    _tmp_data = self.open(self.url,
+                                          page,
+                                          PIL_priority=True,
+                                          only_sizes=True,
+                                          **args)
             if not ('data' in args):
                 del _tmp_data
 
@@ -1133,20 +1176,192 @@ class Frame(Qt.QObject):
 
     def getData(self, asarray=False, asuint8=False,
                 fit_levels=False, ftype=np.float32,
-                PIL_priority=False):
-        return self.open(self.url,
+                PIL_priority=False, copy=True):
+        """
+        Returns the data of the frame. If asarray is True the data
+        are returned as a writable array of type ftype, unless copy
+        is False: in this case the data are returned in their native
+        type (eg. uint8 or uint16) and they can be a read-only view
+        of cached or memory-mapped data, that must not be modified.
+        """
+        if asarray:
+            cache = framecache.getCache()
+            if copy or asuint8:
+                dtype = np.dtype(ftype).str
+            else:
+                dtype = 'native'
+            key = cache.getKey(self.url,
+                               self.page,
+                               self._open_args,
+                               asuint8,
+                               fit_levels,
+                               dtype,
+                               PIL_priority)
+            data = cache.get(key, copy)
+            if data is not None:
+                return data
+
+        data = self.open(self.url,
                          self.page,
                          asarray,
                          asuint8,
                          fit_levels,
                          ftype,
                          PIL_priority,
+                         copy=copy,
                          **self._open_args)
 
+        if asarray and not isinstance(data, np.memmap):
+            # NOTE: memory-mapped data are already cheap to load
+            cache.put(key, data)
+
+        return data
+
+    def _isRaw(self):
+        return (CR2_SUPPORT and self.page == 0 and
+                getFileType(self.url) == 'CR2')
+
+    def _getRawCacheKey(self):
+        subtract_black = self._open_args.get('cr2_black_level', False)
+        return decodecache.getCache().getKey(self.url,
+                                             getRawCacheTag(subtract_black),
+                                             0)
+
+    def _isUndecodedRaw(self):
+        if not self._isRaw():
+            return False
+        return self._getRawCacheKey() not in decodecache.getCache()
+
+    def _getEmbeddedJpeg(self, full=True, decode=True):
+        try:
+            cr2file = cr2plugin.imread(self.url)
+            if decode:
+                data = cr2file.extractEmbeddedJpeg(full)
+            else:
+                data = cr2file.getEmbeddedJpegData(full)
+            cr2file.close()
+        except Exception as exc:
+            log.log(repr(self),
+                    "cannot read the embedded preview: "+str(exc),
+                    level=logging.WARNING)
+            return None
+        return data
+
+    def getPreviewData(self):
+        """
+        Returns the data to show when pixel-accurate data are not
+        needed: for raw files that have not been decoded yet the full
+        size JPEG image embedded by the camera is used, scaled to the
+        size of the frame, otherwise the frame data are returned.
+        """
+        if self._isUndecodedRaw():
+            data = self._getEmbeddedJpeg(True)
+            if data is not None:
+                if data.shape[0:2] != (self.height, self.width):
+                    data = cv2.resize(data, (int(self.width),
+                                             int(self.height)),
+                                      interpolation=cv2.INTER_AREA)
+                log.log(repr(self),
+                        "using the embedded preview",
+                        level=logging.DEBUG)
+                return data.astype(np.float32)
+
+        return self.getData(asarray=True)
+
+    def getThumbnail(self):
+        """
+        Returns a QIcon with the thumbnail embedded in a raw file or
+        None if the file has no thumbnail.
+        """
+        if not self._isRaw():
+            return None
+
+        data = self._getEmbeddedJpeg(False, decode=False)
+        if data is None:
+            return None
+
+        pixmap = QtGui.QPixmap()
+        if not pixmap.loadFromData(data, 'JPG'):
+            return None
+        return QtGui.QIcon(pixmap)
+
+    def _loadRawRegions(self, regions):
+        cache = decodecache.getCache()
+        checkpoints = cache.getCheckpoints(self._getRawCacheKey())
+        if not checkpoints:
+            # a full decoding is needed to record the checkpoints
+            return None
+
+        log.log(repr(self),
+                "decoding {0} regions of the raw data".format(len(regions)),
+                level=logging.DEBUG)
+
+        try:
+            cr2file = cr2plugin.imread(self.url)
+            self.canceled.connect(cr2file.cancel)
+            cr2file.decodingProgressChanged.connect(
+                self.progressValueChanged.emit)
+            data = cr2file.loadRegions(
+                regions, checkpoints,
+                self._open_args.get('cr2_black_level', False))
+            cr2file.close()
+        except Exception as exc:
+            log.log(repr(self),
+                    "cannot decode the raw regions: "+str(exc),
+                    level=logging.WARNING)
+            return None
+        return data
+
+    def loadInto(self, out=None, ftype=np.float32, regions=None):
+        """
+        Writes the data of the frame, converted to the type of out,
+        into the array out and returns it. If out is None or its
+        shape does not match the shape of the frame data, a new
+        array of type ftype is allocated and returned, so a buffer
+        can be reused for all the frames of a sequence.
+
+        regions is an optional list of boxes (x0, y0, x1, y1): when it
+        is given only the data inside the boxes are guaranteed to be
+        loaded, so that raw files that are not in the decode cache can
+        be decoded only partially.
+        """
+        if out is not None:
+            ftype = out.dtype
+
+        if np.dtype(ftype).kind != 'f':
+            raise Exception("Error: float type neede for \'ftype\' argument")
+
+        if regions is not None and self._isUndecodedRaw():
+            data = self._loadRawRegions(regions)
+            if data is not None:
+                if out is None or out.shape != data.shape:
+                    out = np.empty(data.shape, dtype=ftype)
+                out[...] = data
+                return out
+
+        fmap = self.getTileReader(ftype)
+        if fmap is not None:
+            # uncompressed FITS data are scaled directly into out
+            if out is None or out.shape != fmap.shape:
+                out = np.empty(fmap.shape, dtype=ftype)
+            fmap.readTile(0, fmap.shape[0], 0, fmap.shape[1], out=out)
+            fmap.close()
+            return out
+
+        data = self.getData(asarray=True, copy=False)
+        if data is None:
+            return None
+
+        if out is None or out.shape != data.shape:
+            out = np.empty(data.shape, dtype=ftype)
+        out[...] = data
+
+        return out
+
     def open(self, file_name, page=0, asarray=False,
              asuint8=False, fit_levels=False, ftype=np.float32,
              PIL_priority=False, only_sizes=False, force_update=False,
-             **args):
+             copy=True, **args):
 
         data = self._open(file_name,
                           page, asarray,
@@ -1156,6 +1371,7 @@ class Frame(Qt.QObject):
                           PIL_priority,
                           only_sizes,
                           force_update,
+                          copy,
                           **args)
         if data is None:
             self.is_good = False
@@ -1166,15 +1382,85 @@ class Frame(Qt.QObject):
 
         return data
 
+    def getTileReader(self, ftype=np.float32):
+        """
+        Returns a read-only fitsmap.FitsImageMap of the frame data
+        or None if the data cannot be memory-mapped.
+        """
+        if not FITS_SUPPORT or getFileType(self.url) != 'FITS':
+            return None
+        return fitsmap.openFitsMap(self.url, self.page, self.RGB_mode, ftype)
+
+    def _probe(self, file_name, page=0, **args):
+        """
+        Reads size and mode of the requested page from the file
+        header, without decoding the image. Returns True on success,
+        False if the page does not exist and None if the file must be
+        opened with Frame.open.
+        """
+        file_type = getFileType(file_name)
+        if file_type is None:
+            return None
+
+        if file_type == 'CR2' and args.get('convert_cr2', False):
+            # raw data must be converted when the frame is created
+            return None
+
+        is_localtime = args.get('assume_localtime', False)
+
+        info = probes.probe(file_name, file_type,
+                            args.get('rgb_fits_mode', False))
+
+        if info is None:
+            return None
+        elif page >= len(info.pages):
+            self.is_good = False
+            return False
+
+        try:
+            if file_type == 'FITS':
+                ctime = self._readFitsProperties(info.header, is_localtime)
+            elif file_type == 'CR2':
+                ctime = self._readCR2Properties(info.header,
+                                                info.makernotes,
+                                                is_localtime)
+            elif file_type == 'SER':
+                for key, value in info.header:
+                    self.addProperty(key, value)
+                ctime = info.times[page]
+            elif file_type in ('NPY', 'NPZ', 'VIDEO'):
+                ctime = None
+            else:
+                ctime = self._readExifProperties(info.header)
+        except Exception:
+            self.properties = {}
+            return None
+
+        exif_file_path = os.path.splitext(file_name)[0]+'.exif'
+        if os.path.isfile(exif_file_path):
+            self.importProperties(exif_file_path)
+
+        self.width, self.height, self.mode = info.pages[page]
+
+        if file_type == 'VIDEO':
+            # the time of each frame is known only when it is decoded
+            pass
+        elif 'UTCEPOCH' not in self.properties:
+            if ctime is None:
+                self.addProperty('UTCEPOCH', getCreationTime(file_name))
+            else:
+                self.addProperty('UTCEPOCH', ctime)
+
+        self.is_good = True
+        return True
+
     def _open(self, file_name, page=0, asarray=False,
               asuint8=False, fit_levels=False, ftype=np.float32,
               PIL_priority=False, only_sizes=False, force_update=False,
-              **args):
+              copy=True, **args):
         image = None
 
-        file_path, file_ext = os.path.splitext(file_name)
-
-        file_ext = file_ext.lower()
+        file_path = os.path.splitext(file_name)[0]
 
         if 'rgb_fits_mode' in args:
             self.RGB_mode = args['rgb_fits_mode']
@@ -1189,9 +1475,8 @@ class Frame(Qt.QObject):
         if np.dtype(ftype).kind != 'f':
             raise Exception("Error: float type neede for \'ftype\' argument")
 
-        if file_ext in getSupportedFormats():
-            file_type = getSupportedFormats()[file_ext]
-        else:
+        file_type = getFileType(file_name)
+        if file_type is None:
             return None
 
         if page == 0:
@@ -1209,8 +1494,46 @@ class Frame(Qt.QObject):
         if os.path.isfile(exif_file_path):
             self.importProperties(exif_file_path)
 
+        fmap = None
+        if FITS_SUPPORT and file_type == 'FITS' and asarray and not asuint8:
+            fmap = fitsmap.openFitsMap(file_name, page, self.RGB_mode)
+
+        # NOTE: CR2 files always use the decode cache, see below
+        cached = None
+        cache_key = None
+        cached_formats = args.get('cached_formats',
+                                  decodecache.DEFAULT_FORMATS)
+        if asarray and file_type != 'CR2' and file_type in cached_formats:
+            cache_key = decodecache.getCache().getKey(file_name,
+                                                      file_type,
+                                                      page)
+            if not force_update:
+                cached = decodecache.getCache().load(cache_key)
+
         # Choosing among specific loaders
-        if file_type == 'FITS':
+        if cached is not None:
+            if getattr(self, 'width', None) is None:
+                self._setSize(cached)
+            if asuint8:
+                image = normToUint8(cached, fit_levels)
+            else:
+                image = _asArray(cached, ftype, copy)
+            cache_key = None
+
+        elif fmap is not None:
+            # uncompressed data are converted directly from the file
+            ctime = self._readFitsProperties(fmap.cards, is_localtime)
+            self.height, self.width = fmap.shape
+            self.mode = probes.getModeFromShape(fmap.shape, fmap.dtype)
+            if copy:
+                image = fmap.asarray(ftype)
+            elif fmap.bzero == 0 and fmap.bscale == 1:
+                image = fmap.raw
+            else:
+                image = fmap.asarray(fmap.dtype)
+            fmap.close()
+
+        elif file_type == 'FITS':
             if not FITS_SUPPORT:
                 # This should never happen
                 return None
@@ -1225,18 +1548,7 @@ class Frame(Qt.QObject):
 
             header = hdu_table[0].header
 
-            for k, v in header.items():
-                self.addProperty(k, v)
-
-            for date_tag, time_tag in (('DATE-OBS', 'TIME-OBS'),
-                                       ('DATE', 'TIME')):
-                if date_tag in header:
-                    try:
-                        ctime = _getCTime(header[date_tag], 'T', is_localtime)
-                    except:
-                        log.log(repr(self),
-                                "FITS: corrupted or invaild time format",
-                                level=logging.WARNING)
+            ctime = self._readFitsProperties(header.items(), is_localtime)
 
             # Checking for 3 ImageHDU (red, green and blue components)
             if self.RGB_mode and (len(hdu_table) >= 3):
@@ -1286,7 +1598,7 @@ class Frame(Qt.QObject):
                         if asuint8:
                             image = normToUint8(img, fit_levels)
                         else:
-                            image = img.astype(ftype)
+                            image = _asArray(img, ftype, copy)
                     else:
                         image = Image.fromarray(normToUint8(img))
 
@@ -1369,7 +1681,7 @@ class Frame(Qt.QObject):
                                         image = normToUint8(data, fit_levels)
                                         break
                                     else:
-                                        image = data.astype(ftype)
+                                        image = _asArray(data, ftype, copy)
                                         break
                                 else:
                                     image = Image.fromarray(normToUint8(data))
@@ -1397,7 +1709,7 @@ class Frame(Qt.QObject):
                 if asuint8:
                     image = normToUint8(img, fit_levels)
                 else:
-                    image = img.astype(ftype)
+                    image = _asArray(img, ftype, copy)
             else:
                 image = Image.fromarray(normToUint8(img))
 
@@ -1421,31 +1733,31 @@ class Frame(Qt.QObject):
                 if asuint8:
                     image = normToUint8(img, fit_levels)
                 else:
-                    image = img.astype(ftype)
+                    image = _asArray(img, ftype, copy)
             else:
                 image = Image.fromarray(normToUint8(img))
 
         elif file_type == 'CR2':
             cr2file = cr2plugin.imread(file_name)
 
-            for k, v in cr2file.EXIF.items():  # READING EXIF
-                if (k == 306) or (k == 36867) or (k == 36868):
-                    ctime = _getCTime(v, localtime=is_localtime)
-                    self.addProperty('UTCEPOCH', ctime)
-                if k in ExifTags.TAGS:
-                    self.addProperty(ExifTags.TAGS[k], v)
-                else:
-                    self.addProperty(k, v)
-
-            for k, v in cr2file.MAKERNOTES.items():
-                self.addProperty(('MAKERNOTE', k), v)
-
             if page > 0:
                 return None
 
             self.width, self.height = cr2file.size
             self.mode = 'L'
 
+            ctime = self._readCR2Properties(cr2file.EXIF.items(),
+                                            cr2file.MAKERNOTES,
+                                            is_localtime)
+
+            if only_sizes and not args.get('convert_cr2', False):
+                if 'UTCEPOCH' not in self.properties:
+                    if ctime is None:
+                        ctime = getCreationTime(file_name)
+                    self.addProperty('UTCEPOCH', ctime)
+                cr2file.close()
+                return True
+
             self.canceled.connect(cr2file.cancel)
 
             cr2file.decodingProgressChanged.connect(
@@ -1455,22 +1767,11 @@ class Frame(Qt.QObject):
             cr2file.decodingEnded.connect(
                 self.hideProgress.emit)
 
-            if FITS_SUPPORT:
-                fits_header = []
-                if ctime is not None:
-                    gm = time.gmtime(ctime)
-                    fstr = '{0:02d}-{1:02d}-{2:02d}T{3:02d}:{4:02d}:{5:02.0f}'
-
-                    date = fstr.format(gm.tm_year, gm.tm_mon, gm.tm_mday,
-                                       gm.tm_hour, gm.tm_min, gm.tm_sec)
-
-                    fits_header.append(('DATE-OBS',
-                                        date,
-                                        'Date of observations'))
-
-                data_file_name = file_path+'.fits'
-            else:
-                data_file_name = file_path+'.npy'
+            subtract_black = args.get('cr2_black_level', False)
+            cache = decodecache.getCache()
+            cache_key = cache.getKey(file_name,
+                                     getRawCacheTag(subtract_black),
+                                     page)
 
             if asarray:
 
@@ -1478,116 +1779,50 @@ class Frame(Qt.QObject):
                                           ' '+self.name + ', ' +
                                           tr.tr('please wait...'))
 
-                not_updated = notUpdated(self.url, data_file_name)
-                if (not_updated or force_update):
-
-                    log.log(repr(self),
-                            'decoding raw data: force={0} outdate={1}'.format(
-                                force_update, not_updated),
-                            level=logging.DEBUG)
+                if force_update:
+                    img = None
+                else:
+                    img = cache.load(cache_key)
 
+                if img is None:
                     log.log(repr(self),
-                            'decoding raw data to file '+data_file_name,
+                            'decoding raw data: force={0}'.format(
+                                force_update),
                             level=logging.INFO)
 
-                    self.infoTextChanged.emit(
-                        tr.tr('decoding raw data to file')+'\n' +
-                        data_file_name)
-
-                    try:
-                        img = cr2file.load()
-                        if img is None:
-                            return None
-                    except SyntaxError as exc:
-                        msgBox = Qt.QMessageBox()
-                        msgBox.setText('Corrupted CR2 data!')
-                        msgBox.setInformativeText(str(exc))
-                        msgBox.setIcon(Qt.QMessageBox.Critical)
-                        msgBox.exec_()
+                    img = self._decodeCR2(cr2file, subtract_black)
+                    if img is None:
                         return None
 
-                    if FITS_SUPPORT:
-                        imname = os.path.splitext(data_file_name)[0]
-                        self._imwrite_fits_(img,
-                                            override_name=imname,
-                                            header=fits_header,
-                                            force_overwrite=True)
-                    else:
-                        np.save(data_file_name, img)
-
-                    self.exportProperties(exif_file_path)
-
-                    if asuint8:
-                        image = normToUint8(img, fit_levels)
-                    else:
-                        image = img.astype(ftype)
-
+                    cache.store(cache_key, img, file_name,
+                                cr2file.checkpoints)
                 else:
                     log.log(repr(self),
-                            'loading raw data',
+                            'loading cached raw data',
                             level=logging.INFO)
-                    self.infoTextChanged.emit(tr.tr('decoding image ') +
-                                              self.name + ', ' +
-                                              tr.tr('please wait...'))
-                    try:
-                        image = self.open(data_file_name,
-                                          page,
-                                          asarray,
-                                          asuint8,
-                                          fit_levels,
-                                          ftype,
-                                          PIL_priority,
-                                          **args)
-                    except:
-                        image = None
-                    if (image is None or
-                            cr2file.size[0] != self.width or
-                            cr2file.size[1] != self.height):
-                        self.open(file_name,
-                                  page,
-                                  asarray,
-                                  asuint8,
-                                  fit_levels,
-                                  ftype,
-                                  PIL_priority,
-                                  force_update=True,
-                                  **args)
+
+                if asuint8:
+                    image = normToUint8(img, fit_levels)
+                else:
+                    image = _asArray(img, ftype, copy)
             else:
-                if ('convert_cr2' in args and args['convert_cr2'] is True):
+                if (args.get('convert_cr2', False) and
+                        cache_key not in cache):
                     self.infoTextChanged.emit(tr.tr('decoding image')+', ' +
                                               tr.tr('please wait...'))
-                    if notUpdated(self.url, data_file_name):
-                        log.log(repr(self),
-                                'decoding raw data to file '+data_file_name,
-                                level=logging.INFO)
-                        self.infoTextChanged.emit(
-                            tr.tr('decoding raw data to file')+'\n' +
-                            data_file_name)
+                    log.log(repr(self),
+                            'decoding raw data to cache',
+                            level=logging.INFO)
 
-                        try:
-                            img = cr2file.load()
-                            if img is None:
-                                return None
-                        except SyntaxError as exc:
-                            msgBox = Qt.QMessageBox()
-                            msgBox.setText(tr.tr('Corrupted CR2 data!'))
-                            msgBox.setInformativeText(str(exc))
-                            msgBox.setIcon(Qt.QMessageBox.Critical)
-                            msgBox.exec_()
-                            return None
+                    img = self._decodeCR2(cr2file, subtract_black)
+                    if img is None:
+                        return None
 
-                        if FITS_SUPPORT:
-                            imname = os.path.splitext(data_file_name)[0]
-                            self._imwrite_fits_(img,
-                                                override_name=imname,
-                                                header=fits_header,
-                                                force_overwrite=True,
-                                                compressed=True)
-                        else:
-                            np.save(data_file_name, img)
+                    cache.store(cache_key, img, file_name,
+                                cr2file.checkpoints)
 
-                self.exportProperties(exif_file_path)
                 image = cr2file
+            cache_key = None
 
             cr2file.decodingProgressChanged.disconnect()
             cr2file.decodingStarted.disconnect()
@@ -1596,10 +1831,9 @@ class Frame(Qt.QObject):
             del cr2file
 
         elif file_type == 'VIDEO':
-            video = cv2.VideoCapture(file_name)
-            s = video.read()
-            total_frames = video.get(cv2.CAP_PROP_FRAME_COUNT)
-            if not s[0]:
+            video = videoreader.getReader(file_name)
+            total_frames = video.total_frames
+            if not video.is_good:
                 log.log(repr(self),
                         "the video file is corrupted or " +
                         "have an unsupported format",
@@ -1629,25 +1863,10 @@ class Frame(Qt.QObject):
                 else:
                     self.hideProgress.emit()
 
-                shape = s[1].shape
-
-                imh = s[1].shape[0]
-                imw = s[1].shape[1]
-
-                if len(shape) > 2:
-                    dpth = shape[2]
-                    if dpth == 1:
-                        dep = 'L'
-                    elif dpth == 3:
-                        dep = 'RGB'
-                    elif dpth == 4:
-                        dep = 'RGBA'
-                    else:
-                        return None
-
-                self.width = imw
-                self.height = imh
-                self.mode = dep
+                # NOTE: frames are always decoded as RGB images
+                self.width = video.width
+                self.height = video.height
+                self.mode = 'RGB'
 
                 log.log(repr(self),
                         "loading frame "+str(page)+" of video "+str(file_name),
@@ -1656,20 +1875,51 @@ class Frame(Qt.QObject):
                 if only_sizes:
                     return True
                 else:
-                    video.set(cv2.CAP_PROP_POS_FRAMES, page)
-                    time_offset = video.get(cv2.CAP_PROP_POS_MSEC)/1000.0
-                    ctime = getCreationTime(file_name)+time_offset
+                    frame = video.read(page)
+                    if frame is None:
+                        return None
 
-                    img = bgr2rgb(video.read()[1])
+                    img, time_offset = frame
+                    ctime = getCreationTime(file_name)+time_offset
 
                     if asarray:
                         if asuint8:
                             image = normToUint8(np.asarray(img), fit_levels)
                         else:
-                            image = (np.asarray(img)).astype(ftype)
+                            image = _asArray(img, ftype, copy)
                     else:
                         image = Image.fromarray(normToUint8(img))
 
+        elif file_type == 'SER':
+            try:
+                sequence = serfile.getReader(file_name)
+            except Exception as exc:
+                log.log(repr(self),
+                        "cannot open SER file: "+str(exc),
+                        level=logging.ERROR)
+                return None
+
+            img = sequence.getFrame(page)
+            if img is None:
+                return None
+
+            for key, value in sequence.getProperties().items():
+                self.addProperty(key, value)
+            ctime = sequence.getTime(page)
+
+            self._setSize(img)
+
+            if only_sizes:
+                return True
+            elif asarray:
+                # NOTE: frames are read-only memory-mapped views
+                if asuint8:
+                    image = normToUint8(img, fit_levels)
+                else:
+                    image = _asArray(img, ftype, copy)
+            else:
+                image = Image.fromarray(normToUint8(img))
+
         elif file_type == '???':
             # New codecs will be added here
             return None
@@ -1692,7 +1942,7 @@ class Frame(Qt.QObject):
                     if asuint8:
                         image = normToUint8(np.asarray(img), fit_levels)
                     else:
-                        image = (np.asarray(img)).astype(ftype)
+                        image = _asArray(img, ftype, copy)
                 else:
                     image = Image.fromarray(normToUint8(img))
             else:
@@ -1707,54 +1957,8 @@ class Frame(Qt.QObject):
                     self.height = img.size[1]
 
                     try:
-                        # TODO : Check for duplicated code here
-                        for k, v in img._getexif().items():  # Reading EXIF
-                            if (k == 306) or (k == 36867) or (k == 36868):
-                                tm_struct = [0]*9
-                                stm = v.split(' ')
-
-                                # the date is yyyy:mm:dd
-                                dt = stm[0].split(':')
-
-                                if len(dt) < 3:
-                                    # maybe it is yyyy-mm-dd
-                                    dt = stm[0].split('-')
-
-                                if len(dt) < 3:
-                                    # try to detect the separator
-                                    dt = stm[0].split(stm[-3])
-
-                                if len(stm) == 3:
-                                    tm = stm[1].split(':')
-
-                                    if len(tm) < 3:
-                                        # try to detect the separator
-                                        tm = stm[0].split(stm[-3])
-
-                                    tm_struct[3] = int(tm[0])
-                                    tm_struct[4] = int(tm[1])
-                                    ff = float(tm[2])
-                                    tm_struct[5] = int(tm[2])
-                                else:
-                                    continue
-
-                                yy = int(dt[0])
-
-                                if dt[0] < 100:
-                                    tm_struct[0] = 1990 + yy
-                                else:
-                                    tm_struct[0] = yy
-
-                                tm_struct[1] = int(dt[1])
-                                tm_struct[2] = int(dt[2])
-
-                                struct_tm = time.struct_time(tm_struct)
-                                ctime = time.mktime(struct_tm)+math.modf(ff)[0]
-
-                            if k in ExifTags.TAGS:
-                                self.addProperty(ExifTags.TAGS[k], v)
-                            else:
-                                self.addProperty(k, v)
+                        ctime = self._readExifProperties(
+                            img._getexif().items())
                     except AttributeError:
                         pass
                     # Testing decoder
@@ -1784,13 +1988,16 @@ class Frame(Qt.QObject):
                     if asuint8:
                         image = normToUint8(np.asarray(img), fit_levels)
                     else:
-                        image = (np.asarray(img)).astype(ftype)
+                        image = _asArray(img, ftype, copy)
                 else:
                     if _using_cv2:
                         image = Image.fromarray(normToUint8(img))
                     else:
                         image = img
 
+        if cache_key is not None and image is not None and not asuint8:
+            decodecache.getCache().store(cache_key, image, file_name)
+
         if 'UTCEPOCH' not in self.properties:
             if ctime is None:
                 self.addProperty('UTCEPOCH', getCreationTime(file_name))
@@ -1799,6 +2006,105 @@ class Frame(Qt.QObject):
 
         return image
 
+    def _decodeCR2(self, cr2file, subtract_black=False):
+        try:
+            return cr2file.load(subtract_black=subtract_black)
+        except SyntaxError as exc:
+            msgBox = Qt.QMessageBox()
+            msgBox.setText(tr.tr('Corrupted CR2 data!'))
+            msgBox.setInformativeText(str(exc))
+            msgBox.setIcon(Qt.QMessageBox.Critical)
+            msgBox.exec_()
+            return None
+
+    def _readFitsProperties(self, cards, is_localtime=False):
+        ctime = None
+        cards = list(cards)
+
+        for k, v in cards:
+            self.addProperty(k, v)
+
+        header = dict(cards)
+        for date_tag, time_tag in (('DATE-OBS', 'TIME-OBS'),
+                                   ('DATE', 'TIME')):
+            if date_tag in header:
+                try:
+                    ctime = _getCTime(header[date_tag], 'T', is_localtime)
+                except:
+                    log.log(repr(self),
+                            "FITS: corrupted or invaild time format",
+                            level=logging.WARNING)
+        return ctime
+
+    def _readCR2Properties(self, exif, makernotes, is_localtime=False):
+        ctime = None
+
+        for k, v in exif:  # READING EXIF
+            if (k == 306) or (k == 36867) or (k == 36868):
+                ctime = _getCTime(v, localtime=is_localtime)
+                self.addProperty('UTCEPOCH', ctime)
+            if k in ExifTags.TAGS:
+                self.addProperty(ExifTags.TAGS[k], v)
+            else:
+                self.addProperty(k, v)
+
+        for k, v in makernotes.items():
+            self.addProperty(('MAKERNOTE', k), v)
+
+        return ctime
+
+    def _readExifProperties(self, exif):
+        ctime = None
+        for k, v in exif:  # Reading EXIF
+            if (k == 306) or (k == 36867) or (k == 36868):
+                tm_struct = [0]*9
+                stm = v.split(' ')
+
+                # the date is yyyy:mm:dd
+                dt = stm[0].split(':')
+
+                if len(dt) < 3:
+                    # maybe it is yyyy-mm-dd
+                    dt = stm[0].split('-')
+
+                if len(dt) < 3:
+                    # try to detect the separator
+                    dt = stm[0].split(stm[-3])
+
+                if len(stm) == 3:
+                    tm = stm[1].split(':')
+
+                    if len(tm) < 3:
+                        # try to detect the separator
+                        tm = stm[0].split(stm[-3])
+
+                    tm_struct[3] = int(tm[0])
+                    tm_struct[4] = int(tm[1])
+                    ff = float(tm[2])
+                    tm_struct[5] = int(tm[2])
+                else:
+                    continue
+
+                yy = int(dt[0])
+
+                if dt[0] < 100:
+                    tm_struct[0] = 1990 + yy
+                else:
+                    tm_struct[0] = yy
+
+                tm_struct[1] = int(dt[1])
+                tm_struct[2] = int(dt[2])
+
+                struct_tm = time.struct_time(tm_struct)
+                ctime = time.mktime(struct_tm)+math.modf(ff)[0]
+
+            if k in ExifTags.TAGS:
+                self.addProperty(ExifTags.TAGS[k], v)
+            else:
+                self.addProperty(k, v)
+
+        return ctime
+
     def _setSize(self, data):
         shape = data.shape
         self.height = shape[0]
@@ -1831,7 +2137,7 @@ class Frame(Qt.QObject):
                     level=logging.ERROR)
             return False
 
-    def _fits_secure_imwrite(self, hdulist, url, force=False):
+    def _confirmOverwrite(self, url, force=False):
         if os.path.exists(url):
             if force:
                 os.remove(url)
@@ -1848,9 +2154,54 @@ class Frame(Qt.QObject):
                     os.remove(url)
                 else:
                     return False
+        return True
+
+    def _fits_secure_imwrite(self, hdulist, url, force=False):
+        if not self._confirmOverwrite(url, force):
+            return False
 
         hdulist.writeto(url)
 
+    def _fits_stream_imwrite(self, name, data, rgb_mode=True, header={},
+                             force=False):
+        """
+        Writes uncompressed FITS files with fitswriter, directly from
+        data and without building any HDUList.
+        """
+        fits_header = {'SWCREATE': str(paths.PROGRAM_NAME)}
+        fits_header.update(header)
+
+        if rgb_mode and (len(data.shape) == 3):
+            url = name+'-RGB.fits'
+            if not self._confirmOverwrite(url, force):
+                return False
+            log.log(repr(self),
+                    'Saving to '+url,
+                    level=logging.INFO)
+            fitswriter.writeRGB(url, data[..., 0:3], fits_header)
+        elif (len(data.shape) == 3):
+            for c, suffix in enumerate(('-R', '-G', '-B')):
+                url = name+suffix+'.fits'
+                if not self._confirmOverwrite(url, force):
+                    continue
+                log.log(repr(self),
+                        'Saving to '+url,
+                        level=logging.INFO)
+                fitswriter.writeImage(url, data[..., c], fits_header)
+        elif len(data.shape) <= 2:
+            url = name+'.fits'
+            if not self._confirmOverwrite(url, force):
+                return False
+            log.log(repr(self),
+                    'Saving to '+url,
+                    level=logging.INFO)
+            fitswriter.writeImage(url, data, fits_header)
+        else:
+            showErrorMsgBox("unsupported data format!",
+                            caller=self)
+            return False
+        return True
+
     def _imwrite_fits_(self, data, rgb_mode=True,
                        override_name=None, force_overwrite=False,
                        compressed=False, header={}, outbits=16,
@@ -1878,24 +2229,24 @@ class Frame(Qt.QObject):
 
             # make sure the SWCREATE is always lxnstack
             header['SWCREATE'] = str(paths.PROGRAM_NAME)
+
+        if not compressed:
+            return self._fits_stream_imwrite(name, data, rgb_mode,
+                                             header, force_overwrite)
+
         if rgb_mode and (len(data.shape) == 3):
             # NOTE: cannot compress primary HDU
             rgb_fname = name+'-RGB.fits'
             hdu = pyfits.PrimaryHDU(header=getFitsStdHeader())
 
-            if compressed:
-                hdu_r = pyfits.CompImageHDU(data[..., 0].copy(),
-                                            compression_type='RICE_1')
+            hdu_r = pyfits.CompImageHDU(data[..., 0].copy(),
+                                        compression_type='RICE_1')
 
-                hdu_g = pyfits.CompImageHDU(data[..., 1].copy(),
-                                            compression_type='RICE_1')
+            hdu_g = pyfits.CompImageHDU(data[..., 1].copy(),
+                                        compression_type='RICE_1')
 
-                hdu_b = pyfits.CompImageHDU(data[..., 2].copy(),
-                                             compression_type='RICE_1')
-            else:
-                hdu_r = pyfits.ImageHDU(data[..., 0].copy())
-                hdu_g = pyfits.ImageHDU(data[..., 1].copy())
-                hdu_b = pyfits.ImageHDU(data[..., 2].copy())
+            hdu_b = pyfits.CompImageHDU(data[..., 2].copy(),
+                                        compression_type='RICE_1')
 
             hdu_r.update_ext_name('RED')
             hdu_g.update_ext_name('GREN')
@@ -2042,6 +2393,40 @@ class Frame(Qt.QObject):
                 hdl = pyfits.HDUList([hdu])
             return hdl
 
+    def _imwrite_ser_(self, data, force_overwrite=False,
+                      override_name=None, **args):
+        if override_name is not None:
+            url = override_name
+        else:
+            url = self.url
+
+        if not self._confirmOverwrite(url, force_overwrite):
+            return False
+
+        color_id = None
+        if data.ndim == 2:
+            pattern = self.properties.get('BAYERPAT')
+            for key, val in serfile.BAYER_PATTERNS.items():
+                if val == pattern:
+                    color_id = key
+
+        timestamp = self.properties.get('UTCEPOCH')
+
+        try:
+            with serfile.SerWriter(
+                    url,
+                    observer=self.properties.get('OBSERVER', ''),
+                    instrument=self.properties.get('INSTRUME', ''),
+                    telescope=self.properties.get('TELESCOP', ''),
+                    color_id=color_id) as writer:
+                writer.addFrame(data, timestamp)
+        except Exception as exc:
+            log.log(repr(self),
+                    "Cannot save SER file: " + str(exc),
+                    level=logging.ERROR)
+            return False
+        return True
+
     def _imwrite_cv2_(self, data, flags=None, force_overwrite=False,
                       override_name=None, **args):
         if override_name is not None:
@@ -2118,7 +2503,7 @@ class Frame(Qt.QObject):
             If true the file will be overwritten without any confirmation.
 
         frmat: string [=None]
-            'fits', 'numpy', 'jpg', 'png'
+            'fits', 'numpy', 'jpg', 'png', 'ser'
 
         bits: integer [=None]
             8, 16, 32, 64
@@ -2324,6 +2709,14 @@ class Frame(Qt.QObject):
                             level=logging.WARNING)
         elif frmat == 'numpy':
             return np.save(filename, data.astype(dtype+str(bits)))
+        elif frmat == 'ser':
+            if bits == 16:
+                rawavg = normToUint16(data, False)
+            else:
+                rawavg = normToUint8(data, False)
+            return self._imwrite_ser_(rawavg,
+                                      force_overwrite,
+                                      override_name=filename)
         else:
             if bits == 8:
                 rawavg = normToUint8(data, False)
@@ -2344,6 +2737,17 @@ class Frame(Qt.QObject):
                                       override_name=filename)
 
 
+def getRawCacheTag(subtract_black=False):
+    """
+    Returns the tag of the decode cache keys of the CR2 data, that
+    depends on the subtraction of the black level.
+    """
+    if subtract_black:
+        return 'CR2-BLACK'
+    else:
+        return 'CR2'
+
+
 def getSupportedFormats():
     formats = {}
 
@@ -2362,6 +2766,98 @@ def getSupportedFormats():
     return formats
 
 
+def detectFileType(file_name):
+    """
+    Returns the format of a file guessed from its first bytes or None
+    if it is not recognized.
+    """
+    try:
+        with open(file_name, 'rb') as f:
+            head = f.read(16)
+    except (IOError, OSError):
+        return None
+
+    if head[0:4] in (b'II*\x00', b'MM\x00*'):
+        if head[8:10] == b'CR':
+            return 'CR2'
+        else:
+            return 'TIFF'
+
+    for magic, file_type in MAGIC_BYTES:
+        if head.startswith(magic):
+            return file_type
+
+    return None
+
+
+def getFileType(file_name, formats=None):
+    """
+    Returns the format of a file from its extension or, when the
+    extension is missing or unknown, from its first bytes. Returns
+    None if the format is not supported.
+    """
+    if formats is None:
+        formats = getSupportedFormats()
+
+    file_ext = os.path.splitext(file_name)[1].lower()
+    if file_ext in formats:
+        return formats[file_ext]
+
+    file_type = detectFileType(file_name)
+    if file_type in formats.values():
+        return file_type
+    else:
+        return None
+
+
+def probeFiles(file_list, **args):
+    """
+    Reads the headers of all the files in a pool of threads, so that
+    the Frames created later for these files do not need to open them.
+    Returns the list of the probes.ImageInfo of the files, None for the
+    files that cannot be probed.
+    """
+    formats = getSupportedFormats()
+    files = []
+    indexes = []
+    for i, fname in enumerate(file_list):
+        fname = str(fname)
+        if not os.path.isfile(fname):
+            continue
+        file_type = getFileType(fname, formats)
+        if file_type is not None:
+            files.append((fname, file_type))
+            indexes.append(i)
+
+    log.log("<lxnstack.utils module>",
+            "probing "+str(len(files))+" files",
+            level=logging.DEBUG)
+
+    infos = [None]*len(file_list)
+    for i, info in zip(indexes,
+                       probes.probeFiles(files,
+                                         args.get('rgb_fits_mode', False))):
+        infos[i] = info
+
+    return infos
+
+
+def _asArray(data, ftype=np.float32, copy=True):
+    """
+    Converts decoded data to an array of type ftype. Read-only data
+    (cached or memory-mapped) are always copied, while writable data
+    that are already of type ftype are returned as they are. If copy
+    is False the data are returned in their native type.
+    """
+    data = np.asarray(data)
+    if not copy:
+        return data
+    elif data.flags.writeable:
+        return data.astype(ftype, copy=False)
+    else:
+        return data.astype(ftype)
+
+
 def bgr2rgb(cv2img):
     if (len(cv2img.shape) == 3) and (cv2img.shape[2] == 3):
         return cv2img[..., (2, 1, 0)]
@@ -2478,6 +2974,43 @@ def getNeighboursAverage(array, x0, y0, raw_mode=False):
     return total1/count1
 
 
+def matchTemplate(image, template, x1=0, y1=0, x2=None, y2=None,
+                  method=cv2.TM_SQDIFF):
+    """
+    Searches the template inside the window image[y1:y2, x1:x2]
+    and returns the position (x, y) of the top-left corner of the
+    best match, relative to the top-left corner of the image.
+    The window is clipped to the image borders and None is returned
+    if the template does not fit inside it.
+    """
+    h, w = image.shape[0:2]
+    th, tw = template.shape[0:2]
+
+    if x2 is None:
+        x2 = w
+    if y2 is None:
+        y2 = h
+
+    x1 = max(int(x1), 0)
+    y1 = max(int(y1), 0)
+    x2 = min(int(x2), w)
+    y2 = min(int(y2), h)
+
+    if (x2-x1 < tw) or (y2-y1 < th):
+        return None
+
+    res = cv2.matchTemplate(image[y1:y2, x1:x2], template, method)
+    minmax = cv2.minMaxLoc(res)
+    del res
+
+    if method in (cv2.TM_SQDIFF, cv2.TM_SQDIFF_NORMED):
+        loc = minmax[2]
+    else:
+        loc = minmax[3]
+
+    return (loc[0]+x1, loc[1]+y1)
+
+
 def logpolar(input_img, wmul=1, hmul=1, clip=False):
     if clip:
         max_r = min(input_img.shape)/2
@@ -2577,6 +3110,200 @@ def register_image(ref, img, sharp1=2, sharp2=2,
     return (s0, shift, angle)
 
 
+def register_points(points, weights=None, reference=0, derotate=True,
+                    center=(0, 0), kappa=None, iterations=5):
+    """
+    register_points(points, weights, reference, derotate,
+                    center, kappa, iterations)
+
+    input:
+
+        points : an array of shape (N, P, 2) containing the
+                 (x, y) positions of P points in N frames.
+
+        weights : an optional array of P weights, one for
+                  each point.
+
+        reference : the index of the reference frame.
+
+        derotate : if False only the shift is computed.
+
+        center : the rotation center (x, y) of the frames.
+
+        kappa : if not None, the points whose rms residual
+                is greater than median+kappa*sigma are rejected
+                and the transformations are computed again.
+
+        iterations : the maximum number of rejection iterations.
+
+    output:
+
+        (offsets, angles, residuals, weights): offsets is an
+        (N, 2) array of frame offsets and angles is an array
+        of N angles in degrees, as used by Frame.setOffset and
+        Frame.setAngle. residuals is an (N, P) array with the
+        distance of each point from its fitted position and
+        weights are the final weights of the points (rejected
+        points have a null weight).
+
+    description:
+
+        for each frame the rotation R and the translation t
+        that best map the points of the reference frame onto
+        the points of the frame in a weighted least-squares
+        sense (Kabsch/Umeyama method without scaling) are
+        computed for all the frames at once.
+    """
+    pts = np.asarray(points, dtype=np.float64)
+    nfrm, npts = pts.shape[0:2]
+
+    if weights is None:
+        w = np.ones(npts)
+    else:
+        w = np.array(weights, dtype=np.float64)
+
+    ref = pts[reference]
+
+    if kappa is None:
+        iterations = 1
+
+    for i in range(max(int(iterations), 1)):
+        wsum = w.sum()
+
+        # weighted centroids
+        rbar = (ref*w[:, None]).sum(0)/wsum
+        pbar = (pts*w[None, :, None]).sum(1)/wsum
+
+        if derotate:
+            dr = ref - rbar
+            dp = pts - pbar[:, None, :]
+
+            dot = (w*(dr[..., 0]*dp[..., 0] + dr[..., 1]*dp[..., 1])).sum(1)
+            crs = (w*(dr[..., 0]*dp[..., 1] - dr[..., 1]*dp[..., 0])).sum(1)
+
+            del dr, dp
+
+            alpha = np.arctan2(crs, dot)
+        else:
+            alpha = np.zeros(nfrm)
+
+        cosa = np.cos(alpha)
+        sina = np.sin(alpha)
+
+        # t = pbar - R*rbar
+        tx = pbar[:, 0] - (cosa*rbar[0] - sina*rbar[1])
+        ty = pbar[:, 1] - (sina*rbar[0] + cosa*rbar[1])
+
+        fx = np.outer(cosa, ref[:, 0]) - np.outer(sina, ref[:, 1])
+        fy = np.outer(sina, ref[:, 0]) + np.outer(cosa, ref[:, 1])
+
+        residuals = np.hypot(pts[..., 0]-fx-tx[:, None],
+                             pts[..., 1]-fy-ty[:, None])
+        del fx, fy
+
+        if i == iterations-1:
+            break
+
+        good = w > 0
+
+        if good.sum() < 4:
+            # too few points for a meaningful statistic
+            break
+
+        rms = np.sqrt((residuals**2).mean(0))
+        clip = np.median(rms[good]) + kappa*rms[good].std()
+        bad = good & (rms > clip)
+
+        if not bad.any():
+            break
+
+        w[bad] = 0
+
+    # the position of a point in the frame is
+    #
+    #    x = R*(q + offset - center) + center = R*q + t
+    #
+    # so the offset is
+    #
+    #    offset = R^T*(t - center) + center
+
+    ux = tx - center[0]
+    uy = ty - center[1]
+
+    offsets = np.empty((nfrm, 2))
+    offsets[:, 0] = cosa*ux + sina*uy + center[0]
+    offsets[:, 1] = cosa*uy - sina*ux + center[1]
+
+    return (offsets, np.degrees(alpha), residuals, w)
+
+
+def transform_image(img, angle=0, offset=(0, 0), order=0, out=None):
+    """
+    transform_image(img, angle, offset, order, out)
+
+    input:
+
+        img : the image data, either a 2D array or a 3D array
+              whose last axis holds the color components.
+
+        angle : the rotation angle in degrees around the
+                center of the image.
+
+        offset : the (x, y) offset of the image, the same
+                 as Frame.offset.
+
+        order : the order of the spline interpolation.
+
+        out : an optional array, with the same shape of
+              img, where the result is written.
+
+    output:
+
+        the derotated and shifted image.
+
+    description:
+
+        this function is equivalent to a call to
+        sp.ndimage.interpolation.rotate followed by a call
+        to sp.ndimage.interpolation.shift, but the rotation
+        and the translation are combined in a single affine
+        transformation. In this way each component of the
+        image is resampled only once and no interpolation
+        is done along the color axis.
+    """
+    h, w = img.shape[0:2]
+
+    alpha = math.radians(angle)
+    cosa = math.cos(alpha)
+    sina = math.sin(alpha)
+
+    # NOTE: coordinates are in (row, column) order, the
+    #       matrix is the same used by ndimage.rotate
+    matrix = np.array([[cosa, sina],
+                       [-sina, cosa]])
+
+    center = np.array([(h-1)/2.0, (w-1)/2.0])
+    shift = np.array([offset[1], offset[0]], dtype=np.float64)
+
+    # input = matrix*(output + shift - center) + center
+    toffset = center + np.dot(matrix, shift - center)
+
+    if out is None:
+        out = np.empty_like(img)
+
+    if len(img.shape) == 2:
+        sp.ndimage.interpolation.affine_transform(
+            img, matrix, toffset, output=out,
+            order=order, mode='constant', cval=0.0)
+    else:
+        for c in range(img.shape[2]):
+            sp.ndimage.interpolation.affine_transform(
+                img[..., c], matrix, toffset, output=out[..., c],
+                order=order, mode='constant', cval=0.0)
+
+    return out
+
+
 def _derotate_mono(im1, im2, sharpening=2):
 
     f1 = _FFT_mono(im1)
@@ -3040,59 +3767,35 @@ def generateCosBell(w, h, roll_off=0.4):
 
 
 def _FFT_mono(img):
-
-    h, w = img.shape[0:2]
-
-    optimal_w = cv2.getOptimalDFTSize(w)
-    optimal_h = cv2.getOptimalDFTSize(h)
-
-    cmplx = np.zeros((optimal_h, optimal_w, 2))
-    cmplx[0:h, 0:w, 0] = img.real
-    cmplx[0:h, 0:w, 1] = img.imag
-
-    img_fft = cv2.dft(cmplx)
-
-    return img_fft[..., 0] + 1j*img_fft[..., 1]
+    return fftbackends.getBackend().fft(img)
 
 
 def _IFT_mono(fft):
-
-    imh, imw = fft.shape
-
-    cmplx = np.zeros((imh, imw, 2))
-    cmplx[..., 0] = fft.real
-    cmplx[..., 1] = fft.imag
-
-    img_ift = cv2.idft(cmplx)
-
-    return img_ift[..., 0]
+    return fftbackends.getBackend().ift(fft)
 
 
 def _FFT_RGB(img):
     if type(img) != np.ndarray:
         return False
 
-    result = []
-    for l in range(img.shape[2]):
-        result.append(_FFT_mono(img[..., l]))
+    backend = fftbackends.getBackend()
+
+    oh, ow = backend.getOptimalShape(img.shape)
+    final = np.empty((oh, ow, img.shape[2]), dtype=np.complex128)
 
-    final = np.ndarray((len(result[0]),
-                        len(result[0][0]),
-                        len(result)),
-                       dtype='complex128')
+    for l in range(img.shape[2]):
+        final[..., l] = backend.fft(img[..., l])
 
-    for i in range(len(result)):
-        final[..., i] = result[i]
     return final
 
 
 def _IFT_RGB(fft):
-    img = np.zeros_like(fft)
+    backend = fftbackends.getBackend()
 
-    for l in range(fft.shape[2]):
-        img[..., l] = _IFT_mono(fft[..., l])
+    rel = np.empty(fft.shape, dtype=np.float64)
 
-    rel = img.real
+    for l in range(fft.shape[2]):
+        rel[..., l] = backend.ift(fft[..., l])
 
     return rel  # ((rel-rel.min())*255/rel.max()).astype('uint8')
 
@@ -3111,40 +3814,26 @@ def ift(img):
         return _IFT_mono(img)
 
 
-def convolve(img, fltr, transformed=False):
-    # This function is a test for future de-blurring feature
-
+def _getTransformedPair(img, fltr, transformed=False):
     fmax = max(fltr.max(), -fltr.min())
-    i2 = fltr.astype('complex')/fmax
+    i2 = fltr/fmax
     # img = img.astype('float64')/img.max()
 
+    # NOTE: a 2D transform is broadcast over the components
+    #       of a 3D one instead of being copied for each of them
     if (len(img.shape) == 3) and (len(i2.shape) == 2):
         f1 = fft(img)
         if transformed:
-            f2m = i2
+            f2 = i2[..., np.newaxis]
         else:
-            f2m = fft(i2)
-        f2 = np.empty((f2m.shape[0],
-                       f2m.shape[1],
-                       f1.shape[2]),
-                      dtype=np.complex)
-
-        for i in range(f1.shape[2]):
-            f2[..., i] = f2m
+            f2 = fft(i2)[..., np.newaxis]
 
     elif (len(img.shape) == 2) and (len(i2.shape) == 3):
         if transformed:
             f2 = i2
         else:
             f2 = fft(i2)
-        f1m = fft(img)
-        f1 = np.empty((f1m.shape[0],
-                       f1m.shape[1],
-                       f2.shape[2]),
-                      dtype=np.complex)
-
-        for i in range(f2.shape[2]):
-            f1[..., i] = f1m
+        f1 = fft(img)[..., np.newaxis]
 
     elif (len(img.shape) == 3) and (i2.shape == img.shape):
         f1 = fft(img)
@@ -3154,63 +3843,39 @@ def convolve(img, fltr, transformed=False):
             f2 = fft(i2)
     else:
         raise ValueError("Cannot deconvolve the image with the given filter!")
-    del i2
-
-    rf = ift(f1*f2)
 
-    return rf
+    return (f1, f2)
 
 
-def deconvolve(img, fltr, transformed=False):
+def convolve(img, fltr, transformed=False):
     # This function is a test for future de-blurring feature
 
-    fmax = max(fltr.max(), -fltr.min())
-    i2 = fltr.astype(np.complex)/fmax
-    # img = img.astype('float64')/img.max()
+    f1, f2 = _getTransformedPair(img, fltr, transformed)
 
-    if (len(img.shape) == 3) and (len(i2.shape) == 2):
-        f1 = fft(img)
-        if transformed:
-            f2m = i2
-        else:
-            f2m = fft(i2)
-        f2 = np.empty((f2m.shape[0],
-                       f2m.shape[1],
-                       f1.shape[2]),
-                      dtype=np.complex)
+    # the product is computed in place to avoid a further allocation
+    if f1.shape == np.broadcast(f1, f2).shape:
+        f1 *= f2
+        rf = ift(f1)
+    else:
+        rf = ift(f1*f2)
 
-        for i in range(f1.shape[2]):
-            f2[..., i] = f2m
+    return rf
 
-    elif (len(img.shape) == 2) and (len(i2.shape) == 3):
-        if transformed:
-            f2 = i2
-        else:
-            f2 = fft(i2)
-        f1m = fft(img)
-        f1 = np.empty((f1m.shape[0],
-                       f1m.shape[1],
-                       f2.shape[2]),
-                      dtype=np.complex)
 
-        for i in range(f2.shape[2]):
-            f1[..., i] = f1m
+def deconvolve(img, fltr, transformed=False):
+    # This function is a test for future de-blurring feature
 
-    elif (len(img.shape) == 3) and (i2.shape == img.shape):
-        f1 = fft(img)
-        if transformed:
-            f2 = i2
-        else:
-            f2 = fft(i2)
-    else:
-        raise ValueError("Cannot deconvolve the image with the given filter!")
-    del i2
+    f1, f2 = _getTransformedPair(img, fltr, transformed)
 
     # This should avoid "division by 0" errors.
     # mask1 = (f1==0)
     # mask2 = (f2==0)
 
-    rf = ift((f1/(f2)))
+    if f1.shape == np.broadcast(f1, f2).shape:
+        f1 /= f2
+        rf = ift(f1)
+    else:
+        rf = ift(f1/f2)
 
     return rf
 
@@ -3291,6 +3956,9 @@ def storeTmpArray(array, tmpdir=None, compressed=False):
 
 
 def loadTmpArray(tmpfile):
+    if isinstance(tmpfile, fitsmap.FitsImageMap):
+        # image data are read directly from the source file
+        return tmpfile
     tmpfile.file.seek(0)
     if tmpfile.name[-1] == 'z':
         npzf = np.load(tmpfile.name)
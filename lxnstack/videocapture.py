@@ -17,6 +17,7 @@
 import os
 from . import paths
 import time
+import threading
 import subprocess
 import errno
 import ctypes
@@ -31,6 +32,8 @@ from PyQt5.QtWidgets import QLabel
 
 from . import translation as tr
 from . import utils
+from . import serfile
+from . import framering
 from . import videodev2 as v4l2
 from . import log
 import logging
@@ -42,6 +45,42 @@ def listVideoDevices():
     return vd_list
 
 
+class CapturedFrame(object):
+    # a frame returned by GenericVideoDevice.acquireFrame()
+
+    """
+    Image data of a captured frame, with its sequence number and
+    timestamp (in seconds).
+
+    The data may be a view onto a buffer owned by the device driver:
+    it is valid only until release() is called, after which it is set
+    to None. Copy it if it must outlive the frame.
+    """
+
+    def __init__(self, data, sequence, timestamp, device=None, index=None):
+        self.data = data
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.index = index
+        self._device = device
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def isReleased(self):
+        return self.data is None
+
+    def release(self):
+        if self._device is not None:
+            self._device.releaseFrame(self)
+            self._device = None
+        self.data = None
+
+
 class GenericVideoDevice(Qt.QObject):
     # Generic capture interface
     # (parent object of all video capture interfaces)
@@ -59,6 +98,7 @@ class GenericVideoDevice(Qt.QObject):
         self._info_ui = None
         self.lastframe = None
         self._locked = False
+        self._frame_sequence = 0
 
     def __del__(self):
         try:
@@ -113,6 +153,25 @@ class GenericVideoDevice(Qt.QObject):
     def getFrame(self):
         raise NotImplementedError()
 
+    def acquireFrame(self):
+        """
+        returns the next frame as a CapturedFrame, or None
+
+        The frame must be given back with its release() method.
+        This generic implementation wraps a copy returned by
+        getFrame(), devices that can hand out their own buffers
+        override it.
+        """
+        data = self.getFrame()
+        if not isinstance(data, np.ndarray):
+            return None
+        self._frame_sequence += 1
+        return CapturedFrame(data, self._frame_sequence, time.time())
+
+    def releaseFrame(self, frame):
+        frame.data = None
+        return True
+
     def getLastFrame(self):
         return self.lastframe
 
@@ -267,6 +326,10 @@ class V4l2VideoDevice(GenericVideoDevice):
     MEMORY_MMAP = 1
     MEMORY_USERPTR = 2
 
+    # minimum time in seconds between two refreshes of the last frame
+    # while the frames are handed out by acquireFrame()
+    LASTFRAME_INTERVAL = 0.1
+
     supported_pixel_formats = [v4l2.V4L2_PIX_FMT_RGB32,
                                v4l2.V4L2_PIX_FMT_RGB24,
                                v4l2.V4L2_PIX_FMT_BGR32,
@@ -281,6 +344,8 @@ class V4l2VideoDevice(GenericVideoDevice):
         self._io = None
         self._n_userp_buff = 4
         self._buffers = {}
+        self._held_buffers = {}
+        self._lastframe_time = 0
         self._timeout = 2.0
         self._format = None
         self._capture_capability = 0
@@ -1688,6 +1753,17 @@ class V4l2VideoDevice(GenericVideoDevice):
         return fmt
 
     def _uninit_device(self):
+        if self._held_buffers:
+            log.log(repr(self),
+                    "releasing {0:d} frames still in use".format(
+                        len(self._held_buffers)),
+                    level=logging.WARNING)
+            # the data of these frames will not be valid anymore
+            for buf, frame in self._held_buffers.values():
+                frame.data = None
+                frame._device = None
+            self._held_buffers = {}
+
         # deallocating/unmapping memory
         if self._io == self.MEMORY_READ:
             self._buffers.pop(0)
@@ -1696,7 +1772,7 @@ class V4l2VideoDevice(GenericVideoDevice):
                 return False
 
             if self._io == self.MEMORY_MMAP:
-                for i in self._buffers.keys():
+                for i in list(self._buffers.keys()):
                     if v4l2.HAS_LIBV4L2:
                         buf_start = self._buffers[i]['start']
                         buf_length = self._buffers[i]['length']
@@ -1711,7 +1787,7 @@ class V4l2VideoDevice(GenericVideoDevice):
                         self._buffers.pop(i)
 
             elif self._io == self.MEMORY_USERPTR:
-                for i in self._buffers.keys():
+                for i in list(self._buffers.keys()):
                     self._buffers.pop(i)
 
         self._buffers = {}
@@ -1945,12 +2021,47 @@ class V4l2VideoDevice(GenericVideoDevice):
         return True
 
     def getFrame(self):
+        ndframe = self._wait_frame(self.read_frame)
+        self.lastframe = ndframe
+        return ndframe
+
+    def acquireFrame(self):
+        """
+        dequeues the next frame without copying its data
+
+        The data of the returned frame is a view onto the driver
+        buffer, which is queued back only when the frame is released.
+        One buffer is always left to the driver, so None is returned
+        when all the other buffers are still in use.
+        """
+        if self._io == self.MEMORY_READ:
+            # the only buffer is overwritten at every read
+            return GenericVideoDevice.acquireFrame(self)
+        elif len(self._held_buffers) >= len(self._buffers) - 1:
+            log.log(repr(self),
+                    "all the capture buffers are in use",
+                    level=logging.WARNING)
+            return None
+        return self._wait_frame(self._acquire_buffer)
+
+    def releaseFrame(self, frame):
+        frame.data = None
+        if (frame.index is None or
+                frame.index not in self._held_buffers or
+                self._held_buffers[frame.index][1] is not frame):
+            return False
+        buf = self._held_buffers.pop(frame.index)[0]
+        return self._queue_buffer(buf)
+
+    def _wait_frame(self, reader):
+        # waits for the device and then calls reader() until
+        # it returns something different from None
         if not self.isOpened():
             return None
         elif not self.isStreaming():
             self._streamon()
 
-        ndframe = None
+        result = None
 
         maxiter = int(10.0/self._timeout)
 
@@ -1967,24 +2078,79 @@ class V4l2VideoDevice(GenericVideoDevice):
                     self._errno_exit("select")
                     return None
 
-            if (0 == r):
+            if not r[0]:
                 log.log(repr(self),
                         "select timeout",
                         level=logging.DEBUG)
                 return None
 
-            ndframe = self.read_frame()
-            if (ndframe is not None):
+            result = reader()
+            if (result is not None):
                 break
 
-        self.lastframe = ndframe
-        return ndframe
+        return result
 
-    def read_frame(self):
+    def _acquire_buffer(self):
+        buf = self._dequeue_buffer()
+        if buf is None:
+            return None
+
+        index = self._get_buffer_index(buf)
+        data = self._process_image(self._buffers[index], copy=False)
+        timestamp = buf.timestamp.secs + buf.timestamp.usecs*1e-6
+        frame = CapturedFrame(data, buf.sequence, timestamp, self, index)
+        self._held_buffers[index] = (buf, frame)
+
+        # keeping a copy for getLastFrame(), but not for every frame
+        now = time.time()
+        if now - self._lastframe_time >= self.LASTFRAME_INTERVAL:
+            self.lastframe = data.copy()
+            self._lastframe_time = now
+
+        return frame
+
+    def _dequeue_buffer(self):
         buf = v4l2.v4l2_buffer()
 
-        ndframe = None
+        # self._clear(buf)
+
+        buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        buf.memory = self._io
+
+        r, err = self._xioctl(v4l2.VIDIOC_DQBUF, buf)
+
+        if (-1 == r):
+            if err == errno.EAGAIN:
+                return None
+            elif err == errno.EIO:
+                # Could ignore EIO, see spec.
+                # fall through
+                pass
+            else:
+                self._errno_exit("READ:VIDIOC_DQBUF")
+                return None
+
+        assert(buf.index < len(self._buffers))
+
+        return buf
+
+    def _queue_buffer(self, buf):
+        if (-1 == self._xioctl(v4l2.VIDIOC_QBUF, buf)[0]):
+            self._errno_exit("READ:VIDIOC_QBUF")
+            return False
+        return True
+
+    def _get_buffer_index(self, buf):
+        if self._io == self.MEMORY_USERPTR:
+            for i in self._buffers.keys():
+                if (buf.m.userptr == self._buffers[i]['start'] and
+                        buf.length == self._buffers[i]['length']):
+                    return i
+            return -1
+        else:
+            return buf.index
 
+    def read_frame(self):
         if self._io == self.MEMORY_READ:
             r = v4l2.v4l2_read(self._fd,
                                self._buffers[0]['start'],
@@ -1999,80 +2165,56 @@ class V4l2VideoDevice(GenericVideoDevice):
                     self._errno_exit("read")
                     return None
 
-            ndframe = self._process_image(self._buffers[0])
+            return self._process_image(self._buffers[0])
 
-        elif self._io == self.MEMORY_MMAP:
-            # self._clear(buf)
-
-            buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-            buf.memory = self.MEMORY_MMAP
-
-            r, err = self._xioctl(v4l2.VIDIOC_DQBUF, buf)
-
-            if (-1 == r):
-                if err == errno.EAGAIN:
-                    return False
-                elif err == errno.EIO:
-                    # Could ignore EIO, see spec.
-                    # fall through
-                    pass
-                else:
-                    self._errno_exit("READ:MMAP:VIDIOC_DQBUF")
-                    return False
-
-            assert(buf.index < len(self._buffers))
-
-            ndframe = self._process_image(self._buffers[buf.index])
+        buf = self._dequeue_buffer()
+        if buf is None:
+            return False
 
-            if (-1 == self._xioctl(v4l2.VIDIOC_QBUF, buf)[0]):
-                self._errno_exit("READ:MMAP:VIDIOC_QBUF")
-                return False
-        elif self._io == self.MEMORY_USERPTR:
-            # self._clear(buf)
-            buf.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
-            buf.memory = self.MEMORY_USERPTR
+        index = self._get_buffer_index(buf)
+        ndframe = self._process_image(self._buffers[index])
 
-            r, err = self._xioctl(v4l2.VIDIOC_DQBUF, buf)
-            if (-1 == r):
-                if err == errno.EAGAIN:
-                    return False
-                elif err == errno.EIO:
-                    # Could ignore EIO, see spec.
-                    pass
-                else:
-                    self._errno_exit("READ:USERPTR:VIDIOC_DQBUF")
-                    return False
+        if not self._queue_buffer(buf):
+            return False
+        return ndframe
 
-            index = -1
-            for i in self._buffers.keys():
-                if (buf.m.userptr == self._buffers[i]['start'] and
-                        buf.length == self._buffers[i]['length']):
-                    index = i
-                    break
+    def _get_buffer_view(self, buf):
+        # a numpy array of bytes sharing the memory of the buffer
+        if 'view' not in buf:
+            if 'arr' in buf:
+                view = np.frombuffer(buf['arr'],
+                                     dtype=np.uint8,
+                                     count=buf['length'])
+            elif isinstance(buf['start'], mmap.mmap):
+                view = np.frombuffer(buf['start'],
+                                     dtype=np.uint8,
+                                     count=buf['length'])
+            else:
+                cbuf = ctypes.c_char * buf['length']
+                view = np.frombuffer(cbuf.from_address(buf['start']),
+                                     dtype=np.uint8)
+            buf['view'] = view
+        return buf['view']
 
-            ndframe = self._process_image(self._buffers[index])
-            if (-1 == self._xioctl(v4l2.VIDIOC_QBUF, buf)):
-                    self._errno_exit("READ:USERPTR:VIDIOC_QBUF")
-        return ndframe
+    def _process_image(self, buf, copy=True):
 
-    def _process_image(self, buf):
-        if v4l2.HAS_LIBV4L2:
-            bstart = buf['start']
-            blen = buf['length']
+        """
+        returns the content of the buffer 'buf' as a numpy array
 
-            sbuf = ctypes.create_string_buffer(blen)
-            if ctypes.memmove(sbuf, ctypes.c_void_p(bstart), blen) == 0:
-                self._errno_exit("PROCESSING:MEMMOVE")
-                return None
+        if 'copy' is False the array may share the memory of the
+        buffer, and it is valid only until the buffer is queued again
+        """
 
         w = self._format.pix.width
         h = self._format.pix.height
 
         try:
+            view = self._get_buffer_view(buf)
+
             if self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_RGB444:
                 rawarr = np.ndarray((h, w),
                                     dtype=np.uint16,
-                                    buffer=sbuf.raw,
+                                    buffer=view,
                                     order='C')
                 arr = np.ndarray((h, w, 3))
                 arr[..., 0] = rawarr & 0b0000111100000000
@@ -2082,37 +2224,37 @@ class V4l2VideoDevice(GenericVideoDevice):
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_RGB24:
                 arr = np.ndarray((h, w, 3),
                                  dtype=np.uint8,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
 
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_RGB32:
                 arr = np.ndarray((h, w, 4),
                                  dtype=np.uint8,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
 
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_BGR24:
                 arr = np.ndarray((h, w, 3),
                                  dtype=np.uint8,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
 
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_BGR32:
                 arr = np.ndarray((h, w, 4),
                                  dtype=np.uint8,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
 
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_GREY:
                 arr = np.ndarray((h, w),
                                  dtype=np.uint8,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
 
             elif self._format.pix.pixelformat == v4l2.V4L2_PIX_FMT_Y16:
                 arr = np.ndarray((h, w),
                                  dtype=np.uint16,
-                                 buffer=sbuf.raw,
+                                 buffer=view,
                                  order='C')
             else:
                 arr = np.random.random_integers(0, 100, (h, w))
@@ -2121,6 +2263,10 @@ class V4l2VideoDevice(GenericVideoDevice):
                     "frame processing error: \""+str(exc)+"\"",
                     level=logging.DEBUG)
             arr = np.random.random_integers(0, 100, (h, w))
+
+        if copy and not arr.flags.owndata:
+            # the buffer will be reused by the driver
+            arr = arr.copy()
         return arr
 
 
@@ -2629,6 +2775,9 @@ class CaptureJob(Qt.QObject):
     StatusActive = 2
     StatusWaiting = 3
 
+    # minimum time in seconds between two warnings about dropped frames
+    DROP_WARNING_INTERVAL = 10.0
+
     def __init__(self, destdir, name, deviceid=0, captype=1, parent=None):
         log.log(repr(self),
                 "Initializing video capture job \'"+str(name)+"\'",
@@ -2645,7 +2794,13 @@ class CaptureJob(Qt.QObject):
         self._parent = parent
         self._delay = 0
         self._output_file_type = "avi"
+        self._output_frames_type = "ser"
         self._capture_thread = None
+        self._ring_depth = framering.DEFAULT_DEPTH
+        self._writer_threads = 2
+        self._ring = None
+        self._counters_lock = threading.Lock()
+        self._resetCounters()
 
     def __del__(self):
         log.log(repr(self),
@@ -2687,6 +2842,27 @@ class CaptureJob(Qt.QObject):
     def getNumberOfFrames(self):
         return self._n_of_frames
 
+    def getRingDepth(self):
+        return self._ring_depth
+
+    def getWriterThreads(self):
+        return self._writer_threads
+
+    def getCapturedFrames(self):
+        return self._written_frames
+
+    def getDroppedFrames(self):
+        return self._dropped_frames
+
+    def getQueueDepth(self):
+        ring = self._ring
+        if ring is None:
+            return 0
+        return ring.getQueued()
+
+    def getMaxQueueDepth(self):
+        return self._max_queued
+
     def setDelay(self, val):
         self._delay = val
 
@@ -2702,6 +2878,15 @@ class CaptureJob(Qt.QObject):
     def setCaptureDevice(self, deviceid):
         self._device = deviceid
 
+    def setRingDepth(self, depth):
+        # number of frames that can wait to be written
+        self._ring_depth = max(int(depth), 1)
+
+    def setWriterThreads(self, n):
+        # used only when the frames are saved to separate files,
+        # video and SER files are written by a single thread
+        self._writer_threads = max(int(n), 1)
+
     def activate(self):
         self._status = self.StatusWaiting
 
@@ -2743,6 +2928,124 @@ class CaptureJob(Qt.QObject):
         self.stop()
         self._status = self.StatusInactive
 
+    def _resetCounters(self):
+        self._written_frames = 0
+        self._dropped_frames = 0
+        self._max_queued = 0
+
+    def _acquireFrame(self):
+        # the frame data is valid only inside the 'with' block
+        frame = self._device.acquireFrame()
+        if frame is None:
+            raise IOError("no frame received from the device")
+        return frame
+
+    def _logCounters(self, level=logging.INFO):
+        log.log(repr(self),
+                "job \'"+self.name+"\': " +
+                "{0:d} frames written, {1:d} dropped, ".format(
+                    self._written_frames, self._dropped_frames) +
+                "queue depth {0:d}/{1:d} (max {2:d})".format(
+                    self.getQueueDepth(), self._ring_depth,
+                    self._max_queued),
+                level=level)
+
+    def _captureFrames(self, ring):
+        # producer: dequeues the frames from the device and gives the
+        # buffers back as soon as the data is copied into the ring
+        number = 0
+        last_sequence = None
+        last_warning = 0
+        while (self._status == self.StatusInProgress and
+               not ring.isClosed()):
+            try:
+                frame = self._acquireFrame()
+            except Exception as exc:
+                log.log(repr(self),
+                        "An error has occured during " +
+                        "video capturing:\'"+str(exc)+"\'",
+                        level=logging.ERROR)
+                self._status = self.StatusError
+                break
+
+            with frame:
+                dropped = 0
+                if (last_sequence is not None and
+                        frame.sequence > last_sequence + 1):
+                    # the driver had no free buffer for these frames
+                    dropped += frame.sequence - last_sequence - 1
+                last_sequence = frame.sequence
+
+                if ring.push(frame.data, number, time.time()):
+                    number += 1
+                elif not ring.isClosed():
+                    dropped += 1
+
+            self._max_queued = ring.max_queued
+            if dropped:
+                with self._counters_lock:
+                    self._dropped_frames += dropped
+                now = time.time()
+                if now - last_warning >= self.DROP_WARNING_INTERVAL:
+                    self._logCounters(logging.WARNING)
+                    last_warning = now
+
+    def _writeFrames(self, ring, write):
+        # consumer: writes the frames queued in the ring
+        while True:
+            item = ring.pop()
+            if item is None:
+                break
+            idx, data, number, timestamp = item
+            try:
+                write(data, number, timestamp)
+            except Exception as exc:
+                log.log(repr(self),
+                        "An error has occured while writing " +
+                        "frame {0:d}:\'".format(number)+str(exc)+"\'",
+                        level=logging.ERROR)
+                self._status = self.StatusError
+                ring.free(idx)
+                ring.close()
+                break
+            ring.free(idx)
+            with self._counters_lock:
+                self._written_frames += 1
+
+    def _runPipeline(self, write, writers=1):
+
+        """
+        captures frames until the job is stopped
+
+        The frames are copied by this thread into a ring buffer and
+        write(data, number, timestamp) is called by 'writers' other
+        threads, so that a slow disk does not stall the device.
+        """
+
+        ring = framering.FrameRing(self._ring_depth)
+        self._resetCounters()
+        self._ring = ring
+
+        threads = []
+        for i in range(writers):
+            thread = threading.Thread(target=self._writeFrames,
+                                      args=(ring, write),
+                                      name="capture writer {0:d}".format(i))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        self._captureFrames(ring)
+
+        # the frames left in the ring are still written
+        ring.close()
+        for thread in threads:
+            thread.join()
+
+        self._max_queued = ring.max_queued
+        self._logCounters()
+        self._ring = None
+
     def __threaded_video_capturing(self):
 
         device_is_closed = not self._device.isOpened()
@@ -2753,7 +3056,6 @@ class CaptureJob(Qt.QObject):
 
         # requesting the exclusive use of the device
         if self._device.requestLock():
-            captured_frames = 0
 
             if self.type == self.TypeVideo:
                 hexcnt = 0
@@ -2788,18 +3090,10 @@ class CaptureJob(Qt.QObject):
 
                 video_writer = cv2.VideoWriter(file_name, fcc, fps, sze)
                 if video_writer.isOpened():
-                    while(self._status == self.StatusInProgress):
-                        try:
-                            video_writer.write(
-                                self._device.getFrame()[..., (2, 1, 0)])
-                        except Exception as exc:
-                            log.log(repr(self),
-                                    "An error has occured during " +
-                                    "video capturing:\'"+str(exc)+"\'",
-                                    level=logging.ERROR)
-                            self._status = self.StatusError
-                            break
-                        captured_frames += 1
+                    def write(data, number, timestamp):
+                        video_writer.write(data[..., (2, 1, 0)])
+
+                    self._runPipeline(write)
                     video_writer.release()
                 else:
                     log.log(repr(self),
@@ -2807,6 +3101,44 @@ class CaptureJob(Qt.QObject):
                             level=logging.ERROR)
                     self._status = self.StatusError
 
+            elif (self.type == self.TypeFrames and
+                  self._output_frames_type == 'ser'):
+                # all the frames are appended to a single SER file
+                hexcnt = 0
+                file_name = os.path.join(self.getDestinationDir(),
+                                         str(self.name) +
+                                         "-{0:04x}.ser".format(hexcnt))
+
+                # checking if the file already exists
+                while os.path.exists(file_name):
+                    hexcnt += 1
+                    file_name = os.path.join(self.getDestinationDir(),
+                                             str(self.name) +
+                                             "-{0:04x}.ser".format(hexcnt))
+
+                log.log(repr(self),
+                        "Opening sequence file '"+file_name+"'",
+                        level=logging.INFO)
+
+                try:
+                    ser_writer = serfile.SerWriter(file_name)
+                except Exception as exc:
+                    log.log(repr(self),
+                            "Cannot write to the file '"+file_name +
+                            "':'"+str(exc)+"'",
+                            level=logging.ERROR)
+                    self._status = self.StatusError
+                    ser_writer = None
+
+                if ser_writer is not None:
+                    def write(data, number, timestamp):
+                        ser_writer.addFrame(data, timestamp)
+                        if (number + 1) % 100 == 0:
+                            ser_writer.flush()
+
+                    self._runPipeline(write)
+                    ser_writer.close()
+
             elif self.type == self.TypeFrames:
                 hexcnt = 0
                 dir_name = os.path.join(
@@ -2829,24 +3161,18 @@ class CaptureJob(Qt.QObject):
                             level=logging.ERROR)
                     self._status = self.StatusError
 
-                while (self._status == self.StatusInProgress):
-                    file_name = os.path.join(dir_name,
-                                             "{0:08x}".format(captured_frames))
-                    frm = utils.Frame(file_name)
-                    try:
-                        frm.saveData(data=self._device.getFrame(),
+                if self._status == self.StatusInProgress:
+                    def write(data, number, timestamp):
+                        file_name = os.path.join(dir_name,
+                                                 "{0:08x}".format(number))
+                        frm = utils.Frame(file_name)
+                        frm.saveData(data=data,
                                      force_overwrite=True,
                                      save_dlg=False,
                                      frmat='fits',
                                      bits='16')
-                    except Exception as exc:
-                        log.log(repr(self),
-                                "An error has occured during " +
-                                "image capturing:\'"+str(exc)+"\'",
-                                level=logging.ERROR)
-                        self._status = self.StatusError
-                        break
-                    captured_frames += 1
+
+                    self._runPipeline(write, self._writer_threads)
             else:
                 pass
         else:
@@ -3390,12 +3716,21 @@ class CaptureScheduler(Qt.QObject):
                     # Job is active and capturing is completed
                     joblistwidgetitem.setBackground(QtCore.Qt.green)
                     status_txt = tr.tr("Completed")
+                    status_txt += " ({0:d} ".format(job.getCapturedFrames())
+                    status_txt += tr.tr("frames")
+                    status_txt += ", {0:d} ".format(job.getDroppedFrames())
+                    status_txt += tr.tr("dropped")+")"
                 elif status == CaptureJob.StatusInProgress:
                     # Job is active and capturing is in progress
                     joblistwidgetitem.setBackground(QtCore.Qt.yellow)
                     count = (utils.getCurrentTimeMsec()-job.getStartTime())
                     status_txt = tr.tr("In progress")
                     status_txt += " {0:0.02f}sec".format(count/1000.0)
+                    status_txt += "  "+tr.tr("queue")
+                    status_txt += " {0:d}/{1:d}  ".format(
+                        job.getQueueDepth(), job.getRingDepth())
+                    status_txt += tr.tr("dropped")
+                    status_txt += " {0:d}".format(job.getDroppedFrames())
                     if job._end_type == 2:
                         if job.getNumberOfFrames() < 0:
                             # this means that the job will
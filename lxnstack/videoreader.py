@@ -0,0 +1,193 @@
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Shared sequential readers for the frames of video files
+
+import os
+import logging
+import threading
+import collections
+
+import cv2
+
+from . import log
+
+DEFAULT_LOOKAHEAD = 8
+MAX_OPEN_READERS = 4
+
+_readers = collections.OrderedDict()
+_readers_lock = threading.Lock()
+
+
+class VideoReader(object):
+
+    """
+    Sequential reader of the frames of a video file.
+
+    The reader keeps a cursor on the next frame to be decoded, so that
+    reading the frames in order decodes each of them only once, and a
+    small buffer with the last decoded frames. Frames that are skipped
+    by short forward jumps are decoded into the buffer as well, while
+    a seek is performed only for backward or long forward jumps.
+
+    Frames are returned as RGB arrays.
+    """
+
+    def __init__(self, file_name, lookahead=DEFAULT_LOOKAHEAD):
+        self.url = str(file_name)
+        self.lookahead = max(int(lookahead), 1)
+        self._lock = threading.RLock()
+        self._buffer = collections.OrderedDict()
+        self._video = None
+        self._pos = 0
+        self.stamp = _getStamp(self.url)
+        self.decoded_frames = 0
+        self.seeks = 0
+        self.open()
+
+    def open(self):
+        with self._lock:
+            self.close()
+            self._video = cv2.VideoCapture(self.url)
+            self._pos = 0
+            self.total_frames = int(
+                self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.fps = self._video.get(cv2.CAP_PROP_FPS)
+
+            # NOTE: the first frame is used to check that the file
+            #       can be decoded and to get the frame size
+            frame = self._readNext()
+            if frame is None:
+                self.is_good = False
+                self.width = None
+                self.height = None
+            else:
+                self.is_good = True
+                self.height, self.width = frame[0].shape[0:2]
+
+    def close(self):
+        with self._lock:
+            if self._video is not None:
+                self._video.release()
+                self._video = None
+            self._buffer.clear()
+
+    def __len__(self):
+        return max(self.total_frames, 0)
+
+    def _readNext(self):
+        msec = self._video.get(cv2.CAP_PROP_POS_MSEC)
+        s, img = self._video.read()
+        if not s:
+            return None
+
+        self.decoded_frames += 1
+
+        if (len(img.shape) == 3) and (img.shape[2] == 3):
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        # buffered frames are shared among all the callers
+        img.flags.writeable = False
+        frame = (img, msec/1000.0)
+        self._buffer[self._pos] = frame
+        self._pos += 1
+
+        while len(self._buffer) > self.lookahead:
+            self._buffer.popitem(last=False)
+
+        return frame
+
+    def read(self, page):
+        """
+        Returns the tuple (data, time_offset) of the requested frame,
+        where time_offset is the position of the frame in seconds, or
+        None if the frame cannot be read.
+        """
+        with self._lock:
+            if self._video is None:
+                return None
+
+            if page in self._buffer:
+                return self._buffer[page]
+
+            if page < self._pos or page > self._pos + self.lookahead:
+                log.log(repr(self),
+                        "seeking frame "+str(page)+" of "+self.url,
+                        level=logging.DEBUG)
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, page)
+                self._pos = page
+                self.seeks += 1
+
+            frame = None
+            while self._pos <= page:
+                frame = self._readNext()
+                if frame is None:
+                    return None
+            return frame
+
+    def iterFrames(self, start=0, stop=None, step=1):
+        """
+        Yields the tuples (page, data, time_offset) of the frames
+        in the range [start, stop).
+        """
+        if stop is None or stop > len(self):
+            stop = len(self)
+
+        for page in range(start, stop, step):
+            frame = self.read(page)
+            if frame is None:
+                break
+            yield (page,)+frame
+
+
+def _getStamp(url):
+    try:
+        st = os.stat(url)
+        return (st.st_size, st.st_mtime)
+    except OSError:
+        return None
+
+
+def getReader(file_name):
+    """
+    Returns the shared reader of a video file, only the last
+    MAX_OPEN_READERS readers are kept open.
+    """
+    file_name = str(file_name)
+    with _readers_lock:
+        reader = _readers.pop(file_name, None)
+        if reader is None or reader.stamp != _getStamp(file_name):
+            if reader is not None:
+                reader.close()
+            reader = VideoReader(file_name)
+
+        _readers[file_name] = reader
+
+        while len(_readers) > MAX_OPEN_READERS:
+            _readers.popitem(last=False)[1].close()
+
+        return reader
+
+
+def iterFrames(file_name, start=0, stop=None, step=1):
+    return getReader(file_name).iterFrames(start, stop, step)
+
+
+def closeAll():
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.close()
+        _readers.clear()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+
+# lxnstack is a program to align and stack atronomical images
+# Copyright (C) 2013-2015  Maurizio D'Addona <mauritiusdadd@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Conformance tests and benchmark of the CR2 decoder.
+#
+# Synthetic CR2 files are written with random huffman tables, 2 or 4
+# components, several slice layouts and predictors, both the byte
+# orders and known pixel values. Each file is decoded by the
+# lxnstack.cr2plugin module found in the source tree and the result
+# is compared bit by bit with the original data, then the decoding
+# throughput is reported in MPix/s. The exit status is 1 if any file
+# is not decoded correctly.
+#
+# usage: cr2-benchmark.py [--size WIDTHxHEIGHT] [--repeat N] [--seed N]
+#                         [--all-predictors] [--quick]
+
+import sys
+import os
+import time
+import struct
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+
+# using the modules of the source tree rather than the installed ones
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from lxnstack import cr2plugin  # noqa: E402
+
+MAX_CODE_LEN = 16
+NUM_SYMBOLS = 17  # the categories of the differences, from 0 to 16
+
+# size of the blocks of pixels packed at once by the encoder
+ENCODER_BLOCK_SIZE = 256*1024
+
+# (left, top, right, bottom) borders of the synthetic sensors
+BORDERS = (8, 4, 4, 2)
+
+
+def makeHuffmanTable(rng):
+    """
+    Returns the code counts for each length and the list of the
+    symbols of a random huffman table that can encode all the
+    categories. The sum of the Kraft inequality is kept below 1 so
+    that no code is made only of ones.
+    """
+    lengths = [MAX_CODE_LEN] * NUM_SYMBOLS
+    for i in range(rng.integers(20, 200)):
+        sym = rng.integers(NUM_SYMBOLS)
+        if lengths[sym] == 1:
+            continue
+        lengths[sym] -= 1
+        if sum(2.0**-n for n in lengths) >= 1:
+            lengths[sym] += 1
+
+    order = rng.permutation(NUM_SYMBOLS)
+    symbols = sorted(order, key=lambda s: lengths[s])
+    counts = [0] * MAX_CODE_LEN
+    for sym in symbols:
+        counts[lengths[sym] - 1] += 1
+    return counts, [int(s) for s in symbols]
+
+
+def getHuffmanCodes(counts, symbols):
+    """
+    Returns the arrays of the codes and of their lengths indexed by
+    symbol, the codes are assigned as in the annex C of the JPEG
+    specifications.
+    """
+    codes = np.zeros(NUM_SYMBOLS, dtype=np.int64)
+    lengths = np.zeros(NUM_SYMBOLS, dtype=np.int64)
+    code = 0
+    k = 0
+    for length in range(1, MAX_CODE_LEN + 1):
+        for i in range(counts[length - 1]):
+            codes[symbols[k]] = code
+            lengths[symbols[k]] = length
+            code += 1
+            k += 1
+        code <<= 1
+    return codes, lengths
+
+
+def makeImage(rng, width, height, bits):
+    """
+    Returns a noisy sky with a gradient, some stars and some pixels
+    at the limits of the range, that produce the largest differences.
+    """
+    maxval = (1 << bits) - 1
+    y, x = np.mgrid[0:height, 0:width]
+    sky = maxval/16.0 + (maxval/64.0)*(x/float(width) + y/float(height))
+    sky += rng.normal(0, maxval/256.0, (height, width))
+
+    for i in range(20):
+        sx, sy = rng.uniform(0, width), rng.uniform(0, height)
+        amp = rng.uniform(0.1, 1.0)*maxval
+        sky += amp*np.exp(-((x - sx)**2 + (y - sy)**2)/8.0)
+
+    image = sky.clip(0, maxval).astype(np.uint16)
+    image.flat[rng.integers(0, image.size, 64)] = 0
+    image.flat[rng.integers(0, image.size, 64)] = maxval
+    return image
+
+
+def getPredictions(encoded, components, psv, bits):
+    """
+    Returns the values predicted for each pixel of the image as seen
+    by the lossless JPEG encoder.
+    """
+    height, width = encoded.shape
+    planes = encoded.astype(np.int64).reshape((height, -1, components))
+    pred = np.empty_like(planes)
+
+    left = planes[:, :-1]
+    top = planes[:-1, 1:]
+    topleft = planes[:-1, :-1]
+    cur_left = planes[1:, :-1]
+
+    if psv == 1:
+        inner = cur_left
+    elif psv == 2:
+        inner = top
+    elif psv == 3:
+        inner = topleft
+    elif psv == 4:
+        inner = cur_left + top - topleft
+    elif psv == 5:
+        inner = cur_left + ((top - topleft) >> 1)
+    elif psv == 6:
+        inner = top + ((cur_left - topleft) >> 1)
+    elif psv == 7:
+        inner = (top + cur_left) >> 1
+    else:
+        raise ValueError("invalid predictor "+str(psv))
+
+    pred[1:, 1:] = inner
+    pred[0, 1:] = left[0]
+    pred[1:, 0] = planes[:-1, 0]
+    pred[0, 0] = 1 << (bits - 1)
+
+    return pred.reshape((height, width))
+
+
+def packBits(values, lengths):
+    """
+    Returns the bytes of the concatenation of the lowest lengths[i]
+    bits of each values[i], padded with ones.
+    """
+    chunks = []
+    shifts = np.arange(32)
+    for start in range(0, len(values), ENCODER_BLOCK_SIZE):
+        end = start + ENCODER_BLOCK_SIZE
+        val = values[start:end].astype('>u4').view(np.uint8)
+        bits = np.unpackbits(val).reshape((-1, 32))
+        mask = shifts >= (32 - lengths[start:end])[:, np.newaxis]
+        chunks.append(bits[mask])
+
+    stream = np.concatenate(chunks)
+    pad = -len(stream) % 8
+    stream = np.concatenate((stream, np.ones(pad, dtype=np.uint8)))
+    return np.packbits(stream).tobytes()
+
+
+def encodeLosslessJpeg(encoded, components, bits, psv, tables, indexes):
+    """
+    Returns a lossless JPEG stream of encoded, which is the image as
+    seen by the encoder, with the components interleaved along the
+    rows. tables is a dictionary of huffman tables and indexes the
+    table used by each component.
+    """
+    height, width = encoded.shape
+    pred = getPredictions(encoded, components, psv, bits)
+
+    # differences modulo 2**16 in the range [-32767, 32768]
+    diffs = ((encoded.astype(np.int64) - pred + 32767) & 0xffff) - 32767
+    diffs = diffs.ravel()
+    cats = np.frexp(np.abs(diffs).astype(np.float64))[1].astype(np.int64)
+
+    comp = np.tile(np.arange(width) % components, height)
+    all_codes = np.empty((components, NUM_SYMBOLS), dtype=np.int64)
+    all_lengths = np.empty((components, NUM_SYMBOLS), dtype=np.int64)
+    for c in range(components):
+        all_codes[c], all_lengths[c] = getHuffmanCodes(*tables[indexes[c]])
+
+    # no additional bits are written for the category 16
+    extra_lengths = np.where(cats < 16, cats, 0)
+    extra = np.where(diffs > 0, diffs, diffs + (1 << extra_lengths) - 1)
+    extra &= (1 << extra_lengths) - 1
+    values = (all_codes[comp, cats] << extra_lengths) | extra
+    lengths = all_lengths[comp, cats] + extra_lengths
+
+    data = packBits(values, lengths).replace(b'\xff', b'\xff\x00')
+
+    dht = b''
+    for index, (counts, symbols) in sorted(tables.items()):
+        dht += bytes([index]) + bytes(counts) + bytes(symbols)
+
+    sof = struct.pack('>BHHB', bits, height, width // components, components)
+    sos = struct.pack('>B', components)
+    for c in range(components):
+        sof += struct.pack('>BBB', c + 1, 0x11, 0)
+        sos += struct.pack('>BB', c + 1, indexes[c] << 4)
+    sos += struct.pack('>BBB', psv, 0, 0)
+
+    stream = cr2plugin.StartOfImageMarker
+    for marker, body in ((cr2plugin.DhtMarker, dht),
+                         (cr2plugin.StartOfFrameMarker, sof),
+                         (cr2plugin.StartOfScanMarker, sos)):
+        stream += marker + struct.pack('>H', len(body) + 2) + body
+    return stream + data + cr2plugin.EndOfImageMarker
+
+
+def shuffleSlices(raw, slices):
+    """
+    Returns the image as seen by the encoder: the vertical slices of
+    the raw image are stored one after the other.
+    """
+    height, width = raw.shape
+    if not slices[0]:
+        return raw
+    widths = [slices[1]] * slices[0] + [slices[2]]
+    flat = []
+    start = 0
+    for w in widths:
+        flat.append(raw[:, start:start + w].ravel())
+        start += w
+    return np.concatenate(flat).reshape((height, width))
+
+
+def makeIfd(endian, entries, offset):
+    """
+    Returns the bytes of an IFD starting at offset, followed by the
+    values that do not fit in the entries. entries is a list of
+    (tag, type, count, packed value) tuples.
+    """
+    size = 2 + 12*len(entries) + 4
+    body = struct.pack(endian+'H', len(entries))
+    extra = b''
+    for tag, tag_type, count, value in entries:
+        body += struct.pack(endian+'HHI', tag, tag_type, count)
+        if len(value) <= 4:
+            body += value.ljust(4, b'\x00')
+        else:
+            body += struct.pack(endian+'I', offset + size + len(extra))
+            extra += value + b'\x00'*(len(value) % 2)
+    return body + struct.pack(endian+'I', 0) + extra
+
+
+def writeCR2(fname, raw, components, bits, psv, slices, byteorder, rng):
+    """
+    Writes a minimal CR2 file with the raw data of the sensor.
+    """
+    endian = '<' if byteorder == b'II' else '>'
+    height, width = raw.shape
+    left, top, right, bottom = BORDERS
+
+    ntables = min(components, 2)
+    tables = dict((i, makeHuffmanTable(rng)) for i in range(ntables))
+    indexes = [c % ntables for c in range(components)]
+    jpeg = encodeLosslessJpeg(shuffleSlices(raw, slices), components,
+                              bits, psv, tables, indexes)
+
+    sensor = struct.pack(endian+'17H', 34, width, height, 0, 0,
+                         left, top, width - right, height - bottom,
+                         0, 0, 0, 0, 0, 0, 0, 0)
+
+    def layout(offset):
+        ifds = []
+        for make in (
+                lambda o: [(cr2plugin.Make, 2, 6, b'Canon\x00'),
+                           (cr2plugin.EXIF, 4, 1,
+                            struct.pack(endian+'I', o[1]))],
+                lambda o: [(cr2plugin.Makernote, 7, o[3] - o[2],
+                            struct.pack(endian+'I', o[2]))],
+                lambda o: [(cr2plugin.SensorInfo, 3, 17, sensor)],
+                lambda o: [(cr2plugin.StripOffset, 4, 1,
+                            struct.pack(endian+'I', o[4])),
+                           (cr2plugin.StripBytesCount, 4, 1,
+                            struct.pack(endian+'I', len(jpeg)))] +
+                ([(cr2plugin.CR2Slice, 3, 3,
+                   struct.pack(endian+'3H', *slices))]
+                 if slices[0] else [])):
+            ifds.append(make(offset))
+        return ifds
+
+    # the offsets of IFD0, EXIF, makernotes, IFD3 and of the raw data
+    # are computed first with dummy values, the sizes do not change
+    offsets = [0x10, 0, 0, 0, 0]
+    for i in range(2):
+        pos = 0x10
+        blocks = []
+        for n, entries in enumerate(layout(offsets)):
+            offsets[n] = pos
+            blocks.append(makeIfd(endian, entries, pos))
+            pos += len(blocks[-1])
+        offsets[4] = pos
+
+    header = (byteorder + struct.pack(endian+'HI', 42, offsets[0]) +
+              b'CR' + bytes([2, 0]) + struct.pack(endian+'I', offsets[3]))
+
+    with open(fname, 'wb') as f:
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+        f.write(jpeg)
+
+
+def runCase(fname, rng, width, height, components, bits, psv, slices,
+            byteorder, repeat):
+    """
+    Writes and decodes a synthetic file, returns a tuple with the
+    result of the check and the throughput in MPix/s.
+    """
+    raw = makeImage(rng, width, height, bits)
+    writeCR2(fname, raw, components, bits, psv, slices, byteorder, rng)
+
+    left, top, right, bottom = BORDERS
+    expected = raw[top:height - bottom, left:width - right]
+
+    best = None
+    for i in range(repeat):
+        cr2file = cr2plugin.imread(fname)
+        start = time.time()
+        image = cr2file.load()
+        elapsed = time.time() - start
+        checkpoints = cr2file.checkpoints
+        cr2file.close()
+        best = elapsed if best is None else min(best, elapsed)
+
+        if image is None or image.shape != expected.shape:
+            return ("wrong shape", 0)
+        errors = np.count_nonzero(image != expected)
+        if errors:
+            return ("{0} wrong pixels".format(errors), 0)
+
+    # partial decoding of some random regions
+    boxes = []
+    for i in range(4):
+        x0 = int(rng.integers(0, expected.shape[1] - 16))
+        y0 = int(rng.integers(0, expected.shape[0] - 16))
+        boxes.append((x0, y0, x0 + 16, y0 + 16))
+
+    cr2file = cr2plugin.imread(fname)
+    partial = cr2file.loadRegions(boxes, checkpoints)
+    cr2file.close()
+    for x0, y0, x1, y1 in boxes:
+        if not np.array_equal(partial[y0:y1, x0:x1],
+                              expected[y0:y1, x0:x1]):
+            return ("wrong regions", 0)
+
+    return ("OK", width*height/best/1.0e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Conformance tests and benchmark of the CR2 decoder")
+    parser.add_argument('--size', default='1024x680',
+                        help="size of the synthetic sensors, WIDTHxHEIGHT")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="decodings of each file, the fastest is used")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the random data and tables")
+    parser.add_argument('--all-predictors', action='store_true',
+                        help="test also the predictors not used by Canon")
+    parser.add_argument('--quick', action='store_true',
+                        help="test only a few small files")
+    args = parser.parse_args()
+
+    width, height = [int(v) for v in args.size.lower().split('x')]
+    if args.quick:
+        width, height = min(width, 256), min(height, 128)
+        args.repeat = 1
+
+    rng = np.random.default_rng(args.seed)
+
+    # the slice layouts (slices, slice width, last slice width) are
+    # computed for each number of components, since the slices of
+    # the real files are multiple of the number of components
+    cases = []
+    predictors = range(1, 8) if args.all_predictors else (1,)
+    for components in (2, 4):
+        w = width - width % (4*components)
+        s1 = (w // 3) - (w // 3) % components
+        s2 = (w // 4) - (w // 4) % components
+        layouts = [(0, 0, 0), (1, s1, w - s1), (3, s2, w - 3*s2)]
+        if args.quick:
+            layouts = layouts[::2]
+        for slices, psv in itertools.product(layouts, predictors):
+            cases.append((w, components, slices, psv))
+
+    failed = 0
+    tmpdir = tempfile.mkdtemp(prefix='lxnstack-cr2-')
+    fname = os.path.join(tmpdir, 'synthetic.cr2')
+    try:
+        for n, (w, components, slices, psv) in enumerate(cases):
+            bits = (14, 12)[n % 2]
+            byteorder = (b'II', b'MM')[(n // 2) % 2]
+            result, speed = runCase(fname, rng, w, height, components, bits,
+                                    psv, slices, byteorder, args.repeat)
+            if result != "OK":
+                failed += 1
+            print("{0}x{1} components={2} bits={3} psv={4} {5} "
+                  "slices={6}: {7} {8:.2f} MPix/s".format(
+                      w, height, components, bits, psv,
+                      byteorder.decode('ascii'), slices, result, speed))
+    finally:
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rmdir(tmpdir)
+
+    print("{0} of {1} files decoded correctly".format(len(cases) - failed,
+                                                       len(cases)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())